@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+import os
+import csv
+import gc
+import sys
+import json
+import glob
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+# pdf_ocr zuerst importieren, damit dessen Logging-Format gilt
+import pdf_ocr
+import extract_songs
+import update_lyrics
+import song_export
+from ocr_pages import iter_ocr_file
+
+logger = logging.getLogger('PIPELINE_BENCHMARK')
+
+DEV_DIR = os.path.dirname(os.path.abspath(__file__))
+EXTRACTED_DIR = os.path.join(DEV_DIR, "extracted")
+DATA_CSV = os.path.join(DEV_DIR, "data.csv")
+
+# Format der Ergebnisdatei, damit spätere Läufe vergleichbar bleiben
+RESULTS_FORMAT = "pipeline-benchmark-1"
+
+# Seitentext der copy-ten Kopie: die erste Textzeile endet auf copy Leerzeichen.
+# Bereinigung und Segmentierung ergeben dasselbe, aber die Seite kommt nicht aus
+# dem Bereinigungs-Cache (eine zusätzliche Zeile könnte dagegen eine Songüberschrift
+# am Seitenwechsel trennen)
+def mark_copy(text: str, copy: int) -> str:
+    start = len(text) - len(text.lstrip())
+    end = text.find("\n", start)
+    if end < 0:
+        end = len(text)
+    return text[:end] + " " * copy + text[end:]
+
+# Synthetisches Korpus: jedes Buch und data.csv scale-mal hintereinander, die
+# Kopien bekommen neue Seitenzahlen (und in data.csv eindeutige Titel)
+def build_scaled_corpus(scale: int, target_dir: str, extracted_dir: str = EXTRACTED_DIR,
+                        csv_file: str = DATA_CSV) -> Tuple[str, str]:
+    os.makedirs(target_dir, exist_ok=True)
+    page_counts = {}
+    for text_file in sorted(glob.glob(os.path.join(extracted_dir, "Das Ding *.txt"))):
+        pages = list(iter_ocr_file(text_file))
+        last_page = max((page for page, _ in pages), default=0)
+        book_name = os.path.splitext(os.path.basename(text_file))[0]
+        page_counts[update_lyrics.BOOK_MAPPING.get(book_name)] = last_page
+        with open(os.path.join(target_dir, os.path.basename(text_file)), 'w', encoding='utf-8') as f:
+            for copy in range(scale):
+                for page, text in pages:
+                    f.write(f"[Seite {page + copy * last_page}]{mark_copy(text, copy)}")
+
+    scaled_csv = os.path.join(target_dir, "data.csv")
+    with open(csv_file, 'r', encoding='utf-8', newline='') as source, \
+            open(scaled_csv, 'w', encoding='utf-8', newline='') as target:
+        reader = csv.reader(source)
+        writer = csv.writer(target, lineterminator='\n')
+        header = next(reader)
+        writer.writerow(header)
+        # Spalten wie in update_lyrics.load_song_catalog über die Kopfzeile finden
+        columns = [col.strip() for col in header]
+        idx_notes_page = columns.index("Seite (Noten)" if "Seite (Noten)" in columns else "Seite Noten")
+        idx_page = columns.index("Seite")
+        idx_book = columns.index("Buch")
+        idx_title = columns.index("Titel")
+        rows = [row for row in reader if len(row) >= len(header)]
+        for copy in range(scale):
+            shifts = {book_id: copy * count for book_id, count in page_counts.items()}
+            for row in rows:
+                row = list(row)
+                if copy:
+                    shift = shifts.get(row[idx_book].strip(), 0)
+                    row[idx_title] = f"{row[idx_title]} ({copy + 1})"
+                    for idx in (idx_page, idx_notes_page):
+                        if row[idx].strip().isdigit():
+                            row[idx] = str(int(row[idx]) + shift)
+                writer.writerow(row)
+    return target_dir, scaled_csv
+
+# Eine Stufe messen: Laufzeit ohne und Speicherspitze mit tracemalloc (getrennte Läufe,
+# damit tracemalloc die Zeit nicht verfälscht). fn liefert die Zahl der verarbeiteten Einheiten.
+def measure(fn: Callable[[], int], memory: bool = True) -> Dict[str, float]:
+    gc.collect()
+    start = time.perf_counter()
+    items = fn()
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {"seconds": seconds, "items": items, "peak_bytes": peak}
+
+def pipeline_stages(extracted_dir: str, csv_file: str, work_dir: str) -> List[Tuple[str, str, Callable[[], int], Optional[Callable]]]:
+    text_files = sorted(glob.glob(os.path.join(extracted_dir, "Das Ding *.txt")))
+    pages_by_file = {}
+
+    def read_pages():
+        total = 0
+        for text_file in text_files:
+            pages = update_lyrics.extract_pages_from_ocr(text_file)
+            pages_by_file[text_file] = list(pages.values())
+            total += len(pages)
+        return total
+
+    def clean_pages():
+        total = 0
+        for pages in pages_by_file.values():
+            for page in pages:
+                update_lyrics.clean_lyrics(page)
+            total += len(pages)
+        return total
+
+    def load_mapping():
+        _, song_data = update_lyrics.load_song_page_mapping(csv_file)
+        return len(song_data)
+
+    def identify():
+        return sum(len(extract_songs.identify_songs(text_file)) for text_file in text_files)
+
+    def parse_structure():
+        return sum(len(pdf_ocr.parse_song_structure(text_file)) for text_file in text_files)
+
+    output_dir = os.path.join(work_dir, "output")
+    os.makedirs(output_dir, exist_ok=True)
+
+    songs = []
+
+    def update():
+        update_lyrics.update_song_lyrics(csv_file, extracted_dir, output_dir, workers=1)
+        songs[:] = update_lyrics.load_songs_with_lyrics(os.path.join(output_dir, "songs_with_lyrics.json"))
+        return len(songs)
+
+    # Die Schreiber brauchen fertige Songs, die Vorbereitung wird nicht mitgemessen
+    def prepare_songs():
+        if not songs:
+            update()
+
+    def write_json():
+        update_lyrics.write_songs_with_lyrics(songs, os.path.join(work_dir, "bench.json"))
+        return len(songs)
+
+    def write_csv():
+        update_lyrics.write_songs_csv(songs, os.path.join(work_dir, "bench.csv"))
+        return len(songs)
+
+    def write_shards():
+        with song_export.ShardedSongWriter(os.path.join(work_dir, "shards")) as shards:
+            shards.write_many(songs)
+        return len(songs)
+
+    # (Stufe, Einheit, Funktion, Vorbereitung)
+    return [
+        ("extract_pages_from_ocr", "pages", read_pages, None),
+        ("clean_lyrics", "pages", clean_pages, lambda: pages_by_file or read_pages()),
+        ("load_song_page_mapping", "songs", load_mapping, None),
+        ("identify_songs", "songs", identify, None),
+        ("parse_song_structure", "songs", parse_structure, None),
+        ("update_song_lyrics", "songs", update, None),
+        ("write_json", "songs", write_json, prepare_songs),
+        ("write_csv", "songs", write_csv, prepare_songs),
+        ("write_shards", "songs", write_shards, prepare_songs),
+    ]
+
+def run_benchmarks(scales: List[int], memory: bool = True, stages: Optional[List[str]] = None) -> dict:
+    results = []
+    work_root = tempfile.mkdtemp(prefix="pipeline_bench_")
+    # Die Stufen loggen je Seite/Song (und warnen über die fehlenden Bücher 4, 5
+    # und W); gemessen wird die Verarbeitung, nicht das Logging
+    root_logger = logging.getLogger()
+    previous_level = root_logger.level
+    try:
+        for scale in scales:
+            work_dir = os.path.join(work_root, f"x{scale}")
+            if scale == 1:
+                extracted_dir, csv_file = EXTRACTED_DIR, DATA_CSV
+            else:
+                extracted_dir, csv_file = build_scaled_corpus(scale, os.path.join(work_dir, "corpus"))
+            corpus_bytes = sum(os.path.getsize(path) for path in glob.glob(os.path.join(extracted_dir, "Das Ding *.txt")))
+
+            for stage, unit, fn, prepare in pipeline_stages(extracted_dir, csv_file, work_dir):
+                if stages and stage not in stages:
+                    continue
+                root_logger.setLevel(logging.ERROR)
+                try:
+                    if prepare is not None:
+                        prepare()
+                    measured = measure(fn, memory)
+                finally:
+                    root_logger.setLevel(previous_level)
+                result = {"stage": stage, "scale": scale, "unit": unit, "corpus_bytes": corpus_bytes, **measured,
+                          "throughput": measured["items"] / max(measured["seconds"], 1e-9)}
+                results.append(result)
+                peak = f", peak {result['peak_bytes'] / 2**20:.1f} MB" if result["peak_bytes"] is not None else ""
+                logger.info(f"x{scale} {stage}: {result['seconds']:.3f}s, {result['items']} {unit} "
+                            f"({result['throughput']:.0f} {unit}/s){peak}")
+            shutil.rmtree(work_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+    return {
+        "format": RESULTS_FORMAT,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+# Vergleiche mit einem früheren Lauf; liefert die Stufen, die um mehr als tolerance langsamer sind
+def compare_results(current: dict, baseline: dict, tolerance: float = 0.2) -> List[str]:
+    previous = {(r["stage"], r["scale"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for result in current["results"]:
+        old = previous.get((result["stage"], result["scale"]))
+        if old is None or not old["seconds"]:
+            continue
+        ratio = result["seconds"] / old["seconds"]
+        line = f"x{result['scale']} {result['stage']}: {old['seconds']:.3f}s -> {result['seconds']:.3f}s ({ratio:.2f}x)"
+        if ratio > 1 + tolerance:
+            regressions.append(line)
+            logger.warning(f"Langsamer: {line}")
+        else:
+            logger.info(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Laufzeit, Durchsatz und Speicher der Pipeline-Stufen messen")
+    parser.add_argument("--scales", default="1,10", help="Korpusgrößen als Vielfache der eingecheckten Bücher, z.B. 1,10,100")
+    parser.add_argument("--stages", help="Nur diese Stufen (kommagetrennt)")
+    parser.add_argument("--no-memory", action="store_true", help="Speicherspitze nicht messen (halbe Laufzeit)")
+    parser.add_argument("--output", help="Ergebnisse als JSON in diese Datei schreiben (sonst stdout)")
+    parser.add_argument("--compare", metavar="JSON", help="Mit einem früheren Ergebnis vergleichen")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Erlaubte Verlangsamung beim Vergleich (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(",")]
+    stages = args.stages.split(",") if args.stages else None
+    results = run_benchmarks(scales, not args.no_memory, stages)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"Ergebnisse gespeichert in {args.output}")
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare_results(results, json.load(f), args.tolerance)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+import os
+import mmap
+import time
+import zlib
+import struct
+import argparse
+import logging
+from typing import Dict, List, NamedTuple, Optional
+
+from catalog_keys import song_keys
+
+# Logging einrichten
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Dateiaufbau (little endian):
+#   Header | Satztabelle (feste Breite) | String-Pool | Lyrics-Blob
+# Header: Magic, Version, Flags, Anzahl Sätze, dann Offset und Länge von Pool und Blob
+CATALOG_MAGIC = b"KLBC"
+CATALOG_VERSION = 2
+FLAG_COMPRESSED = 1
+HEADER = struct.Struct('<4sHHIIIII')
+
+# Satz: Offsets von ID, Titel, Interpret und Buch im String-Pool, Seite, Notenseite,
+# OCR-Quellseite (-1 = keine), dann (Offset, Länge) von Text, Akkorden und
+# Akkordpositionen im Lyrics-Blob, zuletzt der Offset der Textgruppe ("Buch:Seite"
+# der Vertreterseite bei --share-duplicates, NO_STRING = keine)
+RECORD = struct.Struct('<IIIIiiiIIIIIII')
+NO_PAGE = -1
+NO_STRING = 0xFFFFFFFF
+
+# String-Pool-Eintrag: Länge und UTF-8-Bytes
+POOL_LENGTH = struct.Struct('<H')
+
+# Ein Satz ohne Texte, die Strings sind schon dekodiert
+class CatalogEntry(NamedTuple):
+    song_id: str
+    title: str
+    artist: str
+    book_id: str
+    page: Optional[int]
+    page_notes: Optional[int]
+    source_page: Optional[int]
+    lyrics_group: Optional[str]
+
+# Song-ID wie in update_lyrics.load_song_catalog
+def song_id_for(song: dict) -> str:
+    return f"{song['title'].replace(' ', '_').lower()}_{song['book_id']}"
+
+# Schreibe die Songs (Format von songs_with_lyrics.json) als Binärkatalog
+def write_binary_catalog(songs: List[dict], catalog_file: str, compress: bool = True) -> int:
+    pool = bytearray()
+    pool_offsets: Dict[str, int] = {}
+    blob = bytearray()
+    blob_offsets: Dict[str, tuple] = {}
+
+    # Gleiche Strings und gleiche Texte nur einmal ablegen
+    def intern(value: str) -> int:
+        offset = pool_offsets.get(value)
+        if offset is None:
+            data = value.encode('utf-8')
+            offset = pool_offsets[value] = len(pool)
+            pool.extend(POOL_LENGTH.pack(len(data)))
+            pool.extend(data)
+        return offset
+
+    def store(text: str) -> tuple:
+        if not text:
+            return 0, 0
+        span = blob_offsets.get(text)
+        if span is None:
+            data = text.encode('utf-8')
+            if compress:
+                data = zlib.compress(data, 9)
+            span = blob_offsets[text] = (len(blob), len(data))
+            blob.extend(data)
+        return span
+
+    def page_value(page: Optional[int]) -> int:
+        return NO_PAGE if page is None else page
+
+    records = bytearray()
+    for song in songs:
+        records.extend(RECORD.pack(
+            intern(song_id_for(song)), intern(song["title"]), intern(song["artist"]), intern(song["book_id"]),
+            page_value(song["book_page"]), page_value(song["book_page_notes"]), page_value(song.get("source_page")),
+            *store(song.get("lyrics", "")), *store(song.get("chords", "")), *store(song.get("chord_positions", "")),
+            intern(song["lyrics_group"]) if song.get("lyrics_group") else NO_STRING))
+
+    pool_offset = HEADER.size + len(records)
+    blob_offset = pool_offset + len(pool)
+    with open(catalog_file, 'wb') as f:
+        f.write(HEADER.pack(CATALOG_MAGIC, CATALOG_VERSION, FLAG_COMPRESSED if compress else 0, len(songs),
+                            pool_offset, len(pool), blob_offset, len(blob)))
+        f.write(records)
+        f.write(pool)
+        f.write(blob)
+
+    size = blob_offset + len(blob)
+    logger.info(f"Binärkatalog geschrieben: {catalog_file} ({size / 1024:.0f} KB, {len(songs)} Songs, "
+                f"{len(pool_offsets)} Strings, {len(blob_offsets)} Texte{', komprimiert' if compress else ''})")
+    return size
+
+# Liest einen Binärkatalog per mmap: Sätze ohne Texte auflisten, einzelne Texte in O(1)
+class BinaryCatalog:
+    def __init__(self, catalog_file: str):
+        self._file = open(catalog_file, 'rb')
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, flags, self.count, self._pool_offset, _,
+         self._blob_offset, _) = HEADER.unpack_from(self._buf, 0)
+        if magic != CATALOG_MAGIC or version != CATALOG_VERSION:
+            self.close()
+            raise ValueError(f"Kein Binärkatalog (Version {CATALOG_VERSION}): {catalog_file}")
+        self.compressed = bool(flags & FLAG_COMPRESSED)
+        self._strings: Dict[int, str] = {}
+
+    def close(self):
+        self._buf.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def _record(self, index: int) -> tuple:
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return RECORD.unpack_from(self._buf, HEADER.size + index * RECORD.size)
+
+    # Strings werden beim ersten Zugriff dekodiert und gemerkt
+    def _string(self, offset: int) -> str:
+        value = self._strings.get(offset)
+        if value is None:
+            start = self._pool_offset + offset
+            (length,) = POOL_LENGTH.unpack_from(self._buf, start)
+            start += POOL_LENGTH.size
+            value = self._strings[offset] = self._buf[start:start + length].decode('utf-8')
+        return value
+
+    def _text(self, offset: int, length: int) -> str:
+        if not length:
+            return ""
+        start = self._blob_offset + offset
+        data = self._buf[start:start + length]
+        if self.compressed:
+            data = zlib.decompress(data)
+        return data.decode('utf-8')
+
+    def _entry(self, record: tuple) -> CatalogEntry:
+        string = self._string
+        return CatalogEntry(string(record[0]), string(record[1]), string(record[2]), string(record[3]),
+                            None if record[4] == NO_PAGE else record[4],
+                            None if record[5] == NO_PAGE else record[5],
+                            None if record[6] == NO_PAGE else record[6],
+                            None if record[13] == NO_STRING else string(record[13]))
+
+    def entry(self, index: int) -> CatalogEntry:
+        return self._entry(self._record(index))
+
+    # Alle Sätze in Dateireihenfolge, die Satztabelle wird am Stück entpackt
+    def entries(self):
+        table = memoryview(self._buf)[HEADER.size:HEADER.size + self.count * RECORD.size]
+        try:
+            for record in RECORD.iter_unpack(table):
+                yield self._entry(record)
+        finally:
+            table.release()
+
+    def lyrics(self, index: int) -> str:
+        record = self._record(index)
+        return self._text(record[7], record[8])
+
+    def chords(self, index: int) -> str:
+        record = self._record(index)
+        return self._text(record[9], record[10])
+
+    def chord_positions(self, index: int) -> str:
+        record = self._record(index)
+        return self._text(record[11], record[12])
+
+    # Satz wieder im Format von songs_with_lyrics.json
+    def song(self, index: int) -> dict:
+        entry = self.entry(index)
+        song = {
+            "title": entry.title,
+            "artist": entry.artist,
+            "lyrics": self.lyrics(index),
+            "chords": self.chords(index),
+            "chord_positions": self.chord_positions(index),
+            "book_id": entry.book_id,
+            "book_page": entry.page,
+            "book_page_notes": entry.page_notes,
+            # Schlüssel werden nicht gespeichert, sondern aus Titel und Interpret abgeleitet
+            **song_keys(entry.title, entry.artist),
+        }
+        if entry.source_page is not None:
+            song["source_page"] = entry.source_page
+            song["source_book"] = entry.book_id
+        if entry.lyrics_group is not None:
+            song["lyrics_group"] = entry.lyrics_group
+        return song
+
+# Vergleiche einen Binärkatalog Satz für Satz mit der JSON-Datei, liefert die Zahl der Abweichungen
+def check_round_trip(songs: List[dict], catalog_file: str) -> int:
+    mismatches = 0
+    with BinaryCatalog(catalog_file) as catalog:
+        if len(catalog) != len(songs):
+            logger.error(f"Anzahl Songs: Katalog {len(catalog)}, JSON {len(songs)}")
+            return max(len(catalog), len(songs))
+        for index, expected in enumerate(songs):
+            # Ältere JSON-Dateien haben noch keine Akkordpositionen und Such-/Sortierschlüssel
+            expected = {"chord_positions": "", **song_keys(expected["title"], expected["artist"]), **expected}
+            actual = catalog.song(index)
+            if actual != {key: actual[key] for key in expected} or set(actual) != set(expected):
+                mismatches += 1
+                if mismatches <= 5:
+                    logger.error(f"Abweichung in Satz {index}: {expected['title']}")
+    logger.info(f"Round-Trip {catalog_file}: {len(songs)} Songs, {mismatches} Abweichungen")
+    return mismatches
+
+# Größe und Ladezeit gegenüber songs_with_lyrics.json
+def benchmark_binary_catalog(json_file: str, catalog_file: str, rounds: int = 10) -> Dict[str, float]:
+    # Flach oder Lyrics-Store, wie beim Schreiben des Katalogs
+    from update_lyrics import load_songs_with_lyrics
+    start = time.perf_counter()
+    for _ in range(rounds):
+        songs = load_songs_with_lyrics(json_file)
+    json_time = (time.perf_counter() - start) / rounds
+
+    # Alle Sätze auflisten und filtern, ohne Texte zu dekodieren
+    start = time.perf_counter()
+    for _ in range(rounds):
+        with BinaryCatalog(catalog_file) as catalog:
+            book_1 = [entry for entry in catalog.entries() if entry.book_id == "1"]
+    list_time = (time.perf_counter() - start) / rounds
+
+    # Einzelne Texte nachladen
+    with BinaryCatalog(catalog_file) as catalog:
+        indexes = [i for i in range(len(catalog)) if songs[i]["lyrics"]][::10]
+        start = time.perf_counter()
+        for index in indexes:
+            catalog.lyrics(index)
+        fetch_time = (time.perf_counter() - start) / max(len(indexes), 1)
+
+    json_size = os.path.getsize(json_file)
+    catalog_size = os.path.getsize(catalog_file)
+    logger.info(f"Größe: JSON {json_size / 1024:.0f} KB, Binärkatalog {catalog_size / 1024:.0f} KB "
+                f"({100 * catalog_size / json_size:.0f}%)")
+    logger.info(f"Laden: JSON {json_time * 1000:.1f} ms, Katalog auflisten {list_time * 1000:.2f} ms "
+                f"({len(book_1)} Songs in Buch 1), ein Songtext {fetch_time * 1e6:.0f} µs")
+    return {"json_size": json_size, "catalog_size": catalog_size, "json_load": json_time,
+            "catalog_list": list_time, "lyrics_fetch": fetch_time}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Binärkatalog aus songs_with_lyrics.json schreiben, prüfen und messen")
+    parser.add_argument("json_file", help="songs_with_lyrics.json (flach oder Lyrics-Store)")
+    parser.add_argument("catalog_file", help="Zieldatei des Binärkatalogs")
+    parser.add_argument("--no-compress", action="store_true", help="Texte unkomprimiert ablegen")
+    parser.add_argument("--benchmark", action="store_true", help="Größe und Ladezeiten messen")
+    args = parser.parse_args()
+
+    from update_lyrics import load_songs_with_lyrics
+    songs = load_songs_with_lyrics(args.json_file)
+    write_binary_catalog(songs, args.catalog_file, not args.no_compress)
+    failed = check_round_trip(songs, args.catalog_file)
+    if args.benchmark:
+        benchmark_binary_catalog(args.json_file, args.catalog_file)
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import logging
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+# pdf_ocr zuerst importieren, damit dessen Logging-Format gilt
+import pdf_ocr
+import extract_songs
+import pipeline_metrics as metrics
+from pdf_ocr import (OCR_BATCH_SIZE, OCR_RETRIES, RENDER_CHUNK_PAGES, RENDER_QUEUE_SIZE, OCR_CACHE_DIR, OCR_BACKEND,
+                     OCR_PAGE_ERRORS, OCR_BATCH_ERRORS, BOOK_MAPPING, CSV_FILE, BookPages)
+from page_dedup import PageHashRegistry
+from song_export import SongExport
+
+logger = logging.getLogger('BOOK_SCHEDULER')
+
+# Alle Bücher gleichzeitig: die Unterprozesse (pdfinfo, pdftoppm, tesseract, pdftotext)
+# aller Bücher teilen sich ein gemeinsames CPU-Budget. So läuft das Rendern eines Buchs
+# neben der OCR eines anderen. Gerenderte Seiten warten in einer begrenzten Queue je
+# Buch (Gegendruck auf pdftoppm); bei Abbruch werden laufende Prozesse beendet.
+CPU_BUDGET = int(os.environ.get("CPU_BUDGET", os.cpu_count() or 1))
+# Abfrageintervall, solange übernommene Seiten auf ihre Quelle in einem anderen Buch warten
+SHARE_POLL_SECONDS = 0.1
+
+class CpuBudget:
+    """Global limit for concurrently running subprocesses (one CPU each)"""
+
+    def __init__(self, slots: int = CPU_BUDGET):
+        self.slots = max(1, slots)
+        self._semaphore = asyncio.Semaphore(self.slots)
+        self.running = 0
+        self.peak = 0
+
+    async def acquire(self):
+        await self._semaphore.acquire()
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+
+    def release(self):
+        self.running -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def run(self, cmd: List[str], capture: bool = False, held: bool = False) -> str:
+        """Run cmd once a slot is free (held: the caller already holds one);
+        raises CalledProcessError like subprocess.run(check=True)"""
+        if not held:
+            async with self.slot():
+                return await self.run(cmd, capture, held=True)
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE if capture else asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await proc.communicate()
+        except asyncio.CancelledError:
+            # Abbruch: Prozess nicht weiterlaufen lassen
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+        return stdout.decode('utf-8', errors='replace') if capture else ""
+
+async def gather_or_cancel(*coros):
+    """Like asyncio.gather, but a failure cancels the remaining coroutines"""
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+def read_text(path: str) -> str:
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return f.read()
+
+# Wie pdf_ocr.ocr_page_with_retry, aber über das CPU-Budget (der Aufrufer hält einen Slot)
+async def ocr_page_async(budget: CpuBudget, img_file: str, out_base: str, key: Optional[str], cache_dir: Optional[str]):
+    last_error = None
+    for attempt in range(OCR_RETRIES + 1):
+        try:
+            await budget.run(pdf_ocr.tesseract_command(img_file, out_base), held=True)
+            text = read_text(f"{out_base}.txt")
+            if key:
+                pdf_ocr.ocr_cache_put(cache_dir, key, text)
+            return text, None
+        except OCR_PAGE_ERRORS as e:
+            last_error = e
+            logger.warning(f"OCR attempt {attempt + 1} failed for {img_file}: {e}")
+    return "", last_error
+
+# Wie pdf_ocr.ocr_batch_with_retry: Cache, ein tesseract-Aufruf je Stapel, sonst Seite für Seite
+# (der Aufrufer hält einen Slot)
+async def ocr_batch_async(budget: CpuBudget, items, out_base: str, cache_dir: Optional[str], backend: str):
+    results, pending = pdf_ocr.ocr_cache_lookup(items, cache_dir)
+
+    if backend == "batch" and len(pending) > 1:
+        for attempt in range(OCR_RETRIES + 1):
+            list_file = pdf_ocr.write_batch_list([img_file for _, img_file, _ in pending], out_base)
+            try:
+                await budget.run(pdf_ocr.tesseract_command(list_file, out_base), held=True)
+                texts = pdf_ocr.split_batch_text(read_text(f"{out_base}.txt"), len(pending))
+            except OCR_BATCH_ERRORS as e:
+                pdf_ocr.log_batch_attempt_failed(attempt, pending, e)
+                continue
+            finally:
+                os.remove(list_file)
+            return pdf_ocr.ocr_cache_store(pending, texts, cache_dir, results)
+
+    for page_num, img_file, key in pending:
+        results[page_num] = await ocr_page_async(budget, img_file, f"{out_base}_{page_num}", key, cache_dir)
+    return results
+
+# OCR eines Buchs wie pdf_ocr.extract_text_from_pdf / ocr_pages_streaming, gleiche Ausgabedatei;
+# welche Seiten übersprungen oder übernommen werden, entscheidet pdf_ocr.BookPages
+async def ocr_book(budget: CpuBudget, pdf_path: str, output_dir: str, pages=None, classify: bool = True,
+                   cache_dir: Optional[str] = OCR_CACHE_DIR, backend: str = OCR_BACKEND,
+                   registry: Optional[PageHashRegistry] = None, shared: Optional[dict] = None) -> str:
+    book_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    output_file = os.path.join(output_dir, f"{book_name}.txt")
+    batch_size = OCR_BATCH_SIZE if backend == "batch" else 1
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        page_count = pdf_ocr.parse_page_count(await budget.run(pdf_ocr.pdfinfo_command(pdf_path), capture=True), pdf_path)
+        logger.info(f"{pdf_path} has {page_count} pages")
+        book_pages = BookPages(page_count, pages, registry, book_name, shared)
+        page_queue = asyncio.Queue(maxsize=max(1, RENDER_QUEUE_SIZE))
+
+        async def producer():
+            for first, last, wanted in book_pages.chunks(RENDER_CHUNK_PAGES):
+                kinds = None
+                if classify and wanted:
+                    try:
+                        with metrics.stage("classify"):
+                            await budget.run(pdf_ocr.classify_command(pdf_path, temp_dir, wanted[0], wanted[-1]))
+                            kinds = await asyncio.to_thread(pdf_ocr.classify_rendered, temp_dir, wanted[0],
+                                                            book_pages.hashes)
+                    except (subprocess.CalledProcessError, OSError) as e:
+                        kinds = book_pages.classification_failed(wanted, e)
+                layers = None
+                if book_pages.needs_text_layer(wanted):
+                    try:
+                        with metrics.stage("text_layer"):
+                            await budget.run(pdf_ocr.text_layer_command(pdf_path, temp_dir, wanted[0], wanted[-1]))
+                            layers = await asyncio.to_thread(pdf_ocr.read_text_layer, temp_dir, wanted[0])
+                    except (subprocess.CalledProcessError, OSError) as e:
+                        layers = book_pages.text_layer_failed(wanted, e)
+                wanted = book_pages.select(wanted, kinds, layers)
+
+                # Eine pdftoppm-Ausführung je zusammenhängendem Abschnitt
+                for run_first, run_last in pdf_ocr.page_runs(wanted):
+                    try:
+                        with metrics.stage("render"):
+                            await budget.run(pdf_ocr.render_command(pdf_path, temp_dir, run_first, run_last))
+                    except (subprocess.CalledProcessError, OSError) as e:
+                        logger.error(f"Rendering pages {run_first}-{run_last} of {pdf_path} failed: {e}")
+                        book_pages.fail(range(run_first, run_last + 1), e)
+                        continue
+                    # Volle Queue hält das Rendern an, bis die OCR aufholt
+                    for item in pdf_ocr.collect_rendered(temp_dir, run_first):
+                        await page_queue.put(item)
+            await page_queue.put(None)
+
+        # Läuft mit einem bereits belegten Slot
+        async def ocr_batch(batch):
+            out_base = os.path.join(temp_dir, f"ocr_{batch[0][0]}")
+            with metrics.stage("ocr"):
+                batch_results = await ocr_batch_async(budget, batch, out_base, cache_dir, backend)
+            metrics.count("pages_ocr", len(batch))
+            for page_num, img_file in batch:
+                book_pages.store(page_num, batch_results[page_num])
+                try:
+                    os.remove(img_file)
+                except OSError:
+                    pass
+            metrics.log_sampled(logger, "ocr_batch", "%s: processed pages %s", book_name, [p for p, _ in batch])
+
+        # Je Buch wartet nur ein Stapel auf einen freien Slot; ist er frei, werden alle
+        # inzwischen gerenderten Seiten mitgenommen (größere Stapel, weniger tesseract-Starts)
+        async def dispatcher():
+            batches = []
+            try:
+                stop = False
+                while not stop:
+                    item = await page_queue.get()
+                    if item is None:
+                        break
+                    await budget.acquire()
+                    batch = [item]
+                    while len(batch) < batch_size:
+                        try:
+                            item = page_queue.get_nowait()
+                        except asyncio.QueueEmpty:
+                            break
+                        if item is None:
+                            stop = True
+                            break
+                        batch.append(item)
+                    task = asyncio.ensure_future(ocr_batch(batch))
+                    # Slot auch freigeben, wenn die Aufgabe vor dem Start abgebrochen wird
+                    task.add_done_callback(lambda _: budget.release())
+                    batches.append(task)
+                await gather_or_cancel(*batches)
+            except BaseException:
+                # Laufende Stapel beenden, bevor das temporäre Verzeichnis verschwindet
+                for task in batches:
+                    task.cancel()
+                await asyncio.gather(*batches, return_exceptions=True)
+                raise
+
+        try:
+            await gather_or_cancel(producer(), dispatcher())
+        finally:
+            # Seiten anderer Bücher, die diese Seiten übernehmen, warten sonst ewig
+            book_pages.close()
+        # Quellseiten anderer Bücher sind eventuell noch in Arbeit; sie werden
+        # auf der Event-Loop fertig, daher hier nicht blockierend warten
+        while book_pages.waiting():
+            await asyncio.sleep(SHARE_POLL_SECONDS)
+        book_pages.resolve_shared()
+        book_pages.log_sharing()
+
+        pdf_ocr.log_skipped_pages(book_pages.skipped, page_count)
+        await asyncio.to_thread(pdf_ocr.write_ocr_text, book_pages.results, pdf_path, output_file)
+    return output_file
+
+# Textebene eines Buchs wie extract_songs.convert_pdf_to_text
+async def text_book(budget: CpuBudget, pdf_path: str, output_dir: str) -> str:
+    book_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    output_file = os.path.join(output_dir, f"{book_name}.txt")
+    with metrics.stage("pdftotext"):
+        await budget.run(extract_songs.pdftotext_command(pdf_path, output_file))
+    logger.info(f"Successfully converted {pdf_path} to {output_file}")
+    return output_file
+
+async def process_books(pdf_dir: str, output_dir: str, mode: str = "ocr", cpus: int = CPU_BUDGET,
+                        csv_file: Optional[str] = CSV_FILE, cache_dir: Optional[str] = OCR_CACHE_DIR,
+                        backend: str = OCR_BACKEND, fail_fast: bool = False,
+                        share_duplicates: bool = False, shard_dir: Optional[str] = None) -> int:
+    """Process all 'Das Ding' PDFs concurrently; same outputs as process_pdfs / extract_songs_from_pdfs
+
+    The songs are written book by book in the order of process_pdfs, so a
+    finished book is only held back until the books before it are written.
+    Returns the number of songs.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    budget = CpuBudget(cpus)
+    pdf_files = [f for f in os.listdir(pdf_dir) if f.endswith('.pdf') and 'Das Ding' in f]
+    logger.info(f"Found {len(pdf_files)} PDF files, running them concurrently on {budget.slots} CPUs ({mode})")
+    registry = PageHashRegistry() if share_duplicates and mode == "ocr" else None
+    shared_pages = {}
+    # Fertige Bücher, deren Vorgänger noch nicht geschrieben sind
+    finished = {}
+    next_book = 0
+
+    def export_book(export, index, songs):
+        nonlocal next_book
+        finished[index] = songs
+        while next_book in finished:
+            with metrics.stage("export"):
+                export.add(finished.pop(next_book))
+            next_book += 1
+
+    async def book(export, index, pdf_file):
+        pdf_path = os.path.join(pdf_dir, pdf_file)
+        start = time.perf_counter()
+        try:
+            if mode == "ocr":
+                pages = None
+                book_id = BOOK_MAPPING.get(os.path.splitext(pdf_file)[0])
+                if csv_file and book_id:
+                    pages = pdf_ocr.load_required_pages(csv_file, book_id)
+                    logger.info(f"{len(pages)} pages of {pdf_file} are referenced in {csv_file}")
+                shared = shared_pages.setdefault(os.path.splitext(pdf_file)[0], {}) if registry is not None else None
+                text_file = await ocr_book(budget, pdf_path, output_dir, pages, cache_dir=cache_dir, backend=backend,
+                                           registry=registry, shared=shared)
+                parse = pdf_ocr.parse_song_structure
+            else:
+                text_file = await text_book(budget, pdf_path, output_dir)
+                parse = extract_songs.identify_songs
+        except (subprocess.CalledProcessError, OSError, ValueError) as e:
+            if fail_fast:
+                raise
+            logger.error(f"Failed to extract text from {pdf_file}: {e}")
+            export_book(export, index, [])
+            return
+        # Das Zerlegen in Songs ist reines Python und blockiert die übrigen Bücher nicht
+        with metrics.stage("segment"):
+            songs = await asyncio.to_thread(parse, text_file)
+        metrics.count("songs", len(songs))
+        logger.info(f"{pdf_file}: {len(songs)} songs in {time.perf_counter() - start:.1f}s")
+        export_book(export, index, songs)
+
+    # Nach einem Abbruch bleibt die vorige Ausgabe erhalten
+    with SongExport(output_dir, shard_dir) as export:
+        await gather_or_cancel(*(book(export, index, pdf_file) for index, pdf_file in enumerate(pdf_files)))
+    if mode == "ocr" and cache_dir:
+        pdf_ocr.ocr_cache_evict(cache_dir)
+    logger.info(f"At most {budget.peak} of {budget.slots} subprocesses ran at the same time")
+    if registry is not None:
+        pdf_ocr.write_shared_pages(shared_pages, output_dir)
+    pdf_ocr.log_song_export(export, shard_dir)
+    return export.count
+
+# SIGTERM (z.B. beim Stoppen des Dienstes) bricht wie Strg+C alle Bücher ab
+async def cancel_on_sigterm(coro):
+    task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, task.cancel)
+    try:
+        return await coro
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
+
+def main():
+    pdf_dir = "/var/www/kultliederbuch.z11.de/dev"
+    output_dir = "/var/www/kultliederbuch.z11.de/dev/extracted"
+
+    parser = argparse.ArgumentParser(description="Alle 'Das Ding' PDFs gleichzeitig verarbeiten (gemeinsames CPU-Budget)")
+    parser.add_argument("--pdf-dir", default=pdf_dir, help="Verzeichnis mit den PDFs")
+    parser.add_argument("--output-dir", default=output_dir, help="Zielverzeichnis für Texte, JSON und CSV")
+    parser.add_argument("--mode", choices=["ocr", "text"], default="ocr",
+                        help="ocr: wie pdf_ocr.py, text: Textebene mit pdftotext wie extract_songs.py")
+    parser.add_argument("--cpus", type=int, default=CPU_BUDGET, help="Höchstens so viele Unterprozesse gleichzeitig")
+    parser.add_argument("--backend", choices=["batch", "page"], default=OCR_BACKEND, help="OCR-Backend")
+    parser.add_argument("--csv", default=CSV_FILE, help="Song-Katalog (data.csv) mit den benötigten Seiten")
+    parser.add_argument("--all-pages", action="store_true", help="Alle Seiten erkennen, nicht nur die aus data.csv")
+    parser.add_argument("--no-cache", action="store_true", help="OCR-Cache nicht verwenden")
+    parser.add_argument("--fail-fast", action="store_true", help="Beim ersten fehlgeschlagenen Buch alle abbrechen")
+    parser.add_argument("--share-duplicates", action="store_true",
+                        help="Seiten, deren Bild und Textebene einer schon erkannten Seite gleichen, "
+                             "ohne OCR deren Text geben")
+    parser.add_argument("--shards", metavar="DIR", help="Songs zusätzlich als NDJSON je Buch mit Manifest hier ablegen")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    metrics.start(args)
+    try:
+        song_count = asyncio.run(cancel_on_sigterm(process_books(
+            args.pdf_dir, args.output_dir, args.mode, args.cpus, None if args.all_pages else args.csv,
+            None if args.no_cache else OCR_CACHE_DIR, args.backend, args.fail_fast, args.share_duplicates,
+            args.shards)))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        # asyncio.run bricht die Aufgaben ab, die Unterprozesse sind dann schon beendet
+        logger.error("Abgebrochen")
+        return 130
+    logger.info(f"Extraction complete. Total songs extracted: {song_count}")
+    metrics.finish(args, logger)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+import re
+import sys
+import json
+import time
+import bisect
+import argparse
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from lyrics_search import fold
+
+# Logging einrichten
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Normalisierte Such- und Sortierschlüssel für Titel und Interpreten, einmal beim
+# Export berechnet statt bei jeder Eingabe in der App: Kleinschreibung, Umlaute
+# ausgeschrieben, Satzzeichen entfernt und für die Sortierung ohne führenden
+# Artikel ("Die Ärzte" -> "aerzte"). Dazu Gruppierungen nach Buch und Interpret und
+# die alphabetische Titelliste (catalog_index.json).
+CATALOG_INDEX_FORMAT = "catalog-index-1"
+CATALOG_INDEX_FILE = "catalog_index.json"
+
+# Führende Artikel, die beim Sortieren übersprungen werden ("A" und "An" nicht: "An Tagen wie diesen")
+SORT_ARTICLES = frozenset({"der", "die", "das", "ein", "eine", "the"})
+# Titel, die nicht mit einem Buchstaben beginnen, stehen in der Buchstabenleiste unter OTHER_LETTER
+OTHER_LETTER = "#"
+
+_NON_WORD_PATTERN = re.compile(r'[\W_]+')
+
+def search_key(text: str) -> str:
+    """Folded words separated by single spaces ('Über den Wolken!' -> 'ueber den wolken')"""
+    return _NON_WORD_PATTERN.sub(' ', fold(text)).strip()
+
+def sort_key(text: str) -> str:
+    """search_key without a leading article ('Die Ärzte' -> 'aerzte')"""
+    key = search_key(text)
+    first, _, rest = key.partition(' ')
+    return rest if rest and first in SORT_ARTICLES else key
+
+def song_keys(title: str, artist: str) -> Dict[str, str]:
+    """The precomputed key fields of a song in songs_with_lyrics.json"""
+    return {
+        "search_title": search_key(title),
+        "search_artist": search_key(artist),
+        "sort_title": sort_key(title),
+        "sort_artist": sort_key(artist),
+    }
+
+def index_letter(key: str) -> str:
+    return key[0] if key and key[0].isalpha() else OTHER_LETTER
+
+def build_catalog_index(songs: Dict[str, dict]) -> dict:
+    """Alphabetical title list, songs by book and by artist for {song_id: song} (with song_keys fields)"""
+    def title_order(song_id):
+        song = songs[song_id]
+        return song["sort_title"], song["sort_artist"], song["book_id"], song_id
+
+    titles = sorted(songs, key=title_order)
+    letters = {}
+    for position, song_id in enumerate(titles):
+        letters.setdefault(index_letter(songs[song_id]["sort_title"]), position)
+
+    books: Dict[str, List[str]] = {}
+    artists: Dict[str, dict] = {}
+    for song_id in titles:
+        song = songs[song_id]
+        books.setdefault(song["book_id"], []).append(song_id)
+        # Gleicher Sortierschlüssel = gleicher Interpret ("Die Ärzte" und "Ärzte")
+        group = artists.setdefault(song["sort_artist"], {"artist": song["artist"], "songs": []})
+        group["songs"].append(song_id)
+    for book_songs in books.values():
+        # Im Buch nach Seite, Songs ohne Seite zuletzt
+        book_songs.sort(key=lambda song_id: (songs[song_id]["book_page"] is None, songs[song_id]["book_page"] or 0))
+
+    return {
+        "format": CATALOG_INDEX_FORMAT,
+        "titles": titles,
+        "letters": letters,
+        "books": dict(sorted(books.items())),
+        "artists": [{"sort_artist": key, **group} for key, group in sorted(artists.items())],
+    }
+
+def write_catalog_index(songs: Dict[str, dict], index_file: str) -> dict:
+    index = build_catalog_index(songs)
+    with open(index_file, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    logger.info(f"Katalogindex gespeichert in: {index_file} ({len(index['titles'])} Titel, "
+                f"{len(index['artists'])} Interpreten, {len(index['books'])} Bücher)")
+    return index
+
+class CatalogLookup:
+    """Search and alphabetical browsing over the precomputed keys"""
+
+    def __init__(self, songs: Dict[str, dict], index: dict):
+        self.songs = songs
+        self.titles = index["titles"]
+        self._title_keys = [songs[song_id]["sort_title"] for song_id in self.titles]
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[str]:
+        """Songs whose title or artist contains the query, in title order"""
+        key = search_key(query)
+        hits = [song_id for song_id in self.titles
+                if key in self.songs[song_id]["search_title"] or key in self.songs[song_id]["search_artist"]]
+        return hits[:limit] if limit else hits
+
+    def browse(self, prefix: str, limit: int = 50) -> List[str]:
+        """Titles from the first one whose sort key starts with prefix (binary search)"""
+        start = bisect.bisect_left(self._title_keys, sort_key(prefix))
+        return self.titles[start:start + limit]
+
+# Zum Vergleich: alles je Anfrage neu normalisieren, wie bisher in den Konsumenten
+def search_unkeyed(songs: Dict[str, dict], query: str) -> List[str]:
+    key = search_key(query)
+    hits = [song_id for song_id, song in songs.items()
+            if key in search_key(song["title"]) or key in search_key(song["artist"])]
+    return sorted(hits, key=lambda song_id: (sort_key(songs[song_id]["title"]), sort_key(songs[song_id]["artist"]),
+                                             songs[song_id]["book_id"], song_id))
+
+def browse_unkeyed(songs: Dict[str, dict], prefix: str, limit: int = 50) -> List[str]:
+    ordered = sorted(songs, key=lambda song_id: (sort_key(songs[song_id]["title"]), sort_key(songs[song_id]["artist"]),
+                                                 songs[song_id]["book_id"], song_id))
+    key = sort_key(prefix)
+    start = next((i for i, song_id in enumerate(ordered) if sort_key(songs[song_id]["title"]) >= key), len(ordered))
+    return ordered[start:start + limit]
+
+# Typische Eingaben: Tastendruck für Tastendruck ein Interpret, ein Titel und ein Wortteil
+BENCHMARK_QUERIES = ["d", "di", "die ", "die ä", "die är", "die ärzte", "ü", "üb", "über den", "wolke", "griech", "hallelu"]
+BENCHMARK_PREFIXES = ["a", "ae", "ärz", "m", "mar", "s", "sch", "z"]
+
+def latency(fn, inputs: Iterable[str], rounds: int) -> Dict[str, float]:
+    durations = []
+    for _ in range(rounds):
+        for value in inputs:
+            start = time.perf_counter()
+            fn(value)
+            durations.append(time.perf_counter() - start)
+    durations.sort()
+    return {
+        "p50_ms": durations[len(durations) // 2] * 1000,
+        "p99_ms": durations[min(len(durations) - 1, int(len(durations) * 0.99))] * 1000,
+    }
+
+def benchmark_lookups(songs: Dict[str, dict], index: Optional[dict] = None, rounds: int = 20) -> Dict[str, dict]:
+    """Query latency with and without the precomputed keys; both must return the same songs"""
+    keyed = {song_id: {**song, **song_keys(song["title"], song["artist"])} for song_id, song in songs.items()}
+    lookup = CatalogLookup(keyed, index or build_catalog_index(keyed))
+    for query in BENCHMARK_QUERIES:
+        if lookup.search(query) != search_unkeyed(songs, query):
+            raise ValueError(f"Unterschiedliche Treffer für {query!r}")
+    for prefix in BENCHMARK_PREFIXES:
+        if lookup.browse(prefix) != browse_unkeyed(songs, prefix):
+            raise ValueError(f"Unterschiedliche Liste ab {prefix!r}")
+
+    results = {
+        "search_unkeyed": latency(lambda query: search_unkeyed(songs, query), BENCHMARK_QUERIES, rounds),
+        "search_keyed": latency(lookup.search, BENCHMARK_QUERIES, rounds),
+        "browse_unkeyed": latency(lambda prefix: browse_unkeyed(songs, prefix), BENCHMARK_PREFIXES, rounds),
+        "browse_keyed": latency(lookup.browse, BENCHMARK_PREFIXES, rounds),
+    }
+    for name, values in results.items():
+        logger.info(f"{name}: p50 {values['p50_ms']:.3f} ms, p99 {values['p99_ms']:.3f} ms")
+    for kind in ("search", "browse"):
+        speedup = results[f"{kind}_unkeyed"]["p50_ms"] / max(results[f"{kind}_keyed"]["p50_ms"], 1e-9)
+        logger.info(f"{kind}: {speedup:.0f}x schneller mit vorberechneten Schlüsseln ({len(songs)} Songs)")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Such-/Sortierschlüssel: Latenz mit und ohne Vorberechnung messen")
+    parser.add_argument("json_file", help="songs_with_lyrics.json aus update_lyrics.py")
+    parser.add_argument("--index", metavar="JSON", help=f"{CATALOG_INDEX_FILE} (sonst im Speicher gebaut)")
+    parser.add_argument("--rounds", type=int, default=20, help="Wiederholungen je Anfrage")
+    args = parser.parse_args()
+
+    from update_lyrics import load_songs_with_lyrics
+    from binary_catalog import song_id_for
+    songs = {song_id_for(song): song for song in load_songs_with_lyrics(args.json_file)}
+    index = None
+    if args.index:
+        with open(args.index, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get("format") != CATALOG_INDEX_FORMAT:
+            raise ValueError(f"Unbekanntes Format in {args.index}: {index.get('format')}")
+    benchmark_lookups(songs, index, args.rounds)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import re
+import bisect
+from typing import List, Optional, Tuple
+
+# Lexikon der Akkordzusätze nach Grundton und Vorzeichen, längste zuerst,
+# damit z.B. "maj7" nicht als "m" + "aj7" gelesen wird
+CHORD_QUALITIES = ("maj", "min", "sus", "dim", "aug", "add", "m", "M", "+", "-", "°", "ø")
+CHORD_ROOTS = "ABCDEFG"
+CHORD_ACCIDENTALS = "#b"
+
+# Nur Tokens mit Buchstaben oder Ziffern zählen als Wort (wie früher \b\w+\b); Trenner
+# und OCR-Reste wie "|", "—", "€" oder ";" in Akkordzeilen zählen nicht
+_WORD_CHAR = re.compile(r'\w')
+
+_TOKEN_PATTERN = re.compile(r'\S+')
+# Zeichen, auf die ein Akkord enden kann, außer Buchstaben und Ziffern ("C+", "C°", "C(add9)")
+_CHORD_END_CHARS = frozenset("+-°ø)")
+
+def _read_root(token: str, i: int) -> int:
+    """Root note plus optional accidental starting at i, returns the end index or -1"""
+    if i >= len(token) or token[i] not in CHORD_ROOTS:
+        return -1
+    i += 1
+    if i < len(token) and token[i] in CHORD_ACCIDENTALS:
+        i += 1
+    return i
+
+def is_chord(token: str) -> bool:
+    """Check whether token is a complete chord symbol such as Am, F#m7/C#, Dsus4 or Cmaj7.
+
+    Works as a small DFA: root, accidental, any sequence of qualities from
+    the lexicon, digits and altered degrees (b5, #9), optional bass note.
+    """
+    n = len(token)
+    i = _read_root(token, 0)
+    if i < 0:
+        return False
+
+    while i < n and token[i] != '/':
+        char = token[i]
+        if char.isdigit():
+            i += 1
+            continue
+        # Alterierte Stufe wie b5 oder #9
+        if char in CHORD_ACCIDENTALS and i + 1 < n and token[i + 1].isdigit():
+            i += 2
+            continue
+        # Zusatz in Klammern wie (add9)
+        if char == '(':
+            close = token.find(')', i)
+            if close < 0 or not is_chord("C" + token[i + 1:close]):
+                return False
+            i = close + 1
+            continue
+        for quality in CHORD_QUALITIES:
+            if token.startswith(quality, i):
+                i += len(quality)
+                break
+        else:
+            return False
+
+    # Basston
+    if i < n:
+        i = _read_root(token, i + 1)
+        if i != n:
+            return False
+    return True
+
+def _chord_token(token: str) -> Optional[str]:
+    """The chord symbol in token without OCR punctuation around it ("Em?", "E—", "(Am"), or None"""
+    start = 0
+    while start < len(token) and not token[start].isalnum():
+        start += 1
+    end = len(token)
+    while end > start and not token[end - 1].isalnum() and token[end - 1] not in _CHORD_END_CHARS:
+        end -= 1
+    chord = token[start:end]
+    # Schließende Klammer einer Gruppe wie "(Am F)"
+    if chord.endswith(')') and '(' not in chord:
+        chord = chord[:-1]
+    if chord and chord[0] in CHORD_ROOTS and is_chord(chord):
+        return chord
+    return None
+
+def classify_line(line: str) -> Optional[List[Tuple[int, str]]]:
+    """Classify a line in one pass over its tokens.
+
+    Returns the (column, chord) pairs if chord symbols make up most of the
+    tokens (a chord line), otherwise None. Tokens without a letter or digit
+    do not count, OCR punctuation around a chord is dropped.
+    """
+    chords = 0
+    words = 0
+    for token in line.split():
+        if _chord_token(token) is not None:
+            chords += 1
+        elif _WORD_CHAR.search(token):
+            words += 1
+    if not chords or chords / (chords + words) <= 0.7:
+        return None
+    # Spalten nur für Akkordzeilen bestimmen, die sind selten
+    line_chords = []
+    for match in _TOKEN_PATTERN.finditer(line):
+        chord = _chord_token(match.group())
+        if chord is not None:
+            line_chords.append((match.start() + match.group().index(chord), chord))
+    return line_chords
+
+def align_chords(lines: List[str], line_chords: List[List[Tuple[int, str]]]) -> Tuple[str, List[List]]:
+    """Join lyric lines to whitespace-collapsed text and map chord columns to offsets in it.
+
+    line_chords[i] holds the chords of the chord line directly above lines[i]
+    (column based). Returns the text, equal to ' '.join('\\n'.join(lines).split()),
+    and a list of [offset, chord] pairs.
+    """
+    words = []
+    positions = []
+    # Länge des bisher zusammengefügten Texts
+    length = -1
+    for line, chords in zip(lines, line_chords):
+        if not chords:
+            for word in line.split():
+                words.append(word)
+                length += len(word) + 1
+            continue
+
+        line_words = [(m.start(), m.end()) for m in _TOKEN_PATTERN.finditer(line)]
+        if not line_words:
+            continue
+        line_offsets = []
+        for start, end in line_words:
+            line_offsets.append(length + 1)
+            words.append(line[start:end])
+            length += end - start + 1
+
+        word_starts = [start for start, _ in line_words]
+        for column, chord in chords:
+            # Wort, in dem (oder vor dem) der Akkord steht
+            i = bisect.bisect_right(word_starts, column) - 1
+            if i < 0:
+                positions.append([line_offsets[0], chord])
+                continue
+            start, end = line_words[i]
+            if column < end:
+                positions.append([line_offsets[i] + column - start, chord])
+            elif i + 1 < len(line_words):
+                positions.append([line_offsets[i + 1], chord])
+            else:
+                positions.append([line_offsets[i] + end - start, chord])
+
+    return ' '.join(words), positions
+
+def format_chord_positions(positions: List[List]) -> str:
+    """Compact form for songs_with_lyrics.json: 'offset:chord' pairs separated by spaces"""
+    return ' '.join(f"{offset}:{chord}" for offset, chord in positions)
+
+def parse_chord_positions(value: str) -> List[Tuple[int, str]]:
+    """Inverse of format_chord_positions"""
+    positions = []
+    for pair in value.split():
+        offset, chord = pair.split(':', 1)
+        positions.append((int(offset), chord))
+    return positions
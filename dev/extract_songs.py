@@ -3,8 +3,18 @@
 import os
 import subprocess
 import re
-import json
 import logging
+import bisect
+import time
+import glob
+import tempfile
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from song_segmenter import segment_songs
+from ocr_pages import build_page_map, iter_ocr_file
+import pipeline_metrics as metrics
+from song_export import SongExport
 
 # Konfiguriere Logging
 logging.basicConfig(
@@ -14,6 +24,24 @@ logging.basicConfig(
 
 logger = logging.getLogger('PDF_SONG_EXTRACTOR')
 
+# Nach der Logging-Konfiguration importieren, damit deren Format gilt
+from pdf_ocr import get_pdf_page_count, log_song_export
+
+PAGE_MARKER_PATTERN = re.compile(r'\[Seite (\d+)\]')
+
+# Eingecheckte Texte neben diesem Skript (für Benchmarks)
+EXTRACTED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extracted")
+
+# Seitenbereiche: pdftotext läuft je Bereich (-f/-l) parallel, die Songs eines
+# Bereichs werden erkannt, sobald er fertig ist
+RANGE_PAGES = int(os.environ.get("TEXT_RANGE_PAGES", 16))
+TEXT_WORKERS = int(os.environ.get("TEXT_WORKERS", os.cpu_count() or 1))
+
+def pdftotext_command(pdf_path, output_file, first=None, last=None):
+    # -layout behält das Layout bei
+    pages = ["-f", str(first), "-l", str(last)] if first is not None else []
+    return ["pdftotext", "-layout", *pages, pdf_path, output_file]
+
 def convert_pdf_to_text(pdf_path, output_dir):
     """Convert PDF to text using pdftotext"""
     logger.info(f"Processing PDF: {pdf_path}")
@@ -25,15 +53,18 @@ def convert_pdf_to_text(pdf_path, output_dir):
     
     # Konvertiere PDF zu Text
     try:
-        # -layout behält das Layout bei
-        cmd = ["pdftotext", "-layout", pdf_path, output_file]
-        subprocess.run(cmd, check=True)
+        subprocess.run(pdftotext_command(pdf_path, output_file), check=True)
         logger.info(f"Successfully converted {pdf_path} to {output_file}")
         return output_file
     except subprocess.CalledProcessError as e:
         logger.error(f"Error converting PDF to text: {e}")
         return None
 
+def book_id_from_name(path):
+    """Book number from a 'Das Ding N ...' file name"""
+    match = re.search(r'Das Ding (\d+)', os.path.basename(path))
+    return match.group(1) if match else "unknown"
+
 def identify_songs(text_file):
     """Identify songs from the text file"""
     logger.info(f"Identifying songs from {text_file}")
@@ -41,30 +72,28 @@ def identify_songs(text_file):
     with open(text_file, 'r', encoding='utf-8', errors='replace') as f:
         content = f.read()
     
-    # Extrahiere Buch-ID aus dem Dateinamen
-    base_name = os.path.basename(text_file)
-    match = re.search(r'Das Ding (\d+)', base_name)
-    book_id = match.group(1) if match else "unknown"
-    
-    # Pattern-Erkennung für Songs (muss möglicherweise angepasst werden)
-    # Typische Songstruktur: Nummer, Titel, Interpret, dann Text
-    pattern = r'(\d+)\s+([^\n]+?)\s+(?:- )?([^\n]+?)\s*\n\s*\n([\s\S]+?)(?=\d+\s+[^\n]+|$)'
-    
+    songs = [song for song, _ in identify_song_spans(content, book_id_from_name(text_file))]
+    logger.info(f"Total songs found: {len(songs)}")
+    return songs
+
+def identify_song_spans(content, book_id, first_page=1):
+    """Songs in content as (song, SongSpan) pairs; without page markers content starts at first_page"""
+    # Typische Songstruktur: Nummer, Titel, Interpret, dann Leerzeile und Text
     songs = []
-    matches = re.finditer(pattern, content)
+    page_index = build_page_index(content)
     
-    for match in matches:
+    for span in segment_songs(content, "book"):
         try:
-            number = match.group(1).strip()
-            title = match.group(2).strip()
-            artist = match.group(3).strip()
-            lyrics = match.group(4).strip()
+            number = span.number.strip()
+            title = span.title.strip()
+            artist = span.artist.strip()
+            lyrics = content[span.body_start:span.body_end].strip()
             
             # Manchmal sind Titel und Künstler vertauscht
             if artist.isupper() and not title.isupper():
                 title, artist = artist, title
             
-            page_number = find_page_number(content, match.start())
+            page_number = find_page_number(page_index, span.start, first_page)
             
             song = {
                 'number': number,
@@ -75,77 +104,244 @@ def identify_songs(text_file):
                 'book': f"ding_{book_id}"
             }
             
-            songs.append(song)
-            logger.info(f"Found song: {title} by {artist} on page {page_number}")
+            songs.append((song, span))
+            metrics.log_sampled(logger, "song", "Found song: %s by %s on page %s", title, artist, page_number)
         except Exception as e:
             logger.error(f"Error processing song match: {e}")
     
-    logger.info(f"Total songs found: {len(songs)}")
     return songs
 
-def find_page_number(content, position):
-    """Find the page number for a given position in the text"""
-    # Suche nach Seitenzahlen im Format [Seite X]
+def convert_page_range(pdf_path, temp_dir, first, last, book_id):
+    """pdftotext for pages first..last; returns the text and its (song, span) pairs"""
+    range_file = os.path.join(temp_dir, f"pages_{first}.txt")
+    start = time.perf_counter()
+    subprocess.run(pdftotext_command(pdf_path, range_file, first, last), check=True)
+    metrics.add_time("pdftotext", time.perf_counter() - start)
+    with open(range_file, 'r', encoding='utf-8', errors='replace') as f:
+        content = f.read()
+    # pdftotext schließt jede Seite mit einem Seitenvorschub ab
+    page_count = content.count('\f')
+    if page_count != last - first + 1:
+        logger.warning(f"pdftotext returned {page_count} instead of {last - first + 1} pages for {first}-{last} of {pdf_path}")
+    
+    # Songs dieses Bereichs erkennen, während die übrigen Bereiche noch laufen
+    with metrics.stage("segment"):
+        spans = identify_song_spans(content, book_id, first)
+    return content, spans
+
+def convert_pdf_by_ranges(pdf_path, output_dir, workers=TEXT_WORKERS, range_pages=RANGE_PAGES):
+    """Text layer of a PDF from parallel pdftotext runs over page ranges.
+    
+    Each range knows its first page, so the songs get their real page
+    numbers without counting form feeds through the whole book, and its
+    songs are identified as soon as it is done. Only the text around the
+    range boundaries is segmented again when the ranges are put together.
+    Returns the text file (same content and name as with
+    convert_pdf_to_text) and the songs in page order.
+    """
+    book_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    output_file = os.path.join(output_dir, f"{book_name}.txt")
+    book_id = book_id_from_name(pdf_path)
+    page_count = get_pdf_page_count(pdf_path)
+    ranges = [(first, min(first + range_pages - 1, page_count)) for first in range(1, page_count + 1, range_pages)]
+    logger.info(f"Processing PDF: {pdf_path} ({page_count} pages in {len(ranges)} ranges, {workers} workers)")
+    
+    results = [None] * len(ranges)
+    with tempfile.TemporaryDirectory() as temp_dir, ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(convert_page_range, pdf_path, temp_dir, first, last, book_id): i
+                   for i, (first, last) in enumerate(ranges)}
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            metrics.log_sampled(logger, "page_range", "%s: pages %d-%d done, %d songs",
+                                book_name, ranges[i][0], ranges[i][1], len(results[i][1]))
+    
+    # Nur der letzte Song eines Bereichs kann unvollständig sein, und eine Überschrift
+    # kann über die Bereichsgrenze reichen: die Nahtstelle (ab dem letzten Song bis
+    # vor den ersten Song des nächsten Bereichs) wird daher noch einmal zerlegt
+    songs = []
+    tail, tail_page = "", 1
+    with metrics.stage("segment"):
+        for (first, _), (content, spans) in zip(ranges, results):
+            if not spans:
+                if not tail:
+                    tail_page = first
+                tail += content
+                continue
+            seam = tail + content[:spans[0][1].start]
+            if seam:
+                songs.extend(song for song, _ in identify_song_spans(seam, book_id, tail_page if tail else first))
+            songs.extend(song for song, _ in spans[:-1])
+            last_song, last_span = spans[-1]
+            tail, tail_page = content[last_span.start:], last_song['page']
+        if tail:
+            songs.extend(song for song, _ in identify_song_spans(tail, book_id, tail_page))
+    
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(''.join(content for content, _ in results))
+    logger.info(f"Successfully converted {pdf_path} to {output_file}")
+    return output_file, songs
+
+def iter_text_layer(text_file):
+    """(page, text) of a pdftotext file, pages separated by form feeds"""
+    with open(text_file, 'r', encoding='utf-8', errors='replace') as f:
+        pages = f.read().split('\f')
+    for i, text in enumerate(pages[:-1] if len(pages) > 1 else pages):
+        yield i + 1, text
+
+def compare_with_ocr(text_file, ocr_file):
+    """Per-page word shingle similarity of a text layer and the OCR text of the same book"""
+    from page_dedup import shingles, jaccard
+    
+    text_pages = {page: shingles(text) for page, text in iter_text_layer(text_file)}
+    ocr_pages = {page: shingles(text) for page, text in iter_ocr_file(ocr_file)}
+    common = sorted(set(text_pages) & set(ocr_pages))
+    similarities = [jaccard(text_pages[page], ocr_pages[page]) for page in common
+                    if text_pages[page] or ocr_pages[page]]
+    result = {
+        "pages": len(common),
+        "compared": len(similarities),
+        "mean_similarity": sum(similarities) / len(similarities) if similarities else 0.0,
+        "low_similarity_pages": sum(1 for value in similarities if value < 0.5),
+    }
+    logger.info(f"{os.path.basename(text_file)} vs. OCR: {result['compared']} pages compared, "
+                f"mean similarity {result['mean_similarity']:.2f}, {result['low_similarity_pages']} pages below 0.5")
+    return result
+
+def build_page_index(content):
+    """Build a page index for content in a single pass.
+    
+    Returns (marker_ends, marker_pages, form_feeds): the end offsets and page
+    numbers of all [Seite X] markers and the offsets of all form feeds, each
+    sorted ascending.
+    """
+    page_map = build_page_map(content)
+    marker_ends = page_map.starts
+    marker_pages = [int(number) for number in page_map.numbers]
+    
+    form_feeds = []
+    pos = content.find('\f')
+    while pos != -1:
+        form_feeds.append(pos)
+        pos = content.find('\f', pos + 1)
+    
+    return marker_ends, marker_pages, form_feeds
+
+def find_page_number(page_index, position, first_page=1):
+    """Find the page number for a given position in the text (which starts at first_page)"""
+    marker_ends, marker_pages, form_feeds = page_index
+    
+    # Suche nach der letzten Seitenzahl im Format [Seite X] vor der Position
+    i = bisect.bisect_right(marker_ends, position)
+    if i > 0:
+        return marker_pages[i - 1]
+    
+    # Alternative Methode: Zähle die Seitenumbrüche
+    return bisect.bisect_left(form_feeds, position) + first_page
+
+def find_page_number_linear(content, position):
+    """Previous per-match page lookup, kept as reference for benchmark_page_lookup"""
     lines = content[:position].split('\n')
     for i in range(len(lines) - 1, -1, -1):
-        match = re.search(r'\[Seite (\d+)\]', lines[i])
+        match = PAGE_MARKER_PATTERN.search(lines[i])
         if match:
             return int(match.group(1))
-    
-    # Alternative Methode: Zähle die Seitenumbrüche
-    page_count = content[:position].count('\f') + 1
-    return page_count
+    return content[:position].count('\f') + 1
 
-def extract_songs_from_pdfs(pdf_dir, output_dir):
-    """Extract songs from PDF files"""
+def benchmark_page_lookup(text_files):
+    """Compare the page index against the linear lookup on the song positions of each file"""
+    for text_file in text_files:
+        with open(text_file, 'r', encoding='utf-8', errors='replace') as f:
+            content = f.read()
+        positions = [span.start for span in segment_songs(content, "book")]
+        
+        start = time.perf_counter()
+        linear = [find_page_number_linear(content, p) for p in positions]
+        linear_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        page_index = build_page_index(content)
+        indexed = [find_page_number(page_index, p) for p in positions]
+        indexed_time = time.perf_counter() - start
+        
+        if indexed != linear:
+            logger.error(f"Page lookup mismatch in {text_file}")
+        logger.info(f"{os.path.basename(text_file)}: {len(content)} chars, {len(positions)} lookups, "
+                    f"linear {linear_time * 1000:.1f} ms, indexed {indexed_time * 1000:.1f} ms "
+                    f"({linear_time / max(indexed_time, 1e-9):.0f}x)")
+
+def extract_songs_from_pdfs(pdf_dir, output_dir, shard_dir=None, range_pages=None, workers=TEXT_WORKERS,
+                            ocr_dir=None):
+    """Extract songs from PDF files
+    
+    The songs of each book are written as soon as it is done, with shard_dir
+    additionally as one NDJSON shard per book (song_export.py). With
+    range_pages, pdftotext runs in parallel over page ranges of that size
+    (convert_pdf_by_ranges); with ocr_dir, each text is then compared with
+    the OCR text of the same book found there. Returns the number of songs.
+    """
     # Stelle sicher, dass das Ausgabeverzeichnis existiert
     os.makedirs(output_dir, exist_ok=True)
     
     # Finde alle PDF-Dateien
     pdf_files = [f for f in os.listdir(pdf_dir) if f.endswith('.pdf') and 'Das Ding' in f]
     
-    all_songs = []
-    
-    for pdf_file in pdf_files:
-        pdf_path = os.path.join(pdf_dir, pdf_file)
-        
-        # Konvertiere PDF zu Text
-        text_file = convert_pdf_to_text(pdf_path, output_dir)
-        if not text_file:
-            continue
-        
-        # Identifiziere Songs
-        songs = identify_songs(text_file)
-        all_songs.extend(songs)
-    
-    # Speichere alle Songs im JSON-Format
-    json_output = os.path.join(output_dir, 'all_songs.json')
-    with open(json_output, 'w', encoding='utf-8') as f:
-        json.dump(all_songs, f, ensure_ascii=False, indent=2)
-    
-    logger.info(f"Saved {len(all_songs)} songs to {json_output}")
-    
-    # Erstelle auch eine CSV-Datei für den direkten Import
-    csv_output = os.path.join(output_dir, 'songs_export.csv')
-    with open(csv_output, 'w', encoding='utf-8') as f:
-        # Schreibe CSV-Header
-        f.write("Seite (Noten),Seite,Buch,Künstler,Titel\n")
-        
-        # Schreibe Songs
-        for song in all_songs:
-            book_id = song['book'].replace('ding_', '')
-            f.write(f",{song['page']},{book_id},{song['artist']},{song['title']}\n")
+    # JSON und CSV werden Buch für Buch geschrieben
+    with SongExport(output_dir, shard_dir) as export:
+        for pdf_file in pdf_files:
+            pdf_path = os.path.join(pdf_dir, pdf_file)
+            
+            if range_pages:
+                # Seitenbereiche parallel, die Songs werden dabei schon erkannt
+                try:
+                    text_file, songs = convert_pdf_by_ranges(pdf_path, output_dir, workers, range_pages)
+                except (subprocess.CalledProcessError, OSError, ValueError) as e:
+                    logger.error(f"Error converting PDF to text: {e}")
+                    continue
+            else:
+                # Konvertiere PDF zu Text
+                with metrics.stage("pdftotext"):
+                    text_file = convert_pdf_to_text(pdf_path, output_dir)
+                if not text_file:
+                    continue
+                
+                # Identifiziere Songs
+                with metrics.stage("segment"):
+                    songs = identify_songs(text_file)
+            
+            ocr_file = os.path.join(ocr_dir, os.path.basename(text_file)) if ocr_dir else None
+            if ocr_file and os.path.exists(ocr_file):
+                compare_with_ocr(text_file, ocr_file)
+            metrics.count("songs", len(songs))
+            with metrics.stage("export"):
+                export.add(songs)
     
-    logger.info(f"Saved songs to CSV: {csv_output}")
-    return all_songs
+    log_song_export(export, shard_dir)
+    return export.count
 
 def main():
     pdf_dir = "/var/www/kultliederbuch.z11.de/dev"
     output_dir = "/var/www/kultliederbuch.z11.de/dev/extracted"
     
+    parser = argparse.ArgumentParser(description="Songs aus den 'Das Ding' PDFs extrahieren")
+    parser.add_argument("--benchmark", action="store_true", help="Seitenzuordnung auf den extrahierten Texten messen")
+    parser.add_argument("--shards", metavar="DIR", help="Songs zusätzlich als NDJSON je Buch mit Manifest hier ablegen")
+    parser.add_argument("--range-pages", type=int, nargs="?", const=RANGE_PAGES,
+                        help=f"pdftotext parallel über Seitenbereiche dieser Größe (Standard {RANGE_PAGES})")
+    parser.add_argument("--workers", type=int, default=TEXT_WORKERS, help="Parallele pdftotext-Aufrufe")
+    parser.add_argument("--compare-ocr", metavar="DIR", help="Texte seitenweise mit den OCR-Texten in DIR vergleichen")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    
+    if args.benchmark:
+        benchmark_page_lookup(sorted(glob.glob(os.path.join(EXTRACTED_DIR, "Das Ding *.txt"))))
+        return
+    
     logger.info("Starting PDF extraction process")
-    songs = extract_songs_from_pdfs(pdf_dir, output_dir)
-    logger.info(f"Extraction complete. Total songs extracted: {len(songs)}")
+    metrics.start(args)
+    song_count = extract_songs_from_pdfs(pdf_dir, output_dir, args.shards, args.range_pages, args.workers, args.compare_ocr)
+    logger.info(f"Extraction complete. Total songs extracted: {song_count}")
+    metrics.finish(args, logger)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import glob
+import time
+import argparse
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from ocr_pages import iter_ocr_file
+from chord_tokenizer import classify_line
+from lyrics_search import fold, trigrams
+from update_lyrics import BOOK_MAPPING, CSV_FILE, SongRecord, load_song_catalog
+
+# Logging einrichten
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Eingecheckte Texte neben diesem Skript
+EXTRACTED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extracted")
+
+# Ein Titel gilt als gefunden, wenn dieser Anteil seiner Trigramme in der Überschrift vorkommt
+# (Anteil statt Jaccard, weil zweispaltige Seiten zwei Titel in einer Zeile haben)
+MIN_TITLE_SCORE = 0.75
+# Sehr kurze Titel passen in fast jede Zeile
+MIN_TITLE_LENGTH = 4
+# Seiten mit mehr Überschriften sind Inhaltsverzeichnisse oder Register
+MAX_HEADINGS_PER_PAGE = 6
+
+_LETTERS = re.compile(r'[^\W\d_]')
+_ARTIST_GROUP = re.compile(r'\(([^()]{2,})\)')
+_LEADING_NOISE = re.compile(r'^[\W\d_]+')
+
+# Überschrift auf einer OCR-Seite: Offset im Seitentext, Titelzeile, Interpreten darunter
+class Heading(NamedTuple):
+    offset: int
+    text: str
+    artists: Tuple[str, ...]
+
+# Zuordnung einer Überschrift zu einem Katalogeintrag
+class HeadingMatch(NamedTuple):
+    page: int
+    heading: Heading
+    record: SongRecord
+    score: float
+
+# Titelzeilen in Großbuchstaben, meist gefolgt von "(INTERPRET)"
+def extract_headings(page_text: str) -> List[Heading]:
+    headings = []
+    lines = page_text.split('\n')
+    offset = 0
+    offsets = []
+    for line in lines:
+        offsets.append(offset)
+        offset += len(line) + 1
+
+    for i, line in enumerate(lines):
+        text = _LEADING_NOISE.sub('', line).strip()
+        letters = _LETTERS.findall(text)
+        if len(letters) < 3 or text.startswith('('):
+            continue
+        if sum(1 for char in letters if char.isupper()) < 0.8 * len(letters):
+            continue
+        if classify_line(text) is not None:
+            continue
+        # Interpret in Klammern in derselben oder der nächsten Zeile
+        artists = _ARTIST_GROUP.findall(text)
+        if i + 1 < len(lines):
+            artists += _ARTIST_GROUP.findall(lines[i + 1])
+        title = _ARTIST_GROUP.sub(' ', text).strip()
+        headings.append(Heading(offsets[i], title, tuple(artist.strip() for artist in artists)))
+    return headings
+
+# Trigramm-Index über die Titel von data.csv
+class CatalogMatcher:
+    def __init__(self, records: List[SongRecord]):
+        self.records = records
+        self._title_grams = []
+        self._artist_grams = []
+        self._index: Dict[str, List[int]] = defaultdict(list)
+        for record_id, record in enumerate(records):
+            grams = trigrams(fold(record.title)) if len(record.title) >= MIN_TITLE_LENGTH else set()
+            self._title_grams.append(grams)
+            self._artist_grams.append(trigrams(fold(record.artist)))
+            for gram in grams:
+                self._index[gram].append(record_id)
+
+    # Beste Katalogeinträge für eine Überschrift, optional nur aus einem Buch
+    def match(self, heading: Heading, book_id: Optional[str] = None, limit: int = 2) -> List[Tuple[float, int]]:
+        grams = trigrams(fold(heading.text))
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._index.get(gram, ()))
+
+        artist_grams = [trigrams(fold(artist)) for artist in heading.artists]
+        candidates = []
+        for record_id, count in shared.items():
+            title_grams = self._title_grams[record_id]
+            # Kandidaten mit zu wenig gemeinsamen Trigrammen gar nicht erst bewerten
+            if count < MIN_TITLE_SCORE * len(title_grams):
+                continue
+            if book_id is not None and self.records[record_id].book_id != book_id:
+                continue
+            score = count / len(title_grams)
+            # Passender Interpret entscheidet zwischen gleichnamigen Titeln
+            if artist_grams:
+                own = self._artist_grams[record_id]
+                score += 0.5 * max(len(own & grams_) / len(own) for grams_ in artist_grams)
+            candidates.append((score, record_id))
+
+        candidates.sort(key=lambda candidate: (-candidate[0], -len(self._title_grams[candidate[1]])))
+        # Weitere Treffer nur, wenn sie einen anderen Teil der Zeile abdecken (zweispaltige Seiten)
+        result = []
+        covered = set()
+        for score, record_id in candidates:
+            title_grams = self._title_grams[record_id]
+            if len(title_grams & covered) > 0.5 * len(title_grams):
+                continue
+            result.append((score, record_id))
+            covered |= title_grams
+            if len(result) == limit:
+                break
+        return result
+
+# Ordne die Überschriften eines OCR-Buchs den Katalogeinträgen zu
+def match_book(matcher: CatalogMatcher, ocr_file: str, book_id: Optional[str] = None) -> Tuple[List[HeadingMatch], int, int]:
+    matches = []
+    pages = 0
+    headings_total = 0
+    for page_num, page_text in iter_ocr_file(ocr_file):
+        pages += 1
+        headings = extract_headings(page_text)
+        if len(headings) > MAX_HEADINGS_PER_PAGE:
+            continue
+        headings_total += len(headings)
+        for heading in headings:
+            for score, record_id in matcher.match(heading, book_id):
+                matches.append(HeadingMatch(page_num, heading, matcher.records[record_id], score))
+    return matches, pages, headings_total
+
+# Seitenversatz zwischen OCR-Seite und data.csv: häufigste Differenzen und zusammenhängende Abschnitte
+def detect_page_offsets(matches: List[HeadingMatch]) -> Tuple[Counter, List[Tuple[int, int, int]]]:
+    offsets = Counter()
+    runs = []
+    for match in sorted(matches, key=lambda match: match.page):
+        if match.record.page is None:
+            continue
+        offset = match.record.page - match.page
+        offsets[offset] += 1
+        if runs and runs[-1][2] == offset:
+            runs[-1] = (runs[-1][0], match.page, offset)
+        else:
+            runs.append((match.page, match.page, offset))
+    # Einzelne Ausreißer (Fehlzuordnungen) sind keine Abschnitte und
+    # unterbrechen auch keinen Abschnitt mit gleichem Versatz
+    merged = []
+    for run in runs:
+        if run[1] == run[0]:
+            continue
+        if merged and merged[-1][2] == run[2]:
+            merged[-1] = (merged[-1][0], run[1], run[2])
+        else:
+            merged.append(run)
+    return offsets, merged
+
+def report(text_files: List[str], csv_file: str = CSV_FILE) -> Dict[str, dict]:
+    records, _ = load_song_catalog(csv_file)
+    start = time.perf_counter()
+    matcher = CatalogMatcher(records)
+    logger.info(f"Trigramm-Index über {len(records)} Titel in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    results = {}
+    for text_file in text_files:
+        book_name = os.path.splitext(os.path.basename(text_file))[0]
+        book_id = BOOK_MAPPING.get(book_name)
+
+        start = time.perf_counter()
+        matches, pages, headings = match_book(matcher, text_file, book_id)
+        elapsed = time.perf_counter() - start
+
+        # Ohne Buchfilter: welches Buch aus data.csv passt am besten zu dieser OCR-Datei?
+        votes = Counter(match.record.book_id for match in match_book(matcher, text_file)[0] if match.score >= 1.0)
+        best_book = votes.most_common(1)[0][0] if votes else None
+
+        offsets, runs = detect_page_offsets(matches)
+        matched_pages = Counter(match.page for match in matches)
+        multi_song_pages = sum(1 for count in matched_pages.values() if count > 1)
+
+        logger.info(f"{book_name}: {pages} Seiten, {headings} Überschriften, {len(matches)} Zuordnungen in "
+                    f"{elapsed * 1000:.0f} ms ({headings / max(elapsed, 1e-9):.0f} Überschriften/s, "
+                    f"{pages / max(elapsed, 1e-9):.0f} Seiten/s), {multi_song_pages} Seiten mit mehreren Songs")
+        if book_id is not None and best_book is not None and best_book != book_id:
+            logger.warning(f"{book_name}: BOOK_MAPPING sagt Buch {book_id}, die Überschriften passen am besten zu Buch {best_book} "
+                           f"({dict(votes.most_common(3))})")
+        common = ", ".join(f"{offset:+d} ({count}x)" for offset, count in offsets.most_common(3))
+        logger.info(f"{book_name}: Seitenversatz data.csv - OCR: {common}")
+        for first, last, offset in runs:
+            if offset != 0 and last - first >= 5:
+                logger.info(f"{book_name}: Seiten {first}-{last} um {offset:+d} versetzt")
+
+        results[book_name] = {"pages": pages, "headings": headings, "matches": len(matches), "seconds": elapsed,
+                              "book_votes": dict(votes), "offsets": dict(offsets), "multi_song_pages": multi_song_pages}
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OCR-Überschriften den Songs aus data.csv zuordnen und Seitenversatz erkennen")
+    parser.add_argument("text_files", nargs="*", help="OCR-Textdateien (Standard: extracted/Das Ding *.txt)")
+    parser.add_argument("--csv", default=CSV_FILE, help="Song-Katalog (data.csv)")
+    args = parser.parse_args()
+    report(args.text_files or sorted(glob.glob(os.path.join(EXTRACTED_DIR, "Das Ding *.txt"))), args.csv)
+    sys.exit(0)
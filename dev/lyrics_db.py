@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import time
+import sqlite3
+import argparse
+import logging
+from typing import Dict, List, Optional
+
+# Logging einrichten
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Schema der App (SQLDelight), die Tabellen werden daraus übernommen
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "kultliederbuch", "shared", "src",
+                           "commonMain", "sqldelight", "de", "kultliederbuch", "shared", "db", "KultliederbuchDatabase.sq")
+
+# SQLDelight legt das Schema nur an, solange user_version 0 ist
+SCHEMA_VERSION = 1
+
+# Suchindex über Titel, Interpret und Songtext. Der Inhalt kommt aus einer View
+# über songs und lyrics, damit die Texte nicht doppelt in der Datei liegen.
+# Da songs keinen INTEGER PRIMARY KEY hat, darf die Datei nicht per VACUUM
+# umgeschrieben werden (die rowids könnten sich ändern).
+SEARCH_SCHEMA = """
+CREATE VIEW song_search_content AS
+    SELECT songs.rowid AS song_rowid, songs.title, songs.author, lyrics.text AS lyrics
+    FROM songs LEFT JOIN lyrics ON lyrics.song_id = songs.id;
+
+CREATE VIRTUAL TABLE song_search USING fts5(
+    title, author, lyrics,
+    content = 'song_search_content', content_rowid = 'song_rowid',
+    tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+);
+
+CREATE INDEX songs_title ON songs(title COLLATE NOCASE);
+CREATE INDEX songs_author ON songs(author COLLATE NOCASE);
+CREATE INDEX book_song_page_book ON book_song_page(book_id, page, page_notes);
+"""
+
+# Typische Suchen der App für benchmark_queries: (Name, SQL, Parameter)
+BENCHMARK_QUERIES = [
+    ("fts_title_prefix", "SELECT songs.id, songs.title, songs.author FROM song_search "
+                         "JOIN songs ON songs.rowid = song_search.rowid "
+                         "WHERE song_search MATCH ? ORDER BY rank LIMIT 50", ("title:lieb*",)),
+    ("fts_artist", "SELECT songs.id, songs.title FROM song_search JOIN songs ON songs.rowid = song_search.rowid "
+                   "WHERE song_search MATCH ? ORDER BY rank LIMIT 50", ("author:arzte",)),
+    ("fts_lyrics_snippet", "SELECT rowid, snippet(song_search, 2, '[', ']', '…', 8) FROM song_search "
+                           "WHERE song_search MATCH ? ORDER BY rank LIMIT 20", ("lyrics:\"ich bin\"",)),
+    ("fts_any_prefix", "SELECT rowid, title FROM song_search WHERE song_search MATCH ? ORDER BY rank LIMIT 50", ("sonn*",)),
+    ("like_title", "SELECT id, title, author FROM songs WHERE title LIKE ? LIMIT 50", ("%lieb%",)),
+    ("like_lyrics", "SELECT song_id FROM lyrics WHERE text LIKE ? LIMIT 20", ("%ich bin%",)),
+    ("book_page", "SELECT songs.title, songs.author FROM book_song_page JOIN songs ON songs.id = book_song_page.song_id "
+                  "WHERE book_song_page.book_id = ? AND book_song_page.page = ?", ("book_1", 100)),
+    ("book_list", "SELECT songs.title, book_song_page.page FROM book_song_page JOIN songs ON songs.id = book_song_page.song_id "
+                  "WHERE book_song_page.book_id = ? ORDER BY book_song_page.page", ("book_2",)),
+]
+
+# CREATE TABLE-Anweisungen aus der .sq-Datei (ohne die benannten Queries)
+def load_schema(schema_file: str = SCHEMA_FILE) -> List[str]:
+    with open(schema_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    return re.findall(r'CREATE TABLE[\s\S]+?\n\);', content)
+
+# Buchtitel wie im CsvImporter der App
+def book_title(book_id: str, notes: bool) -> str:
+    title = "Weihnachtslieder" if book_id == "W" else f"Buch {book_id}"
+    return f"{title} mit Noten" if notes else title
+
+# Schreibe die Songs (Format von songs_with_lyrics.json) in eine fertige SQLite-Datei
+def write_lyrics_db(songs: Dict[str, dict], db_file: str, schema_file: str = SCHEMA_FILE) -> Dict[str, int]:
+    if os.path.exists(db_file):
+        os.remove(db_file)
+
+    conn = sqlite3.connect(db_file)
+    try:
+        # Freie Seiten nach dem Aufbau des Suchindex ohne VACUUM zurückgeben
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        for statement in load_schema(schema_file):
+            conn.execute(statement)
+        conn.executescript(SEARCH_SCHEMA)
+
+        with conn:
+            # Je Buch ein Eintrag ohne und einer mit Noten, wie in der App
+            book_ids = sorted({song["book_id"] for song in songs.values()})
+            conn.executemany("INSERT INTO books(id, title, year, favorite) VALUES (?, ?, NULL, 0)",
+                             [(f"book_{book_id}{'_notes' if notes else ''}", book_title(book_id, notes))
+                              for book_id in book_ids for notes in (False, True)])
+
+            # Der Text liegt nur in lyrics, songs.lyrics bleibt wie beim CSV-Import leer
+            conn.executemany("INSERT INTO songs(id, title, author, lyrics, genre, year, favorite) VALUES (?, ?, ?, '', NULL, NULL, 0)",
+                             [(song_id, song["title"], song["artist"]) for song_id, song in songs.items()])
+            conn.executemany("INSERT INTO lyrics(song_id, text) VALUES (?, ?)",
+                             [(song_id, song["lyrics"]) for song_id, song in songs.items() if song["lyrics"]])
+
+            pages = []
+            for song_id, song in songs.items():
+                if song["book_page"] is not None:
+                    pages.append((song_id, f"book_{song['book_id']}", song["book_page"], None))
+                if song["book_page_notes"] is not None:
+                    pages.append((song_id, f"book_{song['book_id']}_notes", None, song["book_page_notes"]))
+            conn.executemany("INSERT INTO book_song_page(song_id, book_id, page, page_notes) VALUES (?, ?, ?, ?)", pages)
+
+            # Suchindex einmal komplett aufbauen und zusammenführen
+            conn.execute("INSERT INTO song_search(song_search) VALUES ('rebuild')")
+            conn.execute("INSERT INTO song_search(song_search) VALUES ('optimize')")
+
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("ANALYZE")
+        conn.executescript("PRAGMA incremental_vacuum;")
+
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ("books", "songs", "lyrics", "book_song_page")}
+    finally:
+        conn.close()
+
+    logger.info(f"SQLite-Datenbank geschrieben: {db_file} ({os.path.getsize(db_file) / 1024:.0f} KB, "
+                + ", ".join(f"{count} {table}" for table, count in counts.items()) + ")")
+    return counts
+
+# Miss die typischen Suchen gegen eine fertige Datenbank
+def benchmark_queries(db_file: str, rounds: int = 200, queries: Optional[List[tuple]] = None) -> Dict[str, dict]:
+    start = time.perf_counter()
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    open_time = time.perf_counter() - start
+    logger.info(f"Öffnen: {open_time * 1000:.2f} ms")
+
+    results = {}
+    try:
+        for name, sql, params in queries or BENCHMARK_QUERIES:
+            rows = conn.execute(sql, params).fetchall()
+            durations = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                conn.execute(sql, params).fetchall()
+                durations.append(time.perf_counter() - start)
+            durations.sort()
+            results[name] = {
+                "rows": len(rows),
+                "p50_ms": durations[len(durations) // 2] * 1000,
+                "p99_ms": durations[min(len(durations) - 1, int(len(durations) * 0.99))] * 1000,
+            }
+            logger.info(f"{name}: {len(rows)} Treffer, p50 {results[name]['p50_ms']:.3f} ms, p99 {results[name]['p99_ms']:.3f} ms")
+    finally:
+        conn.close()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Suchanfragen gegen die exportierte SQLite-Datenbank messen")
+    parser.add_argument("db_file", help="SQLite-Datei aus update_lyrics.py --sqlite")
+    parser.add_argument("--rounds", type=int, default=200, help="Wiederholungen je Anfrage")
+    args = parser.parse_args()
+    benchmark_queries(args.db_file, args.rounds)
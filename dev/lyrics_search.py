@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import time
+import struct
+import argparse
+import logging
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+# Logging einrichten
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Indexdatei: Länge des JSON-Kopfs (uint32), JSON-Kopf (Songs, Vokabular und
+# Trigramme mit Offsets), dann die Postings aller Wörter als Varint-Folgen
+# (Dokument-Delta, Gewicht) und je Trigramm die Wortnummern (Delta) im Vokabular
+INDEX_FORMAT = "lyrics-index-1"
+HEADER_LENGTH = struct.Struct('<I')
+
+# Titel und Interpret zählen mehr als ein Wort im Songtext
+TITLE_WEIGHT = 3
+ARTIST_WEIGHT = 2
+
+# BM25-Parameter
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Unscharfe Suche über Zeichen-Trigramme des Vokabulars (für OCR-Fehler und Wortteile)
+FUZZY_MIN_SIMILARITY = 0.4
+FUZZY_MAX_EXPANSIONS = 5
+
+_FOLD_TABLE = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss", "ẞ": "ss"})
+_WORD_PATTERN = re.compile(r'\w+')
+
+# Deutsche Faltung: Kleinschreibung, Umlaute ausschreiben, übrige Akzente entfernen
+def fold(text: str) -> str:
+    text = text.lower().translate(_FOLD_TABLE)
+    if text.isascii():
+        return text
+    return ''.join(char for char in unicodedata.normalize('NFKD', text) if not unicodedata.combining(char))
+
+def tokenize(text: str) -> List[str]:
+    return _WORD_PATTERN.findall(fold(text))
+
+def trigrams(term: str) -> set:
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def encode_varints(values: Iterable[int]) -> bytearray:
+    out = bytearray()
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return out
+
+def decode_varints(data) -> List[int]:
+    values = []
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = 0
+            shift = 0
+    return values
+
+# Baue den Index aus den Songs (Format von songs_with_lyrics.json) und schreibe ihn
+def build_search_index(songs: List[dict], index_file: str) -> Dict[str, int]:
+    postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+    docs = []
+    doc_lengths = []
+    for doc_id, song in enumerate(songs):
+        weights = Counter()
+        for field, weight in (("title", TITLE_WEIGHT), ("artist", ARTIST_WEIGHT), ("lyrics", 1)):
+            for term in tokenize(song.get(field) or ""):
+                weights[term] += weight
+        for term, weight in weights.items():
+            postings[term].append((doc_id, weight))
+        docs.append([song["title"], song["artist"], song["book_id"], song["book_page"]])
+        doc_lengths.append(sum(weights.values()))
+
+    # Postings delta-kodiert als Varints, Wörter alphabetisch
+    blob = bytearray()
+    terms = {}
+    for term in sorted(postings):
+        entries = postings[term]
+        values = []
+        previous = 0
+        for doc_id, weight in entries:
+            values += (doc_id - previous, weight)
+            previous = doc_id
+        data = encode_varints(values)
+        terms[term] = [len(blob), len(data), len(entries)]
+        blob.extend(data)
+
+    postings_size = len(blob)
+
+    # Trigramme des Vokabulars für die unscharfe Suche
+    vocabulary_trigrams: Dict[str, List[int]] = defaultdict(list)
+    for term_id, term in enumerate(terms):
+        for gram in trigrams(term):
+            vocabulary_trigrams[gram].append(term_id)
+    grams = {}
+    for gram in sorted(vocabulary_trigrams):
+        term_ids = vocabulary_trigrams[gram]
+        data = encode_varints(b - a for a, b in zip([0] + term_ids, term_ids))
+        grams[gram] = [len(blob), len(data)]
+        blob.extend(data)
+
+    header = json.dumps({"format": INDEX_FORMAT, "docs": docs, "doc_lengths": doc_lengths, "terms": terms,
+                         "trigrams": grams},
+                        ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    with open(index_file, 'wb') as f:
+        f.write(HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        f.write(blob)
+
+    raw_size = sum(len(entries) for entries in postings.values()) * 8
+    logger.info(f"Suchindex geschrieben: {index_file} ({os.path.getsize(index_file) / 1024:.0f} KB, {len(docs)} Songs, "
+                f"{len(terms)} Wörter, {len(grams)} Trigramme, Postings {postings_size / 1024:.0f} KB statt "
+                f"{raw_size / 1024:.0f} KB unkomprimiert)")
+    return {"docs": len(docs), "terms": len(terms), "trigrams": len(grams), "postings_bytes": postings_size}
+
+# Liest den Index per mmap, Postings werden erst bei Bedarf dekodiert
+class SearchIndex:
+    def __init__(self, index_file: str):
+        with open(index_file, 'rb') as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (length,) = HEADER_LENGTH.unpack_from(self._buf, 0)
+        header = json.loads(self._buf[HEADER_LENGTH.size:HEADER_LENGTH.size + length])
+        if header.get("format") != INDEX_FORMAT:
+            raise ValueError(f"Unbekanntes Indexformat in {index_file}: {header.get('format')}")
+        self._blob_offset = HEADER_LENGTH.size + length
+        self.docs = header["docs"]
+        self.doc_lengths = header["doc_lengths"]
+        self.terms = header["terms"]
+        self.average_length = sum(self.doc_lengths) / max(len(self.doc_lengths), 1)
+        self._trigrams = header["trigrams"]
+        self._vocabulary = list(self.terms)
+
+    def close(self):
+        self._buf.close()
+
+    def _varints(self, offset: int, length: int) -> List[int]:
+        start = self._blob_offset + offset
+        return decode_varints(self._buf[start:start + length])
+
+    def postings(self, term: str) -> List[Tuple[int, int]]:
+        entry = self.terms.get(term)
+        if entry is None:
+            return []
+        offset, length, _ = entry
+        values = self._varints(offset, length)
+        result = []
+        doc_id = 0
+        for i in range(0, len(values), 2):
+            doc_id += values[i]
+            result.append((doc_id, values[i + 1]))
+        return result
+
+    # Ähnliche Wörter des Vokabulars über gemeinsame Trigramme (Jaccard)
+    def similar_terms(self, term: str) -> List[Tuple[str, float]]:
+        grams = trigrams(term)
+        shared = Counter()
+        for gram in grams:
+            entry = self._trigrams.get(gram)
+            if entry is None:
+                continue
+            term_id = 0
+            for delta in self._varints(*entry):
+                term_id += delta
+                shared[term_id] += 1
+        # Kandidaten ohne genug gemeinsame Trigramme gar nicht erst bewerten
+        needed = math.ceil(FUZZY_MIN_SIMILARITY * len(grams))
+        matches = []
+        for term_id, count in shared.items():
+            if count < needed:
+                continue
+            candidate = self._vocabulary[term_id]
+            similarity = count / (len(grams) + len(trigrams(candidate)) - count)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                matches.append((candidate, similarity))
+        matches.sort(key=lambda match: -match[1])
+        return matches[:FUZZY_MAX_EXPANSIONS]
+
+    # BM25 über die Wörter der Anfrage; unbekannte Wörter werden unscharf erweitert
+    def search(self, query: str, limit: int = 10) -> List[Tuple[float, int]]:
+        doc_count = len(self.docs)
+        scores = defaultdict(float)
+        for query_term in tokenize(query):
+            if query_term in self.terms:
+                expansions = [(query_term, 1.0)]
+            else:
+                expansions = self.similar_terms(query_term)
+            for term, similarity in expansions:
+                df = self.terms[term][2]
+                idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+                for doc_id, weight in self.postings(term):
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / self.average_length)
+                    scores[doc_id] += similarity * idf * weight * (BM25_K1 + 1) / (weight + norm)
+        ranked = sorted(scores.items(), key=lambda item: -item[1])[:limit]
+        return [(score, doc_id) for doc_id, score in ranked]
+
+# Typische Anfragen für den Benchmark: Titel, Interpret, Textzeile, Tippfehler/OCR-Fehler, Wortteil
+BENCHMARK_QUERIES = ["über den wolken", "die ärzte", "schrei nach liebe", "griechischer wein",
+                     "freiheit grenzenlos", "hallelujah", "wolkn", "sonnensch", "atemlos durch die nacht",
+                     "country roads", "ich war noch niemals in new york", "lieb"]
+
+def benchmark_search(index: SearchIndex, queries: List[str], rounds: int = 50) -> Dict[str, float]:
+    durations = []
+    for _ in range(rounds):
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query)
+            durations.append(time.perf_counter() - start)
+    durations.sort()
+    p50 = durations[len(durations) // 2] * 1000
+    p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))] * 1000
+    logger.info(f"{len(durations)} Anfragen: p50 {p50:.3f} ms, p99 {p99:.3f} ms, max {durations[-1] * 1000:.3f} ms")
+    return {"p50_ms": p50, "p99_ms": p99}
+
+def main():
+    parser = argparse.ArgumentParser(description="Volltextsuche über Titel, Interpreten und Songtexte")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Index aus songs_with_lyrics.json bauen")
+    build.add_argument("json_file")
+    build.add_argument("index_file")
+    query = commands.add_parser("query", help="Anfrage beantworten")
+    query.add_argument("index_file")
+    query.add_argument("query", nargs="+")
+    query.add_argument("--limit", type=int, default=10)
+    bench = commands.add_parser("bench", help="Latenz typischer Anfragen messen")
+    bench.add_argument("index_file")
+    bench.add_argument("queries", nargs="*", help=f"Anfragen (Standard: {len(BENCHMARK_QUERIES)} typische)")
+    bench.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from update_lyrics import load_songs_with_lyrics
+        build_search_index(load_songs_with_lyrics(args.json_file), args.index_file)
+        return
+
+    start = time.perf_counter()
+    index = SearchIndex(args.index_file)
+    logger.info(f"Index geladen in {(time.perf_counter() - start) * 1000:.1f} ms")
+    try:
+        if args.command == "query":
+            start = time.perf_counter()
+            results = index.search(' '.join(args.query), args.limit)
+            elapsed = (time.perf_counter() - start) * 1000
+            for score, doc_id in results:
+                title, artist, book_id, page = index.docs[doc_id]
+                print(f"{score:7.2f}  {title} - {artist} (Buch {book_id}, Seite {page})")
+            logger.info(f"{len(results)} Treffer in {elapsed:.3f} ms")
+        else:
+            benchmark_search(index, args.queries or BENCHMARK_QUERIES, args.rounds)
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
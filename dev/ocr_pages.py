@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import mmap
+from collections import namedtuple
+
+# Seitenkarte eines OCR-Texts: pro "[Seite N]"-Block die Seitenzahl (wie im
+# Text geschrieben), der Offset der Markierung und der Bereich des Seiteninhalts.
+# index bildet die Seitenzahl auf den ersten Block mit dieser Nummer ab.
+PageMap = namedtuple('PageMap', ['content', 'numbers', 'marker_starts', 'starts', 'ends', 'index'])
+
+_MARKER_STR = re.compile(r'\[Seite (\d+)\]')
+_MARKER_BYTES = re.compile(rb'\[Seite (\d+)\]')
+
+def scan_pages(content):
+    """Yield (number, marker_start, start, end) for each '[Seite N]' page block of content.
+
+    content may be a str or a bytes-like buffer (bytes, mmap). A page block
+    runs from the end of its marker up to the next '[Seite' (at least one
+    character) or the end of the text, like the former
+    r'\\[Seite (\\d+)\\]([\\s\\S]+?)(?=\\[Seite|$)' pattern. The number is
+    the page number as written in the marker.
+    """
+    if isinstance(content, str):
+        marker, needle, newline = _MARKER_STR, '[Seite', '\n'
+    else:
+        marker, needle, newline = _MARKER_BYTES, b'[Seite', b'\n'
+
+    n = len(content)
+    # $ passt auch vor einem abschließenden Zeilenumbruch
+    text_end = n - 1 if n and content[n - 1:n] == newline else n
+
+    pos = content.find(needle)
+    while pos != -1:
+        match = marker.match(content, pos)
+        if match is None or match.end() >= n:
+            pos = content.find(needle, pos + 1)
+            continue
+
+        start = match.end()
+        next_pos = content.find(needle, start + 1)
+        end = next_pos if next_pos != -1 else (text_end if text_end > start else n)
+
+        number = match.group(1)
+        if not isinstance(number, str):
+            number = number.decode('ascii')
+        yield number, pos, start, end
+        pos = next_pos
+
+def build_page_map(content):
+    """Locate all '[Seite N]' page blocks of content with a single scan (see scan_pages)"""
+    numbers = []
+    marker_starts = []
+    starts = []
+    ends = []
+    index = {}
+    for number, marker_start, start, end in scan_pages(content):
+        index.setdefault(number, len(numbers))
+        numbers.append(number)
+        marker_starts.append(marker_start)
+        starts.append(start)
+        ends.append(end)
+    return PageMap(content, numbers, marker_starts, starts, ends, index)
+
+def page_span(page_map, page):
+    """(start, end) of the given page (int or page number as written), or None"""
+    i = page_map.index.get(str(page))
+    if i is None:
+        return None
+    return page_map.starts[i], page_map.ends[i]
+
+def page_text(page_map, page):
+    """Content of the given page or None; a memoryview for byte buffers (no copy)"""
+    span = page_span(page_map, page)
+    if span is None:
+        return None
+    if isinstance(page_map.content, str):
+        return page_map.content[span[0]:span[1]]
+    return memoryview(page_map.content)[span[0]:span[1]]
+
+def decode_page(data):
+    """Decode a page from a byte buffer like reading the file in text mode would"""
+    text = bytes(data).decode('utf-8', errors='replace')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+def iter_ocr_file(path):
+    """Yield (page_number, page_text) of an OCR text file one page at a time.
+
+    The file is memory-mapped and scanned lazily, so only the current page is
+    decoded into a str and memory stays flat regardless of the file size.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for number, _, start, end in scan_pages(buf):
+                yield int(number), decode_page(buf[start:end])
+
+def iter_pages(page_map):
+    """Yield (page_number, start, end) for all page blocks in text order"""
+    for number, start, end in zip(page_map.numbers, page_map.starts, page_map.ends):
+        yield int(number), start, end
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+import re
+import zlib
+import heapq
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Gleiche Songseiten in mehreren Büchern (und in Text- und Notenausgabe) finden:
+# über einen Wahrnehmungs-Hash des gerenderten Seitenbilds (nur als Kandidat, die
+# Textebenen der PDFs müssen ebenfalls übereinstimmen, dann entfällt die OCR) und über
+# MinHash/LSH auf den Wort-Shingles des Texts. Je Gruppe wird nur ein Vertreter bereinigt.
+
+# dHash: Helligkeitsvergleich benachbarter Zellen auf einem DHASH_SIZE x DHASH_SIZE Raster
+DHASH_SIZE = 16
+# Höchstens so viele abweichende Bits gelten als gleiche Seite (von DHASH_SIZE**2)
+DHASH_MAX_DISTANCE = 12
+# Bänder für die Suche: bei weniger abweichenden Bits als Bändern stimmt ein Band sicher überein
+DHASH_BANDS = 16
+
+# MinHash (Bottom-k) über Wort-3-Shingles: je Seite die MINHASH_SIZE kleinsten
+# Shingle-Hashes. LSH: Seiten, die mindestens MINHASH_SHARED dieser Werte teilen, sind
+# Kandidaten (gemeinsame Floskeln wie Copyright-Zeilen reichen dafür nicht)
+SHINGLE_SIZE = 3
+MINHASH_SIZE = 16
+MINHASH_SHARED = 4
+# Ab dieser Jaccard-Ähnlichkeit der Shingles gelten zwei Seiten als gleich
+MIN_JACCARD = 0.7
+# Zu kurze Seiten (Überschriften, Register-Reste) werden nicht gruppiert
+MIN_SHINGLES = 20
+
+_WORD_PATTERN = re.compile(r'\w+')
+
+def page_dhash(width: int, height: int, pixels: bytes) -> int:
+    """Difference hash of a grayscale page image as an int of DHASH_SIZE**2 bits"""
+    cols = DHASH_SIZE + 1
+    rows = DHASH_SIZE
+    if width < cols or height < rows:
+        return 0
+    bounds = [x * width // cols for x in range(cols + 1)]
+    cells = [[0] * cols for _ in range(rows)]
+    for y in range(height):
+        line = pixels[y * width:(y + 1) * width]
+        target = cells[y * rows // height]
+        for x in range(cols):
+            target[x] += sum(line[bounds[x]:bounds[x + 1]])
+    value = 0
+    for row in cells:
+        for x in range(DHASH_SIZE):
+            value = (value << 1) | (row[x] < row[x + 1])
+    return value
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+class PageHashRegistry:
+    """Perceptual hashes of the pages chosen for OCR, with their text layer and OCR result.
+
+    A page is registered before it is recognized; pages matching it later
+    (same image, and the same page by the shingles of their PDF text layer)
+    take over its result once it is resolved. Thread-safe, shared by all books.
+    """
+
+    def __init__(self, max_distance: int = DHASH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._band_bits = DHASH_SIZE * DHASH_SIZE // DHASH_BANDS
+        self._buckets: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        self._entries: List[Tuple[int, Hashable, set]] = []
+        self._results: Dict[Hashable, Tuple[str, Optional[Exception]]] = {}
+        self._resolved: Dict[Hashable, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def _bands(self, value: int):
+        mask = (1 << self._band_bits) - 1
+        for band in range(DHASH_BANDS):
+            yield band, (value >> (band * self._band_bits)) & mask
+
+    def _confirmed(self, value: int, layer_shingles: set) -> Tuple[Optional[Hashable], bool]:
+        """Closest image match whose text layer is the same page, and whether any image matched"""
+        found = []
+        seen = set()
+        for band in self._bands(value):
+            for index in self._buckets.get(band, ()):
+                if index in seen:
+                    continue
+                seen.add(index)
+                other, key, other_shingles = self._entries[index]
+                distance = hamming(value, other)
+                if distance <= self.max_distance:
+                    found.append((distance, index, key, other_shingles))
+        for _, _, key, other_shingles in sorted(found):
+            if same_shingles(layer_shingles, other_shingles):
+                return key, True
+        return None, bool(found)
+
+    def lookup(self, value: int, key: Hashable, layer: str) -> Tuple[Optional[Hashable], bool]:
+        """Key of a registered page that is the same page, or None after registering key.
+
+        Also returns whether the page image matched a registered page at all.
+        Pages without a usable hash or text layer are neither shared nor registered.
+        """
+        layer_shingles = shingles(layer)
+        if not value or len(layer_shingles) < MIN_SHINGLES:
+            return None, False
+        with self._lock:
+            source, candidate = self._confirmed(value, layer_shingles)
+            if source is not None:
+                return source, candidate
+            index = len(self._entries)
+            self._entries.append((value, key, layer_shingles))
+            for band in self._bands(value):
+                self._buckets[band].append(index)
+            self._resolved[key] = threading.Event()
+        return None, candidate
+
+    def resolve(self, key: Hashable, result: Tuple[str, Optional[Exception]]):
+        """Set the (text, error) of a registered page; later calls are ignored"""
+        with self._lock:
+            resolved = self._resolved.get(key)
+            if resolved is None or resolved.is_set():
+                return
+            self._results[key] = result
+        resolved.set()
+
+    def resolved(self, key: Hashable) -> bool:
+        return self._resolved[key].is_set()
+
+    def result(self, key: Hashable) -> Tuple[str, Optional[Exception]]:
+        """(text, error) of a registered page, waits until it is resolved"""
+        self._resolved[key].wait()
+        return self._results[key]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._resolved
+
+    def __len__(self):
+        return len(self._entries)
+
+def shingles(text: str) -> set:
+    """Hashed word shingles of a page text (stable across runs)"""
+    # Keine Akzentfaltung (wie in lyrics_search.fold) nötig, gleiche Seiten haben gleiche Akzente
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return set()
+    # Tupel aus CRC-Werten: ihr hash() ist anders als der von Strings in jedem Lauf gleich
+    word_hashes = {word: zlib.crc32(word.encode('utf-8')) for word in set(words)}
+    hashes = [word_hashes[word] for word in words]
+    return set(zip(hashes, hashes[1:], hashes[2:]))
+
+def minhash(values: set) -> List[int]:
+    """Bottom-k MinHash signature: the MINHASH_SIZE smallest shingle hashes"""
+    return heapq.nsmallest(MINHASH_SIZE, map(hash, values))
+
+def jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    shared = len(a & b)
+    return shared / (len(a) + len(b) - shared)
+
+def same_shingles(a: set, b: set, min_jaccard: float = MIN_JACCARD) -> bool:
+    """Whether two shingle sets are the same page (too short pages never are)"""
+    if len(a) < MIN_SHINGLES or len(b) < MIN_SHINGLES:
+        return False
+    return jaccard(a, b) >= min_jaccard
+
+def group_similar_pages(pages: Sequence[Tuple[Hashable, str]], min_jaccard: float = MIN_JACCARD) -> List[List[Hashable]]:
+    """Group near-identical page texts; returns groups of at least two keys, each in input order.
+
+    The first key of a group is its representative. Candidates share a value
+    of their MinHash signatures and are confirmed with the exact Jaccard
+    similarity of the shingle sets.
+    """
+    sets = [shingles(text) for _, text in pages]
+    buckets = defaultdict(list)
+    for i, values in enumerate(sets):
+        if len(values) < MIN_SHINGLES:
+            continue
+        for value in minhash(values):
+            buckets[value].append(i)
+
+    parent = list(range(len(pages)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    shared = Counter()
+    for members in buckets.values():
+        for a_pos, a in enumerate(members):
+            for b in members[a_pos + 1:]:
+                shared[(a, b)] += 1
+    for (a, b), count in sorted(shared.items()):
+        if count >= MINHASH_SHARED and root(a) != root(b) and jaccard(sets[a], sets[b]) >= min_jaccard:
+            # Der frühere Eintrag bleibt Vertreter
+            ra, rb = root(a), root(b)
+            parent[max(ra, rb)] = min(ra, rb)
+
+    groups = defaultdict(list)
+    for i in range(len(pages)):
+        groups[root(i)].append(pages[i][0])
+    return [members for _, members in sorted(groups.items()) if len(members) > 1]
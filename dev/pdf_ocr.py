@@ -6,7 +6,13 @@ import re
 import json
 import logging
 import tempfile
-import shutil
+import hashlib
+import argparse
+import time
+import csv
+import queue
+import threading
+import mmap
 
 # Konfiguriere Logging
 logging.basicConfig(
@@ -16,9 +22,662 @@ logging.basicConfig(
 
 logger = logging.getLogger('PDF_OCR_EXTRACTOR')
 
-def extract_text_from_pdf(pdf_path, output_dir):
-    """Extract text from PDF using OCR"""
-    logger.info(f"Processing PDF with OCR: {pdf_path}")
+# Nach der Logging-Konfiguration importieren, damit deren Format gilt
+from update_lyrics import BOOK_MAPPING, CSV_FILE
+from song_segmenter import segment_songs
+from ocr_pages import build_page_map, iter_pages, page_text, decode_page
+import pipeline_metrics as metrics
+from page_dedup import page_dhash, PageHashRegistry
+from song_export import SongExport
+
+# OCR-Einstellungen
+OCR_DPI = 300
+OCR_LANG = "deu+eng"
+OCR_PSM = "6"
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", os.cpu_count() or 1))  # Anzahl paralleler Tesseract-Prozesse
+OCR_RETRIES = 2  # Wiederholungen pro Seite bei Fehlern
+RENDER_CHUNK_PAGES = 4  # Seiten pro pdftoppm-Aufruf (-f/-l)
+RENDER_QUEUE_SIZE = 8  # Maximale Anzahl gerenderter Seiten, die auf OCR warten
+OCR_BACKEND = os.environ.get("OCR_BACKEND", "batch")  # "batch": ein Tesseract-Aufruf pro Seitenstapel, "page": ein Aufruf pro Seite
+OCR_BATCH_SIZE = 8  # Seiten pro Tesseract-Aufruf im Batch-Modus
+
+# Vorklassifikation der Seiten auf einem niedrig aufgelösten Graustufenbild
+CLASSIFY_DPI = 50
+CLASSIFY_DARK_LEVEL = 160  # Grauwerte darunter zählen als Tinte
+CLASSIFY_BLANK_INK = 0.005  # Weniger Tintenanteil: leere Seite
+CLASSIFY_LINE_FILL = 0.5  # Zeilen mit mehr Tinte gelten als horizontale Linie (Notenlinie)
+CLASSIFY_STAFF_LINES = 10  # Ab so vielen Linienzeilen: Notenseite (zwei Notensysteme)
+
+# Persistenter OCR-Cache (Schlüssel: Hash des Seitenbilds + OCR-Einstellungen)
+OCR_CACHE_DIR = os.environ.get("OCR_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".ocr_cache"))
+OCR_CACHE_MAX_BYTES = int(os.environ.get("OCR_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+def tesseract_command(img_file, out_base):
+    """tesseract call for one image (or a list file of images)"""
+    return [
+        "tesseract",
+        img_file,
+        out_base,  # Tesseract fügt .txt automatisch an
+        "-l", OCR_LANG,  # Deutsch und Englisch
+        "--psm", OCR_PSM  # Einzelner Block Text (gut für Liedtexte)
+    ]
+
+def ocr_page(img_file, out_base):
+    """OCR a single page image with tesseract and return the recognized text"""
+    subprocess.run(tesseract_command(img_file, out_base), check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    
+    with open(f"{out_base}.txt", 'r', encoding='utf-8', errors='replace') as f:
+        return f.read()
+
+def ocr_cache_key(img_file):
+    """Content hash of the page image combined with the OCR settings"""
+    h = hashlib.sha256()
+    h.update(f"{OCR_LANG}|{OCR_PSM}|{OCR_DPI}|".encode('utf-8'))
+    with open(img_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def ocr_cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], f"{key}.txt")
+
+def ocr_cache_get(cache_dir, key):
+    """Return the cached page text or None"""
+    path = ocr_cache_path(cache_dir, key)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+    except OSError:
+        return None
+    # mtime dient als LRU-Zeitstempel für die Eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return text
+
+def ocr_cache_put(cache_dir, key, text):
+    """Store page text atomically in the cache"""
+    path = ocr_cache_path(cache_dir, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def ocr_cache_evict(cache_dir, max_bytes=OCR_CACHE_MAX_BYTES):
+    """Remove least recently used entries until the cache fits into max_bytes"""
+    entries = []
+    total = 0
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    
+    if total <= max_bytes:
+        return 0
+    
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    logger.info(f"OCR cache evicted {removed} entries, {total} bytes remaining")
+    return removed
+
+# Fehler, nach denen die OCR einer Seite bzw. eines Stapels wiederholt wird
+OCR_PAGE_ERRORS = (subprocess.CalledProcessError, OSError)
+OCR_BATCH_ERRORS = OCR_PAGE_ERRORS + (ValueError,)
+
+def ocr_page_with_retry(img_file, out_base, retries=OCR_RETRIES, cache_dir=None):
+    """OCR a page, retrying on failure. Returns (text, error)"""
+    key = None
+    if cache_dir:
+        key = ocr_cache_key(img_file)
+        cached = ocr_cache_get(cache_dir, key)
+        if cached is not None:
+            return cached, None
+    
+    last_error = None
+    for attempt in range(retries + 1):
+        try:
+            text = ocr_page(img_file, out_base)
+            if key:
+                ocr_cache_put(cache_dir, key, text)
+            return text, None
+        except OCR_PAGE_ERRORS as e:
+            last_error = e
+            logger.warning(f"OCR attempt {attempt + 1} failed for {img_file}: {e}")
+    return "", last_error
+
+def ocr_batch(img_files, out_base):
+    """OCR several page images with one tesseract invocation (list-file input).
+    
+    Tesseract loads the traineddata only once and separates the pages in its
+    output with a form feed, which is used to split the text per page again.
+    """
+    list_file = write_batch_list(img_files, out_base)
+    try:
+        text = ocr_page(list_file, out_base)
+    finally:
+        os.remove(list_file)
+    return split_batch_text(text, len(img_files))
+
+def write_batch_list(img_files, out_base):
+    """Write the list file for a batch tesseract call, returns its path"""
+    list_file = f"{out_base}.list"
+    with open(list_file, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(img_files) + '\n')
+    return list_file
+
+def split_batch_text(text, count):
+    """Split the output of a batch tesseract call into the texts of its count pages.
+    
+    Each text keeps the form feed tesseract puts after every page, so it is
+    byte-identical to the output of a single-page call (ocr_page).
+    """
+    parts = text.split('\f')
+    # Nach der letzten Seite folgt ebenfalls ein Seitentrenner
+    if len(parts) < count or any(p.strip() for p in parts[count:]):
+        raise ValueError(f"Expected {count} pages from tesseract, got {len(parts)} parts")
+    return [part + '\f' for part in parts[:count]]
+
+def ocr_cache_lookup(items, cache_dir):
+    """Split (page_num, img_file) items into cached results and the pending (page_num, img_file, key)"""
+    results = {}
+    pending = []
+    for page_num, img_file in items:
+        key = ocr_cache_key(img_file) if cache_dir else None
+        cached = ocr_cache_get(cache_dir, key) if key else None
+        if cached is not None:
+            results[page_num] = (cached, None)
+        else:
+            pending.append((page_num, img_file, key))
+    return results, pending
+
+def ocr_cache_store(pending, texts, cache_dir, results):
+    """Cache the texts recognized for the pending pages and add them to results"""
+    for (page_num, _, key), text in zip(pending, texts):
+        if key:
+            ocr_cache_put(cache_dir, key, text)
+        results[page_num] = (text, None)
+    return results
+
+def ocr_batch_with_retry(items, out_base, retries=OCR_RETRIES, cache_dir=None):
+    """OCR a batch of (page_num, img_file) items. Returns {page_num: (text, error)}"""
+    results, pending = ocr_cache_lookup(items, cache_dir)
+    
+    if len(pending) > 1:
+        for attempt in range(retries + 1):
+            try:
+                texts = ocr_batch([img_file for _, img_file, _ in pending], out_base)
+            except OCR_BATCH_ERRORS as e:
+                log_batch_attempt_failed(attempt, pending, e)
+                continue
+            return ocr_cache_store(pending, texts, cache_dir, results)
+    
+    # Einzelne Seite oder fehlgeschlagener Batch: Seite für Seite
+    for page_num, img_file, _ in pending:
+        results[page_num] = ocr_page_with_retry(img_file, f"{out_base}_{page_num}", retries, cache_dir)
+    return results
+
+def log_batch_attempt_failed(attempt, pending, error):
+    logger.warning(f"Batch OCR attempt {attempt + 1} failed for pages {[p for p, _, _ in pending]}: {error}")
+
+def pdfinfo_command(pdf_path):
+    return ["pdfinfo", pdf_path]
+
+def get_pdf_page_count(pdf_path):
+    """Read the number of pages with pdfinfo"""
+    result = subprocess.run(pdfinfo_command(pdf_path), check=True, capture_output=True, text=True, errors='replace')
+    return parse_page_count(result.stdout, pdf_path)
+
+def parse_page_count(pdfinfo_output, pdf_path):
+    match = re.search(r'^Pages:\s+(\d+)', pdfinfo_output, re.MULTILINE)
+    if not match:
+        raise ValueError(f"Could not determine page count of {pdf_path}")
+    return int(match.group(1))
+
+def render_command(pdf_path, temp_dir, first, last, dpi=OCR_DPI):
+    """pdftoppm call rendering the page range first..last to PNG"""
+    # Konvertiere PDF zu Bildern mit pdftoppm (aus poppler-utils)
+    return [
+        "pdftoppm",
+        "-png",  # PNG-Format
+        "-r", str(dpi),  # 300 DPI für bessere OCR-Qualität
+        "-f", str(first),
+        "-l", str(last),
+        pdf_path,
+        os.path.join(temp_dir, f"page_{first}")
+    ]
+
+def render_pages(pdf_path, temp_dir, first, last, dpi=OCR_DPI):
+    """Render the page range first..last to PNG, returns [(page_num, img_file), ...]"""
+    subprocess.run(render_command(pdf_path, temp_dir, first, last, dpi), check=True)
+    return collect_rendered(temp_dir, first)
+
+def collect_rendered(temp_dir, first):
+    """Images written by render_command for the range starting at first, in page order"""
+    # pdftoppm hängt die echte Seitenzahl an den Dateinamen an (page_1-007.png)
+    prefix = f"page_{first}-"
+    rendered = []
+    for f in os.listdir(temp_dir):
+        if f.startswith(prefix) and f.endswith('.png'):
+            rendered.append((int(f[len(prefix):-4]), os.path.join(temp_dir, f)))
+    return sorted(rendered)
+
+def page_runs(page_nums):
+    """Contiguous runs of the given pages as [(first, last), ...], one pdftoppm call each"""
+    runs = []
+    for page_num in sorted(page_nums):
+        if runs and runs[-1][1] == page_num - 1:
+            runs[-1][1] = page_num
+        else:
+            runs.append([page_num, page_num])
+    return [(first, last) for first, last in runs]
+
+def render_page_list(pdf_path, temp_dir, page_nums):
+    """Render the given pages, one pdftoppm call per contiguous run"""
+    rendered = []
+    for first, last in page_runs(page_nums):
+        rendered.extend(render_pages(pdf_path, temp_dir, first, last))
+    return rendered
+
+def read_pgm(path):
+    """Read a binary 8-bit PGM (P5) as (width, height, pixel bytes)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    
+    # Header: Magic, Breite, Höhe, Maximalwert, Kommentare mit '#'
+    fields = []
+    pos = 0
+    while len(fields) < 4:
+        while data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b'#':
+            pos = data.index(b'\n', pos) + 1
+            continue
+        end = pos
+        while not data[end:end + 1].isspace():
+            end += 1
+        fields.append(data[pos:end])
+        pos = end
+    if fields[0] != b'P5':
+        raise ValueError(f"Unsupported image format in {path}")
+    width, height = int(fields[1]), int(fields[2])
+    return width, height, data[pos + 1:pos + 1 + width * height]
+
+# Übersetzungstabelle: dunkle Pixel -> 1, helle -> 0
+_INK_TABLE = bytes(1 if v < CLASSIFY_DARK_LEVEL else 0 for v in range(256))
+
+def classify_page_image(width, height, pixels):
+    """Classify a low-resolution grayscale page as 'blank', 'music' or 'text'"""
+    ink = pixels.translate(_INK_TABLE)
+    total = width * height
+    if not total or ink.count(1) / total < CLASSIFY_BLANK_INK:
+        return "blank"
+    
+    # Notenlinien sind lange horizontale Tintenzeilen über die halbe Seitenbreite
+    line_rows = 0
+    min_fill = width * CLASSIFY_LINE_FILL
+    for y in range(height):
+        if ink.count(1, y * width, (y + 1) * width) > min_fill:
+            line_rows += 1
+    if line_rows >= CLASSIFY_STAFF_LINES:
+        return "music"
+    return "text"
+
+def classify_command(pdf_path, temp_dir, first, last):
+    """pdftoppm call for the low-DPI grayscale render used by classify_pages"""
+    return [
+        "pdftoppm",
+        "-gray",
+        "-r", str(CLASSIFY_DPI),
+        "-f", str(first),
+        "-l", str(last),
+        pdf_path,
+        os.path.join(temp_dir, f"class_{first}")
+    ]
+
+def classify_pages(pdf_path, temp_dir, first, last, hashes=None):
+    """Classify pages first..last from a cheap low-DPI render, returns {page_num: kind}"""
+    subprocess.run(classify_command(pdf_path, temp_dir, first, last), check=True)
+    return classify_rendered(temp_dir, first, hashes)
+
+def classify_rendered(temp_dir, first, hashes=None):
+    """Classify (and remove) the images written by classify_command, returns {page_num: kind}
+    
+    If hashes is given, the perceptual hash of each page is stored there.
+    """
+    prefix = f"class_{first}-"
+    kinds = {}
+    for f in os.listdir(temp_dir):
+        if f.startswith(prefix) and f.endswith('.pgm'):
+            path = os.path.join(temp_dir, f)
+            try:
+                page_num = int(f[len(prefix):-4])
+                image = read_pgm(path)
+                kinds[page_num] = classify_page_image(*image)
+                if hashes is not None:
+                    hashes[page_num] = page_dhash(*image)
+            except (ValueError, IndexError) as e:
+                logger.warning(f"Could not classify {path}: {e}")
+            finally:
+                os.remove(path)
+    return kinds
+
+def text_layer_command(pdf_path, temp_dir, first, last):
+    """pdftotext call for the text layer of pages first..last, which confirms shared pages"""
+    return ["pdftotext", "-layout", "-f", str(first), "-l", str(last), pdf_path,
+            os.path.join(temp_dir, f"layer_{first}.txt")]
+
+def read_text_layer(temp_dir, first):
+    """Read (and remove) the file written by text_layer_command, returns {page_num: text}"""
+    path = os.path.join(temp_dir, f"layer_{first}.txt")
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            # pdftotext schließt jede Seite mit einem Seitenvorschub ab
+            texts = f.read().split('\f')
+    finally:
+        os.remove(path)
+    return {first + i: text for i, text in enumerate(texts[:-1])}
+
+def text_layer_pages(pdf_path, temp_dir, first, last):
+    """Text layer of pages first..last, returns {page_num: text}"""
+    subprocess.run(text_layer_command(pdf_path, temp_dir, first, last), check=True)
+    return read_text_layer(temp_dir, first)
+
+def load_required_pages(csv_file, book_id):
+    """Pages of a book referenced in the 'Seite' / 'Seite (Noten)' columns of data.csv"""
+    pages = set()
+    with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            if row.get("Buch", "").strip() != book_id:
+                continue
+            for column in ("Seite", "Seite (Noten)"):
+                value = (row.get(column) or "").strip()
+                if value.isdigit():
+                    pages.add(int(value))
+    return pages
+
+class BookPages:
+    """Page selection and per-page results of the OCR run of one book.
+    
+    Used by ocr_pages_streaming and book_scheduler.ocr_book, so both skip
+    and share the same pages: pages not contained in pages (if given) are
+    "unused"; after classification, blank pages are always skipped, sheet
+    music only if no page list is given.
+    With a PageHashRegistry, a page whose low-DPI image matches a page
+    selected for OCR before is only a candidate: if the PDF text layers of
+    both pages are the same page as well, it is neither rendered nor
+    recognized and takes over the OCR result of that page (source key in
+    shared[page_num]) in resolve_shared; otherwise it is recognized itself
+    and registered under the key (book, page_num). Scans without a text
+    layer are therefore always recognized themselves.
+    """
+    
+    def __init__(self, page_count, pages=None, registry=None, book=None, shared=None):
+        self.page_count = page_count
+        self.pages = pages
+        self.registry = registry
+        self.book = book
+        self.shared = shared
+        self.results = [("", None)] * page_count
+        self.skipped = {}
+        # Wahrnehmungs-Hashes aus classify_rendered, nur mit Registry
+        self.hashes = {} if registry is not None else None
+        # In der Registry angemeldete Seiten dieses Buchs und übernommene Seiten mit ihrer Quelle
+        self.registered = set()
+        self.sources = {}
+        # Bildgleiche Seiten, deren Textebene nicht passte
+        self.rejected = 0
+    
+    def chunks(self, chunk_size=RENDER_CHUNK_PAGES):
+        """(first, last, wanted pages) of each render chunk"""
+        for first in range(1, self.page_count + 1, chunk_size):
+            last = min(first + chunk_size - 1, self.page_count)
+            wanted = []
+            for page_num in range(first, last + 1):
+                if self.pages is None or page_num in self.pages:
+                    wanted.append(page_num)
+                else:
+                    self.skipped[page_num] = "unused"
+            yield first, last, wanted
+    
+    def classification_failed(self, wanted, error):
+        """Log a failed classification; returns the kinds to use instead (none: OCR all)"""
+        logger.warning(f"Page classification {wanted[0]}-{wanted[-1]} failed, OCR all: {error}")
+        return {}
+    
+    def needs_text_layer(self, wanted):
+        """Whether the text layer of wanted is needed to share or register pages"""
+        return bool(self.hashes) and any(page_num in self.hashes for page_num in wanted)
+    
+    def text_layer_failed(self, wanted, error):
+        """Log a failed text layer extraction; returns the layers to use instead (none: no sharing)"""
+        logger.warning(f"Text layer of pages {wanted[0]}-{wanted[-1]} failed, no sharing: {error}")
+        return {}
+    
+    def select(self, wanted, kinds=None, layers=None):
+        """The pages of wanted that need OCR, given their kinds from classify_rendered
+        and their text layers (text_layer_pages, only used with a registry)"""
+        keep = []
+        for page_num in wanted:
+            kind = (kinds or {}).get(page_num, "text")
+            # Auf Noten-Seiten aus data.csv steht meist auch der Liedtext
+            if kind == "blank" or (kind == "music" and self.pages is None):
+                self.skipped[page_num] = kind
+            elif not self.share(page_num, (layers or {}).get(page_num, "")):
+                keep.append(page_num)
+        return keep
+    
+    def share(self, page_num, layer):
+        """Share the page with a confirmed image match; False if the page needs OCR"""
+        if not self.hashes or page_num not in self.hashes:
+            return False
+        key = (self.book, page_num)
+        source, candidate = self.registry.lookup(self.hashes[page_num], key, layer)
+        if source is None:
+            if candidate:
+                # Ähnliches Bild, andere oder keine Textebene (z.B. fast leere Seiten)
+                self.rejected += 1
+            if key in self.registry:
+                self.registered.add(page_num)
+            return False
+        self.sources[page_num] = source
+        if self.shared is not None:
+            self.shared[page_num] = source
+        metrics.count("pages_shared")
+        metrics.log_sampled(logger, "shared_page", "%s page %d: same page as %s page %d",
+                            self.book, page_num, *source)
+        return True
+    
+    def store(self, page_num, result):
+        """Store the (text, error) of a recognized page"""
+        self.results[page_num - 1] = result
+        if page_num in self.registered:
+            self.registry.resolve((self.book, page_num), result)
+    
+    def waiting(self):
+        """Whether a source page of a shared page is still being recognized"""
+        return any(not self.registry.resolved(source) for source in self.sources.values())
+    
+    def resolve_shared(self):
+        """Take over the results of the source pages; waits for sources still being recognized"""
+        for page_num, source in self.sources.items():
+            self.results[page_num - 1] = self.registry.result(source)
+    
+    def close(self):
+        """Resolve the registered pages that were not recognized (render failure, abort)"""
+        for page_num in self.registered:
+            self.registry.resolve((self.book, page_num),
+                                  ("", RuntimeError(f"{self.book} page {page_num} was not recognized")))
+    
+    def log_sharing(self):
+        """Warn about image matches the text layer did not confirm"""
+        if self.rejected:
+            logger.warning(f"{self.book}: {self.rejected} pages looked like an already recognized page, "
+                           f"but their text layer differs or is missing; they were recognized themselves")
+            metrics.count("pages_share_rejected", self.rejected)
+    
+    def fail(self, page_nums, error):
+        for page_num in page_nums:
+            self.store(page_num, ("", error))
+
+def log_skipped_pages(skipped, page_count):
+    """Log and count the pages skipped without OCR by kind"""
+    if not skipped:
+        return
+    kinds = {}
+    for kind in skipped.values():
+        kinds[kind] = kinds.get(kind, 0) + 1
+    logger.info(f"Skipped {len(skipped)} of {page_count} pages without OCR: {kinds}")
+    metrics.count("pages_skipped", len(skipped))
+
+def ocr_pages_streaming(pdf_path, page_count, temp_dir, workers=OCR_WORKERS, cache_dir=OCR_CACHE_DIR,
+                        chunk_size=RENDER_CHUNK_PAGES, queue_size=RENDER_QUEUE_SIZE, backend=OCR_BACKEND,
+                        pages=None, classify=True, registry=None, book=None, shared=None):
+    """Render page ranges on demand and OCR them concurrently.
+    
+    A producer thread renders chunk_size pages at a time into a bounded queue,
+    the OCR workers delete each image once it is processed, so the number of
+    page images on disk is bounded by queue_size + chunk_size + workers.
+    With backend "batch" each worker hands up to OCR_BATCH_SIZE queued pages
+    to a single tesseract process.
+    
+    With classify, a low-DPI render decides beforehand which pages are
+    blank or sheet music; which pages are skipped or shared (registry,
+    requires classify) is decided by BookPages.
+    Returns a list of (text, error) in page order and the skipped pages by kind.
+    """
+    book_pages = BookPages(page_count, pages, registry, book, shared)
+    batch_size = OCR_BATCH_SIZE if backend == "batch" else 1
+    page_queue = queue.Queue(maxsize=max(1, queue_size))
+    workers = max(1, workers)
+    done = [0]
+    done_lock = threading.Lock()
+    producer_errors = []
+    
+    def producer():
+        try:
+            produce()
+        except Exception as e:
+            producer_errors.append(e)
+        finally:
+            # Die Worker beenden sich auch, wenn das Rendern abbricht
+            for _ in range(workers):
+                page_queue.put(None)
+    
+    def produce():
+        for first, last, wanted in book_pages.chunks(chunk_size):
+            kinds = None
+            if classify and wanted:
+                try:
+                    with metrics.stage("classify"):
+                        kinds = classify_pages(pdf_path, temp_dir, wanted[0], wanted[-1], book_pages.hashes)
+                except (subprocess.CalledProcessError, OSError) as e:
+                    kinds = book_pages.classification_failed(wanted, e)
+            layers = None
+            if book_pages.needs_text_layer(wanted):
+                try:
+                    with metrics.stage("text_layer"):
+                        layers = text_layer_pages(pdf_path, temp_dir, wanted[0], wanted[-1])
+                except (subprocess.CalledProcessError, OSError) as e:
+                    layers = book_pages.text_layer_failed(wanted, e)
+            wanted = book_pages.select(wanted, kinds, layers)
+            if not wanted:
+                continue
+            
+            try:
+                with metrics.stage("render"):
+                    rendered = render_page_list(pdf_path, temp_dir, wanted)
+            except (subprocess.CalledProcessError, OSError) as e:
+                logger.error(f"Rendering pages {first}-{last} of {pdf_path} failed: {e}")
+                book_pages.fail(wanted, e)
+                continue
+            for item in rendered:
+                page_queue.put(item)
+    
+    def consumer():
+        while True:
+            item = page_queue.get()
+            if item is None:
+                return
+            # Im Batch-Modus alle bereits gerenderten Seiten mitnehmen
+            batch = [item]
+            stop = False
+            while len(batch) < batch_size:
+                try:
+                    item = page_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            
+            out_base = os.path.join(temp_dir, f"ocr_{batch[0][0]}")
+            # Die OCR-Zeit wird über alle Worker summiert
+            with metrics.stage("ocr"):
+                try:
+                    if backend == "batch":
+                        batch_results = ocr_batch_with_retry(batch, out_base, OCR_RETRIES, cache_dir)
+                    else:
+                        batch_results = {page_num: ocr_page_with_retry(img_file, out_base, OCR_RETRIES, cache_dir)
+                                         for page_num, img_file in batch}
+                except Exception as e:
+                    # Der Worker muss weiterlaufen, sonst blockiert der Producer an der vollen Queue
+                    logger.error(f"OCR of pages {[p for p, _ in batch]} failed: {e}")
+                    batch_results = {page_num: ("", e) for page_num, _ in batch}
+            metrics.count("pages_ocr", len(batch))
+            
+            for page_num, img_file in batch:
+                book_pages.store(page_num, batch_results[page_num])
+                try:
+                    os.remove(img_file)
+                except OSError:
+                    pass
+            with done_lock:
+                done[0] += len(batch)
+                metrics.log_sampled(logger, "ocr_batch", "Processed pages %s (%d of %d done)",
+                                    [p for p, _ in batch], done[0], page_count)
+            if stop:
+                return
+    
+    # Tesseract läuft als eigener Prozess, daher reichen Threads
+    threads = [threading.Thread(target=producer, daemon=True)]
+    threads += [threading.Thread(target=consumer, daemon=True) for _ in range(workers)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        # Seiten anderer Bücher, die diese Seiten übernehmen, warten sonst ewig
+        book_pages.close()
+    if producer_errors:
+        raise producer_errors[0]
+    book_pages.resolve_shared()
+    book_pages.log_sharing()
+    return book_pages.results, book_pages.skipped
+
+def extract_text_from_pdf(pdf_path, output_dir, workers=OCR_WORKERS, cache_dir=OCR_CACHE_DIR, backend=OCR_BACKEND,
+                          pages=None, classify=True, registry=None, shared=None):
+    """Extract text from PDF using OCR
+    
+    registry and shared are passed on to ocr_pages_streaming.
+    """
+    logger.info(f"Processing PDF with OCR: {pdf_path} ({workers} workers, {backend} backend)")
     
     # Erstelle Basisnamen für die Ausgabedatei
     base_name = os.path.basename(pdf_path)
@@ -28,87 +687,77 @@ def extract_text_from_pdf(pdf_path, output_dir):
     # Erstelle temporäres Verzeichnis für die Bildausgabe
     with tempfile.TemporaryDirectory() as temp_dir:
         try:
-            # Konvertiere PDF zu Bildern mit pdftoppm (aus poppler-utils)
-            cmd_convert = [
-                "pdftoppm", 
-                "-png",  # PNG-Format
-                "-r", "300",  # 300 DPI für bessere OCR-Qualität
-                pdf_path,
-                os.path.join(temp_dir, "page")
-            ]
-            subprocess.run(cmd_convert, check=True)
-            logger.info(f"Successfully converted {pdf_path} to images")
-            
-            # Liste der erzeugten Bilddateien
-            image_files = sorted([os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if f.endswith('.png')])
-            logger.info(f"Generated {len(image_files)} page images")
-            
-            # OCR mit Tesseract für jede Seite
-            all_text = []
-            for i, img_file in enumerate(image_files):
-                # OCR mit Tesseract
-                temp_txt = os.path.join(temp_dir, f"page_{i}.txt")
-                cmd_ocr = [
-                    "tesseract",
-                    img_file,
-                    os.path.splitext(temp_txt)[0],  # Tesseract fügt .txt automatisch an
-                    "-l", "deu+eng",  # Deutsch und Englisch
-                    "--psm", "6"  # Einzelner Block Text (gut für Liedtexte)
-                ]
-                subprocess.run(cmd_ocr, check=True)
-                
-                # Seitenu00fcberschrift hinzufu00fcgen
-                with open(temp_txt, 'r', encoding='utf-8', errors='replace') as f:
-                    page_text = f.read()
-                    
-                all_text.append(f"[Seite {i+1}]\n{page_text}\n\n")
-                
-                logger.info(f"Processed page {i+1} of {len(image_files)}")
+            page_count = get_pdf_page_count(pdf_path)
+            logger.info(f"{pdf_path} has {page_count} pages")
             
-            # Alle Texte in einer Datei zusammenfu00fchren
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(''.join(all_text))
+            # Rendern und OCR laufen überlappend, Seite für Seite
+            results, skipped = ocr_pages_streaming(pdf_path, page_count, temp_dir, workers, cache_dir,
+                                                   backend=backend, pages=pages, classify=classify,
+                                                   registry=registry, book=book_name, shared=shared)
+            log_skipped_pages(skipped, page_count)
+            if cache_dir:
+                ocr_cache_evict(cache_dir)
             
-            logger.info(f"OCR complete: output saved to {output_file}")
+            write_ocr_text(results, pdf_path, output_file)
             return output_file
         
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, ValueError) as e:
             logger.error(f"Error during PDF processing: {e}")
             return None
 
+def write_ocr_text(results, pdf_path, output_file):
+    """Write the per-page (text, error) results of a PDF as one '[Seite N]' text file"""
+    # Seitenüberschrift hinzufügen, Reihenfolge bleibt erhalten
+    all_text = []
+    failed_pages = []
+    for i, (page_text, error) in enumerate(results):
+        if error is not None:
+            failed_pages.append(i + 1)
+        all_text.append(f"[Seite {i+1}]\n{page_text}\n\n")
+    
+    if failed_pages:
+        logger.error(f"OCR failed for {len(failed_pages)} pages of {pdf_path}: {failed_pages}")
+    
+    # Alle Texte in einer Datei zusammenführen
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(''.join(all_text))
+    
+    logger.info(f"OCR complete: output saved to {output_file}")
+
 def parse_song_structure(text_file):
     """Versuche, Songtitel, Künstler und Lyrics aus dem OCR-Text zu extrahieren"""
     logger.info(f"Parsing song structure from {text_file}")
     
-    with open(text_file, 'r', encoding='utf-8', errors='replace') as f:
-        content = f.read()
-    
     # Extrahiere Buch-ID aus dem Dateinamen
     base_name = os.path.basename(text_file)
     match = re.search(r'Das Ding (\d+)', base_name)
     book_id = match.group(1) if match else "unknown"
     
-    # Teile den Text in Seitenblöcke
-    page_pattern = r'\[Seite (\d+)\]([\s\S]+?)(?=\[Seite|$)'
-    pages = re.finditer(page_pattern, content)
+    # Datei per mmap lesen, die Seiten werden einzeln dekodiert
+    if os.path.getsize(text_file) == 0:
+        logger.info(f"Total songs found in {text_file}: 0")
+        return []
+    with open(text_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+        return parse_song_pages(content, text_file, book_id)
+
+def parse_song_pages(content, text_file, book_id):
+    """Extract songs from the memory-mapped OCR text of one book"""
+    # Teile den Text einmalig in Seitenblöcke
+    page_map = build_page_map(content)
     
     songs = []
-    for page_match in pages:
-        page_num = page_match.group(1)
-        page_content = page_match.group(2)
+    for page_num, start, end in iter_pages(page_map):
+        page_content = decode_page(content[start:end])
         
         # Suche nach Songblöcken in der Seite
         # In Songbüchern ist oft ein Überschriften-Muster erkennbar:
         # Nummer + Titel + Künstler, dann Leerzeile, dann Text
-        song_pattern = r'(\d+)[.\s]+(.*?)\s+[-–]\s+(.*?)\n\s*\n([\s\S]+?)(?=\d+[.\s]+|$)'
-        song_matches = re.finditer(song_pattern, page_content)
-        
-        for song_match in song_matches:
+        for span in segment_songs(page_content, "page"):
             try:
-                number = song_match.group(1).strip()
-                title = song_match.group(2).strip()
-                artist = song_match.group(3).strip()
-                lyrics = song_match.group(4).strip()
+                number = span.number.strip()
+                title = span.title.strip()
+                artist = span.artist.strip()
+                lyrics = page_content[span.body_start:span.body_end].strip()
                 
                 # Bereinige den Liedtext (entferne überflüssige Leerzeichen und Zeilenumbrüche)
                 lyrics = re.sub(r'\s+', ' ', lyrics)
@@ -119,23 +768,23 @@ def parse_song_structure(text_file):
                     'title': title,
                     'artist': artist,
                     'lyrics': lyrics,
-                    'page': int(page_num),
+                    'page': page_num,
                     'book': f"ding_{book_id}"
                 }
                 
                 songs.append(song)
-                logger.info(f"Found song: {title} by {artist} on page {page_num}")
+                metrics.log_sampled(logger, "song", "Found song: %s by %s on page %s", title, artist, page_num)
             except Exception as e:
                 logger.error(f"Error processing song match: {e}")
     
     # Zweite Methode: Suche nach Mustern basierend auf Inhaltsverzeichnis
     if len(songs) == 0:
         # Suche nach Inhaltsverzeichnis
-        toc_pattern = r'(?:Inhaltsverzeichnis|Inhalt)([\s\S]+?)(?:\[Seite|$)'
+        toc_pattern = rb'(?:Inhaltsverzeichnis|Inhalt)([\s\S]+?)(?:\[Seite|$)'
         toc_match = re.search(toc_pattern, content)
         
         if toc_match:
-            toc_content = toc_match.group(1)
+            toc_content = decode_page(toc_match.group(1))
             # Typische Inhaltsverzeichniseinträge: Titel ... Seitenzahl
             toc_entries = re.finditer(r'([^\n.]+?)\s*\.+\s*(\d+)', toc_content)
             
@@ -143,12 +792,11 @@ def parse_song_structure(text_file):
                 title = entry.group(1).strip()
                 page = entry.group(2).strip()
                 
-                # Suche nach dem Songtext auf der referenzierten Seite
-                page_pattern = r'\[Seite ' + page + r'\]([\s\S]+?)(?=\[Seite|$)'
-                page_match = re.search(page_pattern, content)
+                # Songtext der referenzierten Seite aus der Seitenkarte
+                page_content = page_text(page_map, page)
                 
-                if page_match:
-                    page_content = page_match.group(1)
+                if page_content is not None:
+                    page_content = decode_page(page_content)
                     
                     # Versuche, den Künstler und den Text zu extrahieren
                     artist_pattern = r'(.+?)\s*[-–]\s*(.+?)\n'
@@ -182,62 +830,127 @@ def parse_song_structure(text_file):
                     }
                     
                     songs.append(song)
-                    logger.info(f"Found song from TOC: {title} on page {page}")
+                    metrics.log_sampled(logger, "toc_song", "Found song from TOC: %s on page %s", title, page)
     
     logger.info(f"Total songs found in {text_file}: {len(songs)}")
     return songs
 
-def process_pdfs(pdf_dir, output_dir):
-    """Verarbeite alle 'Das Ding' PDFs im Verzeichnis"""
+def process_pdfs(pdf_dir, output_dir, workers=OCR_WORKERS, cache_dir=OCR_CACHE_DIR, backend=OCR_BACKEND,
+                 csv_file=None, share_duplicates=False, shard_dir=None):
+    """Verarbeite alle 'Das Ding' PDFs im Verzeichnis
+    
+    Mit csv_file werden nur die in data.csv referenzierten Seiten eines Buchs erkannt.
+    Mit share_duplicates bekommen Seiten, deren Bild und Textebene einer schon erkannten
+    Seite gleichen, ohne eigene OCR deren Text (Bericht in shared_pages.json).
+    Die Songs werden je Buch geschrieben, sobald es fertig ist; mit shard_dir
+    zusätzlich als NDJSON-Shard je Buch (song_export.py). Gibt die Anzahl der Songs zurück.
+    """
     os.makedirs(output_dir, exist_ok=True)
     
     # Finde alle Das Ding PDFs
     pdf_files = [f for f in os.listdir(pdf_dir) if f.endswith('.pdf') and 'Das Ding' in f]
     logger.info(f"Found {len(pdf_files)} PDF files to process")
     
-    all_songs = []
+    registry = PageHashRegistry() if share_duplicates else None
+    shared_pages = {}
+    with SongExport(output_dir, shard_dir) as export:
+        for pdf_file in pdf_files:
+            pdf_path = os.path.join(pdf_dir, pdf_file)
+            
+            # Benötigte Seiten laut data.csv
+            pages = None
+            book_id = BOOK_MAPPING.get(os.path.splitext(pdf_file)[0])
+            if csv_file and book_id:
+                pages = load_required_pages(csv_file, book_id)
+                logger.info(f"{len(pages)} pages of {pdf_file} are referenced in {csv_file}")
+            
+            # Konvertiere PDF zu Text mit OCR
+            shared = shared_pages.setdefault(os.path.splitext(pdf_file)[0], {}) if registry is not None else None
+            text_file = extract_text_from_pdf(pdf_path, output_dir, workers, cache_dir, backend, pages,
+                                              registry=registry, shared=shared)
+            if not text_file:
+                logger.error(f"Failed to extract text from {pdf_file}")
+                continue
+            
+            # Extrahiere Songs aus dem Text
+            with metrics.stage("segment"):
+                songs = parse_song_structure(text_file)
+            metrics.count("songs", len(songs))
+            with metrics.stage("export"):
+                export.add(songs)
     
-    for pdf_file in pdf_files:
-        pdf_path = os.path.join(pdf_dir, pdf_file)
-        
-        # Konvertiere PDF zu Text mit OCR
-        text_file = extract_text_from_pdf(pdf_path, output_dir)
-        if not text_file:
-            logger.error(f"Failed to extract text from {pdf_file}")
-            continue
+    if registry is not None:
+        write_shared_pages(shared_pages, output_dir)
+    log_song_export(export, shard_dir)
+    return export.count
+
+def write_shared_pages(shared_pages, output_dir):
+    """Write {book: {page: [source book, source page]}} of the pages taken over without OCR"""
+    report = {book: {str(page): list(source) for page, source in sorted(pages.items())}
+              for book, pages in shared_pages.items() if pages}
+    report_file = os.path.join(output_dir, 'shared_pages.json')
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"{sum(len(pages) for pages in report.values())} pages taken over from other books, see {report_file}")
+
+def log_song_export(export, shard_dir=None):
+    """Log where a finished SongExport wrote the songs"""
+    logger.info(f"Saved {export.count} songs to {export.json_output}")
+    logger.info(f"Saved songs to CSV: {export.csv_output}")
+    if shard_dir:
+        logger.info(f"Saved per-book NDJSON shards to {shard_dir}")
+
+def benchmark_ocr_backends(pdf_path, max_pages=16):
+    """Compare one tesseract process per page against the batch backend on the same pages"""
+    page_count = min(get_pdf_page_count(pdf_path), max_pages)
+    timings = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        items = render_pages(pdf_path, temp_dir, 1, page_count)
+        logger.info(f"Benchmarking OCR backends on {len(items)} pages of {pdf_path}")
         
-        # Extrahiere Songs aus dem Text
-        songs = parse_song_structure(text_file)
-        all_songs.extend(songs)
-    
-    # Speichere alle Songs im JSON-Format
-    json_output = os.path.join(output_dir, 'all_songs.json')
-    with open(json_output, 'w', encoding='utf-8') as f:
-        json.dump(all_songs, f, ensure_ascii=False, indent=2)
-    
-    logger.info(f"Saved {len(all_songs)} songs to {json_output}")
-    
-    # Erstelle auch eine CSV-Datei für den direkten Import
-    csv_output = os.path.join(output_dir, 'songs_export.csv')
-    with open(csv_output, 'w', encoding='utf-8') as f:
-        # Schreibe CSV-Header
-        f.write("Seite (Noten),Seite,Buch,Künstler,Titel\n")
+        start = time.perf_counter()
+        for page_num, img_file in items:
+            ocr_page(img_file, os.path.join(temp_dir, f"bench_page_{page_num}"))
+        timings["page"] = time.perf_counter() - start
         
-        # Schreibe Songs
-        for song in all_songs:
-            book_id = song['book'].replace('ding_', '')
-            f.write(f",{song['page']},{book_id},{song['artist']},{song['title']}\n")
+        start = time.perf_counter()
+        for i in range(0, len(items), OCR_BATCH_SIZE):
+            chunk = items[i:i + OCR_BATCH_SIZE]
+            ocr_batch([img_file for _, img_file in chunk], os.path.join(temp_dir, f"bench_batch_{i}"))
+        timings["batch"] = time.perf_counter() - start
     
-    logger.info(f"Saved songs to CSV: {csv_output}")
-    return all_songs
+    for backend, seconds in timings.items():
+        logger.info(f"{backend:>5}: {seconds:.2f}s total, {seconds / max(1, len(items)):.2f}s per page")
+    logger.info(f"Speedup batch vs. page: {timings['page'] / max(timings['batch'], 1e-9):.2f}x")
+    return timings
 
 def main():
     pdf_dir = "/var/www/kultliederbuch.z11.de/dev"
     output_dir = "/var/www/kultliederbuch.z11.de/dev/extracted"
     
+    parser = argparse.ArgumentParser(description="OCR der 'Das Ding' PDFs")
+    parser.add_argument("--workers", type=int, default=OCR_WORKERS, help="Anzahl paralleler OCR-Worker")
+    parser.add_argument("--backend", choices=["batch", "page"], default=OCR_BACKEND, help="OCR-Backend")
+    parser.add_argument("--benchmark", metavar="PDF", help="Nur die OCR-Backends auf dieser PDF vergleichen")
+    parser.add_argument("--all-pages", action="store_true", help="Alle Seiten erkennen, nicht nur die aus data.csv")
+    parser.add_argument("--share-duplicates", action="store_true",
+                        help="Seiten, deren Bild und Textebene einer schon erkannten Seite gleichen, "
+                             "ohne OCR deren Text geben")
+    parser.add_argument("--shards", metavar="DIR", help="Songs zusätzlich als NDJSON je Buch mit Manifest hier ablegen")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    
+    if args.benchmark:
+        benchmark_ocr_backends(args.benchmark)
+        return
+    
     logger.info("Starting PDF OCR extraction process")
-    songs = process_pdfs(pdf_dir, output_dir)
-    logger.info(f"OCR extraction complete. Total songs extracted: {len(songs)}")
+    metrics.start(args)
+    song_count = process_pdfs(pdf_dir, output_dir, args.workers, backend=args.backend,
+                         csv_file=None if args.all_pages else CSV_FILE, share_duplicates=args.share_duplicates,
+                         shard_dir=args.shards)
+    logger.info(f"OCR extraction complete. Total songs extracted: {song_count}")
+    metrics.finish(args, logger)
 
 if __name__ == "__main__":
     main()
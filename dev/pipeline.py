@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import pipeline_metrics as metrics
+from update_lyrics import (BOOK_MAPPING, CSV_FILE, EXTRACTED_DIR, OUTPUT_DIR, SONGS_CSV_HEADER,
+                           load_song_page_mapping, stream_pages_from_ocr, page_hash, clean_lyrics_batch,
+                           assign_page_lyrics, songs_csv_row)
+from lyrics_db import write_lyrics_db
+from binary_catalog import write_binary_catalog
+from song_export import json_array_element
+from catalog_keys import CATALOG_INDEX_FILE, write_catalog_index
+
+# Logging einrichten
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Inkrementeller Lauf der ganzen Pipeline: PDF -> OCR-Text -> songs_with_lyrics.json/.csv.
+# Der Zustand (build_state.json im Ausgabeverzeichnis) merkt sich die Fingerabdrücke
+# aller Eingaben (PDFs, OCR-Texte je Seite, CSV-Zeilen je Song) und wo jeder Song in
+# den Ausgabedateien steht. Neu berechnet werden nur Songs, deren Zeile oder Quellseite
+# sich geändert hat; unveränderte Songs werden als Bytes aus den alten Ausgaben übernommen.
+STATE_FORMAT = "pipeline-state-1"
+STATE_FILE = "build_state.json"
+JSON_OUTPUT = "songs_with_lyrics.json"
+CSV_OUTPUT = "songs_with_lyrics.csv"
+
+# Ändert sich der Code der Bereinigung, ist kein gespeichertes Ergebnis mehr gültig
+CODE_FILES = ("update_lyrics.py", "chord_tokenizer.py", "ocr_pages.py", "song_export.py", "catalog_keys.py",
+              "lyrics_search.py", "song_segmenter.py", "page_dedup.py", "binary_catalog.py", "lyrics_db.py",
+              "pipeline.py")
+
+HASH_CHUNK = 1 << 20
+
+def file_sha1(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Fingerabdruck einer Datei; bei gleicher Größe und mtime wird der alte Hash übernommen
+def file_fingerprint(path: str, previous: Optional[dict] = None) -> Optional[dict]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime_ns") == stat.st_mtime_ns:
+        return previous
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": file_sha1(path)}
+
+def code_fingerprint() -> str:
+    base = os.path.dirname(os.path.abspath(__file__))
+    return hashlib.sha1(''.join(file_sha1(os.path.join(base, name)) for name in CODE_FILES).encode()).hexdigest()
+
+def load_state(state_file: str) -> dict:
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return state if state.get("format") == STATE_FORMAT else {}
+
+# Eintrag eines Songs im flachen JSON (Element der mit indent=2 geschriebenen Liste)
+def json_element(song: dict) -> bytes:
+    return json_array_element(song).encode('utf-8')
+
+def json_document(elements: List[bytes]) -> Tuple[bytes, List[int]]:
+    if not elements:
+        return b"[]", []
+    offsets = []
+    parts = [b"[\n"]
+    position = 2
+    for i, element in enumerate(elements):
+        if i:
+            parts.append(b",\n")
+            position += 2
+        offsets.append(position)
+        parts.append(element)
+        position += len(element)
+    parts.append(b"\n]")
+    return b"".join(parts), offsets
+
+def csv_document(rows: List[Optional[bytes]]) -> Tuple[bytes, List[int]]:
+    header = SONGS_CSV_HEADER.encode('utf-8')
+    offsets = []
+    position = len(header)
+    for row in rows:
+        offsets.append(position)
+        position += len(row) if row else 0
+    return header + b"".join(row for row in rows if row), offsets
+
+# Ersetze die alte Datei durch content, falls sich etwas geändert hat. Die Datei wird
+# immer ganz neu geschrieben, in eine temporäre Datei, die erst fertig die alte ersetzt:
+# ein abgebrochener Lauf hinterlässt keine Mischung aus altem und neuem Stand. Liefert
+# die Zahl der geschriebenen Bytes (0, wenn die Datei unverändert bleibt).
+def replace_file(path: str, content: bytes, old: Optional[bytes]) -> int:
+    if old is not None and old == content:
+        return 0
+    with open(path + ".tmp", 'wb') as f:
+        f.write(content)
+    os.replace(path + ".tmp", path)
+    return len(content)
+
+# Gespeicherte Ausgabe nur verwenden, wenn sie noch genau der Stand des letzten Laufs ist
+def read_output(path: str, expected_sha1: Optional[str]) -> Optional[bytes]:
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if expected_sha1 is None or hashlib.sha1(data).hexdigest() != expected_sha1:
+        return None
+    return data
+
+# OCR für Bücher, deren PDF oder Seitenliste sich geändert hat (der OCR-Cache von
+# pdf_ocr sorgt dafür, dass unveränderte Seiten nicht neu erkannt werden)
+def refresh_ocr(pdf_dir: str, extracted_dir: str, csv_file: str, state: dict, new_state: dict, workers: int) -> List[str]:
+    # Erst hier importieren: pdf_ocr braucht tesseract und pdftoppm
+    import pdf_ocr
+    refreshed = []
+    for book_name, book_id in BOOK_MAPPING.items():
+        pdf_path = os.path.join(pdf_dir, f"{book_name}.pdf")
+        previous = state.get("pdfs", {}).get(book_name, {})
+        fingerprint = file_fingerprint(pdf_path, previous.get("file"))
+        if fingerprint is None:
+            continue
+        required = sorted(pdf_ocr.load_required_pages(csv_file, book_id))
+        text_file = os.path.join(extracted_dir, f"{book_name}.txt")
+        unchanged = (previous.get("file") == fingerprint and os.path.exists(text_file)
+                     and set(required) <= set(previous.get("pages", ())))
+        if not unchanged:
+            logger.info(f"{book_name}: PDF oder benötigte Seiten geändert, OCR wird aktualisiert")
+            with metrics.stage("ocr"):
+                if pdf_ocr.extract_text_from_pdf(pdf_path, extracted_dir, workers, pages=set(required)) is None:
+                    logger.error(f"OCR für {pdf_path} fehlgeschlagen")
+                    continue
+            refreshed.append(book_name)
+        new_state.setdefault("pdfs", {})[book_name] = {"file": fingerprint, "pages": required}
+    return refreshed
+
+# Seitentabelle eines OCR-Texts: {Seite: [Position, Hash]}, bei doppelten Seiten gilt die letzte
+# (wie in update_song_lyrics); texts erhält die Inhalte der Seiten aus wanted
+def scan_book(ocr_file: str, wanted=(), texts: Optional[dict] = None) -> Dict[str, list]:
+    pages = {}
+    for ordinal, (page_num, page_content) in enumerate(stream_pages_from_ocr(ocr_file)):
+        pages[str(page_num)] = [ordinal, page_hash(page_content)]
+        if texts is not None and page_num in wanted:
+            texts[page_num] = page_content
+    return pages
+
+def build(csv_file: str = CSV_FILE, extracted_dir: str = EXTRACTED_DIR, output_dir: str = OUTPUT_DIR,
+          pdf_dir: Optional[str] = None, full: bool = False, sqlite_file: Optional[str] = None,
+          binary_file: Optional[str] = None, workers: int = 1) -> Dict[str, int]:
+    os.makedirs(output_dir, exist_ok=True)
+    state_file = os.path.join(output_dir, STATE_FILE)
+    state = {} if full else load_state(state_file)
+    code = code_fingerprint()
+    if state and state.get("code") != code:
+        logger.info("Code der Pipeline geändert, alles wird neu berechnet")
+        state = {}
+    new_state = {"format": STATE_FORMAT, "code": code}
+
+    if pdf_dir:
+        refresh_ocr(pdf_dir, extracted_dir, csv_file, state, new_state, workers)
+
+    # Fingerabdrücke der OCR-Texte; Seiten nur bei geänderter Datei neu hashen
+    with metrics.stage("fingerprint"):
+        books = {}
+        for book_name, book_id in BOOK_MAPPING.items():
+            ocr_file = os.path.join(extracted_dir, f"{book_name}.txt")
+            previous = state.get("books", {}).get(book_name)
+            fingerprint = file_fingerprint(ocr_file, previous and previous["file"])
+            if fingerprint is None:
+                continue
+            if previous and previous["file"]["sha1"] == fingerprint["sha1"]:
+                pages = previous["pages"]
+            else:
+                pages = scan_book(ocr_file)
+                metrics.count("books_rescanned")
+            books[book_id] = {"name": book_name, "file": fingerprint, "pages": pages}
+        new_state["books"] = {book["name"]: {"file": book["file"], "pages": book["pages"]} for book in books.values()}
+
+    with metrics.stage("csv"):
+        songs_by_page, song_data = load_song_page_mapping(csv_file)
+
+    # Quellseite je Song: von seinen Seiten die im OCR-Text zuletzt stehende
+    with metrics.stage("fingerprint"):
+        sources = {}
+        for book_id, pages in songs_by_page.items():
+            book = books.get(book_id)
+            if book is None:
+                continue
+            for page_num, entries in pages.items():
+                page = book["pages"].get(str(page_num))
+                if page is None:
+                    continue
+                for song_id, _, _ in entries:
+                    if song_id not in sources or sources[song_id][1] < page[0]:
+                        sources[song_id] = (page_num, page[0], page[1])
+
+        # Fingerabdruck eines Songs: CSV-Zeile, Quellseite und deren Inhalt
+        previous_songs = state.get("songs", {})
+        fingerprints = {}
+        stale = defaultdict(dict)
+        for song_id, song in song_data.items():
+            source = sources.get(song_id)
+            key = json.dumps([song, source and [song["book_id"], source[0], source[2]]], ensure_ascii=False)
+            fingerprints[song_id] = hashlib.sha1(key.encode('utf-8')).hexdigest()
+            previous = previous_songs.get(song_id)
+            if previous is None or previous[0] != fingerprints[song_id]:
+                stale[song["book_id"]][song_id] = source
+
+    old_json = read_output(os.path.join(output_dir, JSON_OUTPUT), state.get("outputs", {}).get("json"))
+    old_csv = read_output(os.path.join(output_dir, CSV_OUTPUT), state.get("outputs", {}).get("csv"))
+    if old_json is None or old_csv is None:
+        # Ohne die alten Ausgaben kann kein Song übernommen werden
+        previous_songs = {}
+        for song_id, song in song_data.items():
+            stale[song["book_id"]][song_id] = sources.get(song_id)
+    changed = sum(len(songs) for songs in stale.values())
+    logger.info(f"{changed} von {len(song_data)} Songs neu zu berechnen")
+
+    # Texte nur der Quellseiten geänderter Songs lesen und bereinigen
+    texts = {}
+    for book_id, songs in stale.items():
+        wanted = {source[0] for source in songs.values() if source is not None}
+        if not wanted:
+            continue
+        book = books[book_id]
+        with metrics.stage("read"):
+            texts[book_id] = {}
+            scan_book(os.path.join(extracted_dir, f"{book['name']}.txt"), wanted, texts[book_id])
+        with metrics.stage("clean"):
+            page_nums = sorted(texts[book_id])
+            cleaned = clean_lyrics_batch([texts[book_id][page_num] for page_num in page_nums])
+            texts[book_id] = dict(zip(page_nums, cleaned))
+        metrics.count("pages_cleaned", len(page_nums))
+
+    with metrics.stage("export"):
+        json_elements = []
+        csv_rows = []
+        songs_state = {}
+        for song_id, song in song_data.items():
+            source = stale.get(song["book_id"], {}).get(song_id, False)
+            if source is False:
+                # Unverändert: Bytes aus den alten Ausgaben übernehmen
+                _, json_offset, json_length, csv_offset, csv_length = previous_songs[song_id]
+                json_elements.append(old_json[json_offset:json_offset + json_length])
+                csv_rows.append(old_csv[csv_offset:csv_offset + csv_length])
+                continue
+            if source is not None:
+                assign_page_lyrics(song, texts[song["book_id"]][source[0]], source[0], song["book_id"])
+            json_elements.append(json_element(song))
+            row = songs_csv_row(song)
+            csv_rows.append(row.encode('utf-8') if row is not None else b"")
+
+        json_content, json_offsets = json_document(json_elements)
+        csv_content, csv_offsets = csv_document(csv_rows)
+        for i, song_id in enumerate(song_data):
+            songs_state[song_id] = [fingerprints[song_id], json_offsets[i], len(json_elements[i]),
+                                    csv_offsets[i], len(csv_rows[i])]
+
+        json_written = replace_file(os.path.join(output_dir, JSON_OUTPUT), json_content, old_json)
+        csv_written = replace_file(os.path.join(output_dir, CSV_OUTPUT), csv_content, old_csv)
+        logger.info(f"{JSON_OUTPUT}: {json_written} Bytes geschrieben, {CSV_OUTPUT}: {csv_written} Bytes geschrieben "
+                    f"(0: unverändert)")
+
+    # Der Katalogindex hängt nur an den Titeln, Interpreten und Seiten und ist schnell gebaut
+    with metrics.stage("export_index"):
+        write_catalog_index(song_data, os.path.join(output_dir, CATALOG_INDEX_FILE))
+
+    # Datenbank und Binärkatalog sind abgeleitet und werden bei Änderungen komplett neu geschrieben
+    if (sqlite_file or binary_file) and (changed or json_written or csv_written
+                                         or not all(os.path.exists(path) for path in (sqlite_file, binary_file) if path)):
+        songs = json.loads(json_content)
+        if sqlite_file:
+            with metrics.stage("export_sqlite"):
+                write_lyrics_db({song_id: song for song_id, song in zip(song_data, songs)}, sqlite_file)
+        if binary_file:
+            with metrics.stage("export_binary"):
+                write_binary_catalog(songs, binary_file)
+
+    new_state["songs"] = songs_state
+    new_state["outputs"] = {"json": hashlib.sha1(json_content).hexdigest(), "csv": hashlib.sha1(csv_content).hexdigest()}
+    with open(state_file + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(new_state, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(state_file + ".tmp", state_file)
+    return {"songs": len(song_data), "changed": changed, "json_written": json_written, "csv_written": csv_written}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipeline inkrementell ausführen: nur geänderte Bücher, Seiten und Songs neu berechnen")
+    parser.add_argument("--csv", default=CSV_FILE, help="Song-Katalog (data.csv)")
+    parser.add_argument("--extracted-dir", default=EXTRACTED_DIR, help="Verzeichnis mit den OCR-Textdateien")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Zielverzeichnis für JSON, CSV und den Zustand")
+    parser.add_argument("--pdf-dir", help="Verzeichnis mit den PDFs; geänderte PDFs werden neu erkannt")
+    parser.add_argument("--workers", type=int, default=1, help="OCR-Worker für geänderte PDFs")
+    parser.add_argument("--full", action="store_true", help="Gespeicherten Zustand ignorieren und alles neu berechnen")
+    parser.add_argument("--sqlite", metavar="DB", help="Zusätzlich eine SQLite-Datenbank mit Suchindex schreiben")
+    parser.add_argument("--binary", metavar="FILE", help="Zusätzlich einen Binärkatalog zum Memory-Mapping schreiben")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    metrics.start(args)
+    result = build(args.csv, args.extracted_dir, args.output_dir, args.pdf_dir, args.full,
+                   args.sqlite, args.binary, args.workers)
+    logger.info(f"Fertig: {result['changed']} von {result['songs']} Songs neu berechnet")
+    metrics.finish(args, logger)
+    sys.exit(0)
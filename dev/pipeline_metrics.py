@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import json
+import time
+import pstats
+import logging
+import cProfile
+import resource
+import threading
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# Gemeinsame Messpunkte für pdf_ocr.py, extract_songs.py und update_lyrics.py:
+# Zeit je Stufe, Zähler, gedrosseltes Logging je Seite/Song und am Ende eine
+# JSON-Zusammenfassung. Die Stufenzeiten werden über alle Threads summiert.
+
+# Einzelmeldungen (je Seite/Song): die ersten LOG_FIRST, danach jede LOG_EVERY-te
+LOG_FIRST = int(os.environ.get("PIPELINE_LOG_FIRST", 10))
+LOG_EVERY = int(os.environ.get("PIPELINE_LOG_EVERY", 100))
+
+_lock = threading.Lock()
+_stage_seconds = defaultdict(float)
+_stage_calls = Counter()
+_counters = Counter()
+_log_seen = Counter()
+_log_emitted = Counter()
+_started = time.perf_counter()
+_profiler = None
+
+def reset():
+    """Forget all measurements (e.g. between benchmark runs)"""
+    global _started
+    with _lock:
+        _stage_seconds.clear()
+        _stage_calls.clear()
+        _counters.clear()
+        _log_seen.clear()
+        _log_emitted.clear()
+        _started = time.perf_counter()
+
+def add_time(name, seconds):
+    with _lock:
+        _stage_seconds[name] += seconds
+        _stage_calls[name] += 1
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as (part of) the given stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+def count(name, n=1):
+    with _lock:
+        _counters[name] += n
+
+def log_sampled(logger, key, msg, *args, level=logging.INFO):
+    """Log a per-item message only for the first LOG_FIRST and then every LOG_EVERY-th item of key.
+
+    msg is formatted lazily (logging %-style), so suppressed messages cost
+    almost nothing.
+    """
+    with _lock:
+        _log_seen[key] += 1
+        seen = _log_seen[key]
+        emit = seen <= LOG_FIRST or (LOG_EVERY > 0 and seen % LOG_EVERY == 0)
+        if emit:
+            _log_emitted[key] += 1
+    if emit and logger.isEnabledFor(level):
+        if seen > LOG_FIRST:
+            msg = f"{msg} [{seen}. Meldung, übrige werden nicht geloggt]"
+        logger.log(level, msg, *args)
+
+def summary():
+    """Measurements so far as a JSON-serialisable dict"""
+    with _lock:
+        result = {
+            "wall_seconds": time.perf_counter() - _started,
+            "stages": {name: {"seconds": seconds, "calls": _stage_calls[name]}
+                       for name, seconds in _stage_seconds.items()},
+            "counters": dict(_counters),
+            "suppressed_log_messages": {key: seen - _log_emitted[key] for key, seen in _log_seen.items()
+                                        if seen > _log_emitted[key]},
+        }
+    # ru_maxrss ist unter Linux in KB
+    result["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    if tracemalloc.is_tracing():
+        result["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    return result
+
+def add_arguments(parser):
+    """Add --metrics, --profile and --trace-memory to a script's argument parser"""
+    parser.add_argument("--metrics", metavar="JSON", help="Messwerte am Ende als JSON in diese Datei schreiben")
+    parser.add_argument("--profile", metavar="PSTATS", help="Lauf mit cProfile aufzeichnen und hier speichern")
+    parser.add_argument("--trace-memory", action="store_true", help="Speicher mit tracemalloc verfolgen")
+
+def start(args):
+    """Start profiling/memory tracing as requested on the command line"""
+    global _profiler
+    reset()
+    if getattr(args, "trace_memory", False):
+        tracemalloc.start()
+    if getattr(args, "profile", None):
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+def finish(args, logger):
+    """Stop profiling, log the stage summary and write the JSON metrics if requested"""
+    global _profiler
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(args.profile)
+        stream = io.StringIO()
+        pstats.Stats(_profiler, stream=stream).sort_stats("cumulative").print_stats(15)
+        logger.info(f"Profil gespeichert in {args.profile}:\n{stream.getvalue()}")
+        _profiler = None
+
+    result = summary()
+    if tracemalloc.is_tracing():
+        top = tracemalloc.take_snapshot().statistics("lineno")[:5]
+        logger.info("Größte Allokationen: " + "; ".join(str(stat) for stat in top))
+        tracemalloc.stop()
+
+    logger.info("Laufzeit je Stufe: " + ", ".join(f"{name} {values['seconds']:.3f}s"
+                                                  for name, values in result["stages"].items())
+                + f" (gesamt {result['wall_seconds']:.3f}s)")
+    if result["counters"]:
+        logger.info("Zähler: " + ", ".join(f"{name} {value}" for name, value in result["counters"].items()))
+
+    if getattr(args, "metrics", None):
+        with open(args.metrics, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        logger.info(f"Messwerte gespeichert in {args.metrics}")
+    return result
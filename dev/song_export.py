@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import re
+import csv
+import json
+import hashlib
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional
+
+# Streamende Ausgabe der Songlisten: jeder Song wird geschrieben, sobald er vorliegt,
+# statt erst eine komplette Liste bzw. einen großen JSON-String aufzubauen. Dazu je
+# Buch ein NDJSON-Shard (eine Zeile pro Song) und ein kleines Manifest mit Anzahl,
+# Größe, Prüfsumme und Sprungmarken je Shard, damit App und Werkzeuge ein einzelnes
+# Buch laden können, ohne die ganze Ausgabe zu lesen.
+
+SHARD_FORMAT = "song-shards-1"
+MANIFEST_FILE = "manifest.json"
+# Das Manifest enthält den Byte-Offset jedes OFFSET_STRIDE-ten Songs eines Shards
+OFFSET_STRIDE = 64
+
+# Kopfzeile der songs_export.csv von pdf_ocr.py und extract_songs.py
+SONG_EXPORT_CSV_HEADER = ["Seite (Noten)", "Seite", "Buch", "Künstler", "Titel"]
+
+def json_array_element(record) -> str:
+    """One element of a list as written by json.dump(..., ensure_ascii=False, indent=2)"""
+    # Zeilenumbrüche in Strings sind escaped, jeder echte Umbruch gehört zur Einrückung
+    return "  " + json.dumps(record, indent=2, ensure_ascii=False).replace("\n", "\n  ")
+
+class JsonArrayWriter:
+    """Write a JSON list element by element into a binary file.
+
+    The result is byte-identical to json.dump(records, f, ensure_ascii=False,
+    indent=2); bytes counts the bytes written so far.
+    """
+
+    def __init__(self, f: BinaryIO):
+        self._f = f
+        self.count = 0
+        self.bytes = 0
+
+    def _write(self, data: bytes):
+        self._f.write(data)
+        self.bytes += len(data)
+
+    def write(self, record):
+        self._write((",\n" if self.count else "[\n").encode('utf-8'))
+        self._write(json_array_element(record).encode('utf-8'))
+        self.count += 1
+
+    def close(self):
+        self._write(b"\n]" if self.count else b"[]")
+
+def csv_line(fields: Iterable, quoting: int = csv.QUOTE_MINIMAL) -> str:
+    """A single CSV row (with '\\n') as written by csv_writer"""
+    buffer = io.StringIO()
+    csv_writer(buffer, quoting).writerow(fields)
+    return buffer.getvalue()
+
+def csv_writer(f, quoting: int = csv.QUOTE_MINIMAL):
+    """csv.writer with the repo's CSV dialect ('\\n' line endings)"""
+    return csv.writer(f, quoting=quoting, lineterminator='\n')
+
+def song_export_fields(song: dict) -> list:
+    """Row of songs_export.csv for a song found by pdf_ocr.py / extract_songs.py"""
+    return ["", song['page'], song['book'].replace('ding_', ''), song['artist'], song['title']]
+
+def shard_file_name(book: str) -> str:
+    return re.sub(r'[^\w.-]', '_', book) + ".ndjson"
+
+class ShardedSongWriter:
+    """Write songs as NDJSON, one shard file per book, plus MANIFEST_FILE.
+
+    Shards are written to temporary files and only replace the previous ones
+    (together with the manifest) in close(); after an exception the previous
+    export stays untouched.
+    """
+
+    def __init__(self, shard_dir: str, book_field: str = "book_id"):
+        self.shard_dir = shard_dir
+        self.book_field = book_field
+        self._shards: Dict[str, dict] = {}
+        os.makedirs(shard_dir, exist_ok=True)
+
+    def write(self, song: dict, book: Optional[str] = None):
+        book = str(book if book is not None else song.get(self.book_field) or "unknown")
+        shard = self._shards.get(book)
+        if shard is None:
+            name = shard_file_name(book)
+            shard = self._shards[book] = {
+                "file": name,
+                "handle": open(os.path.join(self.shard_dir, name + ".tmp"), 'wb'),
+                "sha1": hashlib.sha1(),
+                "count": 0,
+                "bytes": 0,
+                "offsets": [],
+            }
+        if shard["count"] % OFFSET_STRIDE == 0:
+            shard["offsets"].append(shard["bytes"])
+        line = (json.dumps(song, ensure_ascii=False, separators=(',', ':')) + "\n").encode('utf-8')
+        shard["handle"].write(line)
+        shard["sha1"].update(line)
+        shard["count"] += 1
+        shard["bytes"] += len(line)
+
+    def write_many(self, songs: Iterable[dict], book: Optional[str] = None):
+        for song in songs:
+            self.write(song, book)
+
+    def _close_files(self):
+        for shard in self._shards.values():
+            shard["handle"].close()
+
+    def abort(self):
+        self._close_files()
+        for shard in self._shards.values():
+            try:
+                os.remove(os.path.join(self.shard_dir, shard["file"] + ".tmp"))
+            except OSError:
+                pass
+
+    def close(self) -> dict:
+        """Publish the shards and write the manifest; returns the manifest"""
+        self._close_files()
+        previous = {}
+        try:
+            previous = load_manifest(self.shard_dir)["books"]
+        except (OSError, ValueError):
+            pass
+
+        books = {}
+        for book in sorted(self._shards):
+            shard = self._shards[book]
+            path = os.path.join(self.shard_dir, shard["file"])
+            os.replace(path + ".tmp", path)
+            books[book] = {
+                "file": shard["file"],
+                "count": shard["count"],
+                "bytes": shard["bytes"],
+                "sha1": shard["sha1"].hexdigest(),
+                "offsets": shard["offsets"],
+            }
+        manifest = {
+            "format": SHARD_FORMAT,
+            "offset_stride": OFFSET_STRIDE,
+            "count": sum(shard["count"] for shard in books.values()),
+            "books": books,
+        }
+        manifest_file = os.path.join(self.shard_dir, MANIFEST_FILE)
+        with open(manifest_file + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(manifest_file + ".tmp", manifest_file)
+
+        # Shards von Büchern, die es nicht mehr gibt, entfernen
+        current = {shard["file"] for shard in books.values()}
+        for shard in previous.values():
+            if shard.get("file") not in current:
+                try:
+                    os.remove(os.path.join(self.shard_dir, shard["file"]))
+                except OSError:
+                    pass
+        return manifest
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+def load_manifest(shard_dir: str) -> dict:
+    with open(os.path.join(shard_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SHARD_FORMAT:
+        raise ValueError(f"Unbekanntes Format in {shard_dir}: {manifest.get('format')}")
+    return manifest
+
+def iter_book_songs(shard_dir: str, book: str, start: int = 0, manifest: Optional[dict] = None) -> Iterator[dict]:
+    """Songs of one book from its shard, beginning with the start-th song"""
+    manifest = manifest or load_manifest(shard_dir)
+    shard = manifest["books"].get(book)
+    if shard is None or start >= shard["count"]:
+        return
+    stride = manifest["offset_stride"]
+    with open(os.path.join(shard_dir, shard["file"]), 'rb') as f:
+        # Zur nächsten Sprungmarke springen, den Rest zeilenweise überspringen
+        f.seek(shard["offsets"][start // stride])
+        for _ in range(start % stride):
+            f.readline()
+        for line in f:
+            yield json.loads(line)
+
+def iter_shard_songs(shard_dir: str) -> Iterator[dict]:
+    """All songs of a shard export, book by book"""
+    manifest = load_manifest(shard_dir)
+    for book in manifest["books"]:
+        yield from iter_book_songs(shard_dir, book, manifest=manifest)
+
+class SongExport:
+    """all_songs.json and songs_export.csv of pdf_ocr.py / extract_songs.py, written while the books are processed
+
+    With shard_dir, every book additionally gets an NDJSON shard there. Like
+    ShardedSongWriter, both files are written to temporary files and only
+    replace the previous ones in close(); after an exception the previous
+    export stays untouched.
+    """
+
+    def __init__(self, output_dir: str, shard_dir: Optional[str] = None):
+        self.json_output = os.path.join(output_dir, 'all_songs.json')
+        self.csv_output = os.path.join(output_dir, 'songs_export.csv')
+        self._json_file = open(self.json_output + ".tmp", 'wb')
+        self._json = JsonArrayWriter(self._json_file)
+        self._csv_file = open(self.csv_output + ".tmp", 'w', encoding='utf-8', newline='')
+        self._csv = csv_writer(self._csv_file)
+        self._csv.writerow(SONG_EXPORT_CSV_HEADER)
+        self._shards = ShardedSongWriter(shard_dir, "book") if shard_dir else None
+
+    @property
+    def count(self) -> int:
+        return self._json.count
+
+    def add(self, songs: List[dict]):
+        for song in songs:
+            self._json.write(song)
+        self._csv.writerows(song_export_fields(song) for song in songs)
+        if self._shards is not None:
+            self._shards.write_many(songs)
+
+    def abort(self):
+        self._json_file.close()
+        self._csv_file.close()
+        for path in (self.json_output, self.csv_output):
+            try:
+                os.remove(path + ".tmp")
+            except OSError:
+                pass
+        if self._shards is not None:
+            self._shards.abort()
+
+    def close(self):
+        """Publish all_songs.json, songs_export.csv and the shards"""
+        self._json.close()
+        self._json_file.close()
+        self._csv_file.close()
+        os.replace(self.json_output + ".tmp", self.json_output)
+        os.replace(self.csv_output + ".tmp", self.csv_output)
+        if self._shards is not None:
+            self._shards.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+import re
+import bisect
+from itertools import accumulate
+from collections import namedtuple
+
+# Song-Grenzen: Offsets beziehen sich auf den segmentierten Text
+SongSpan = namedtuple('SongSpan', ['start', 'number', 'title', 'artist', 'body_start', 'body_end'])
+
+# Die bisherigen Regex-Muster, deren Treffer der Segmentierer nachbildet
+# "book": extract_songs.identify_songs (Nummer, Titel, Interpret über das ganze Buch)
+# "page": pdf_ocr.parse_song_structure (Nummer, Titel - Interpret innerhalb einer Seite)
+REGEX_PATTERNS = {
+    "book": r'(\d+)\s+([^\n]+?)\s+(?:- )?([^\n]+?)\s*\n\s*\n([\s\S]+?)(?=\d+\s+[^\n]+|$)',
+    "page": r'(\d+)[.\s]+(.*?)\s+[-–]\s+(.*?)\n\s*\n([\s\S]+?)(?=\d+[.\s]+|$)',
+}
+
+_DIGITS = re.compile(r'\d+')
+# Ziffernfolgen, an denen ein Songtext endet (Lookahead der REGEX_PATTERNS)
+_BOUNDARIES = {
+    "book": re.compile(r'(?<!\d)\d+(?=\s+[^\n])'),
+    "page": re.compile(r'(?<!\d)\d+(?=[.\s])'),
+}
+_WS = re.compile(r'\s')
+_WS_RUN = re.compile(r'\s*')
+_DOT_WS_RUN = re.compile(r'[.\s]*')
+_DASHES = '-–'
+# Ohne " - " zwischen Titel und Interpret hat eine Seite keine Überschrift ("page")
+_TITLE_DASH = re.compile(r'\s[-–]\s')
+
+def build_line_table(content):
+    """Split content into lines once.
+
+    Returns (starts, ends, content_ends, body_starts): per line the start
+    offset, the offset of its '\\n' (or len(content) for the last line), the
+    offset after its last non-whitespace character, and where the lyrics body
+    begins if the line is a song heading followed by a blank line (else None).
+    """
+    line_texts = content.split('\n')
+    starts = [0]
+    starts += accumulate(len(line) + 1 for line in line_texts[:-1])
+    ends = [start + len(line) for start, line in zip(starts, line_texts)]
+    content_ends = [start + len(line.rstrip()) for start, line in zip(starts, line_texts)]
+
+    # Nach einer Überschrift folgt mindestens eine Leerzeile; der Text beginnt
+    # nach dem letzten Zeilenumbruch dieser Leerzeilen, der noch Platz für
+    # mindestens ein Zeichen lässt
+    n = len(content)
+    count = len(starts)
+    last_break = [None] * (count + 1)
+    for i in range(count - 2, -1, -1):
+        if content_ends[i] != starts[i]:
+            continue
+        own = ends[i] if ends[i] <= n - 2 else None
+        last_break[i] = last_break[i + 1] if last_break[i + 1] is not None else own
+    body_starts = [last_break[i + 1] + 1 if last_break[i + 1] is not None else None for i in range(count)]
+
+    return starts, ends, content_ends, body_starts
+
+def _boundary_runs(content, dialect):
+    """Digit runs at which a lyrics body ends (start of the next song number)"""
+    spans = [match.span() for match in _BOUNDARIES[dialect].finditer(content)]
+    return [d0 for d0, _ in spans], [d1 for _, d1 in spans]
+
+def _body_end(content, boundaries, body_start):
+    """First position after at least one body character where the next song starts"""
+    n = len(content)
+    run_starts, run_ends = boundaries
+    end = n
+    i = bisect.bisect_right(run_ends, body_start + 1)
+    if i < len(run_ends):
+        end = max(run_starts[i], body_start + 1)
+    # Textende (bzw. vor einem abschließenden Zeilenumbruch)
+    if content.endswith('\n') and n - 1 >= body_start + 1:
+        end = min(end, n - 1)
+    return end
+
+def _line_of(lines, pos):
+    return bisect.bisect_right(lines[0], pos) - 1
+
+def _book_artist_start(content, lines, t_end):
+    """Highest position after the whitespace run at t_end where the artist can start"""
+    n = len(content)
+    starts, ends, _, body_starts = lines
+    r2 = _WS_RUN.match(content, t_end).end()
+    hi = r2 if r2 < n else n - 1
+    for m in range(_line_of(lines, hi), _line_of(lines, t_end) - 1, -1):
+        lo_m = max(t_end + 1, starts[m])
+        hi_m = min(hi, ends[m] - 1)
+        if lo_m <= hi_m and body_starts[m] is not None:
+            return hi_m, m
+    return None, None
+
+def _match_book_header(content, lines, a):
+    """Heading after a song number for the 'book' dialect, a is the offset after the number"""
+    n = len(content)
+    starts, ends, content_ends, body_starts = lines
+    r1 = _WS_RUN.match(content, a).end()
+    for t_start in range(r1, a, -1):
+        if t_start == n or content[t_start] == '\n':
+            continue
+        line = _line_of(lines, t_start)
+        ce = content_ends[line]
+
+        # Leerraum innerhalb der Zeile: Interpret folgt in derselben Zeile
+        if body_starts[line] is not None and ce > t_start + 1:
+            ws = _WS.search(content, t_start + 1, ce)
+            if ws:
+                t_end = ws.start()
+                p = _WS_RUN.match(content, t_end).end()
+                return t_start, t_end, p, line
+
+        # Sonst steht der Interpret nach dem Zeilenende (ggf. in einer späteren Zeile)
+        t_end = max(t_start + 1, ce)
+        if t_end > ends[line] or t_end == n:
+            continue
+        p, artist_line = _book_artist_start(content, lines, t_end)
+        if p is not None:
+            return t_start, t_end, p, artist_line
+    return None
+
+def _page_artist_start(content, lines, lo, r3):
+    """Highest artist start in lo+1..r3 for the 'page' dialect"""
+    n = len(content)
+    starts, ends, _, body_starts = lines
+    hi = min(r3, n - 1)
+    for m in range(_line_of(lines, hi), _line_of(lines, lo + 1) - 1, -1):
+        lo_m = max(lo + 1, starts[m])
+        hi_m = min(hi, ends[m])
+        if lo_m <= hi_m and ends[m] < n and body_starts[m] is not None:
+            return hi_m, m
+    return None, None
+
+def _break_run_ends(content, lines):
+    """Per line, the end of the whitespace run that contains its line break"""
+    n = len(content)
+    starts, ends, content_ends, _ = lines
+    count = len(starts)
+    run_ends = [n] * count
+    for i in range(count - 2, -1, -1):
+        # Über Leerzeilen hinweg bis zum ersten Zeichen danach
+        if content_ends[i + 1] == starts[i + 1]:
+            run_ends[i] = run_ends[i + 1]
+        else:
+            run_ends[i] = _WS_RUN.match(content, starts[i + 1]).end()
+    return run_ends
+
+def _page_title_runs(content, lines, line, break_run_ends):
+    """Whitespace runs of a line that can end a title in the 'page' dialect.
+
+    A run qualifies if " - " and an artist follow it; that does not depend on
+    where the title starts, so each line is scanned once. Returns the run ends
+    and (run start, artist start, artist line) per run, in line order.
+    """
+    n = len(content)
+    starts, ends = lines[0], lines[1]
+    eol = ends[line]
+    run_ends = []
+    runs = []
+    # Die meisten Zeilen enthalten gar keinen Bindestrich bis zum Ende ihres letzten Leerraums
+    stop = min(break_run_ends[line] + 1, n) if eol < n else n
+    if all(content.find(dash, starts[line], stop) < 0 for dash in _DASHES):
+        return run_ends, runs
+    j = starts[line]
+    while j <= eol and j < n:
+        ws = _WS.search(content, j, eol + 1)
+        if not ws:
+            break
+        w0 = ws.start()
+        # Läuft der Leerraum bis zum Zeilenende, geht er über die folgenden Leerzeilen weiter
+        w1 = _WS_RUN.match(content, w0, eol).end()
+        if w1 == eol and eol < n:
+            w1 = break_run_ends[line]
+        if w1 + 1 < n and content[w1] in _DASHES and content[w1 + 1].isspace():
+            r3 = _WS_RUN.match(content, w1 + 1).end()
+            s_a, artist_line = _page_artist_start(content, lines, w1 + 1, r3)
+            if s_a is not None:
+                run_ends.append(w1)
+                runs.append((w0, s_a, artist_line))
+        j = w1
+    return run_ends, runs
+
+def _match_page_header(content, lines, a, title_runs, break_run_ends):
+    """Heading after a song number for the 'page' dialect, a is the offset after the number.
+
+    title_runs caches _page_title_runs per line for one segment_songs call.
+    """
+    n = len(content)
+    r1 = _DOT_WS_RUN.match(content, a).end()
+    for t_start in range(r1, a, -1):
+        if t_start == n:
+            continue
+        line = _line_of(lines, t_start)
+        if line not in title_runs:
+            title_runs[line] = _page_title_runs(content, lines, line, break_run_ends)
+        run_ends, runs = title_runs[line]
+        # Titel endet vor dem ersten Leerraum hinter t_start, auf den " - " und der Interpret folgen
+        i = bisect.bisect_right(run_ends, t_start)
+        if i < len(runs):
+            w0, s_a, artist_line = runs[i]
+            return t_start, max(w0, t_start), s_a, artist_line
+    return None
+
+def segment_songs(content, dialect="book"):
+    """Split content into songs in a single forward pass over its lines.
+
+    Yields SongSpan tuples with the same boundaries, numbers, titles and
+    artists (unstripped) that re.finditer(REGEX_PATTERNS[dialect], content)
+    finds, without the backtracking of the lazy body pattern. The time is
+    linear in the length of content (test_song_segmenter.py checks both).
+    """
+    if dialect == "page" and not _TITLE_DASH.search(content):
+        return
+    n = len(content)
+    lines = build_line_table(content)
+    ends, content_ends, body_starts = lines[1], lines[2], lines[3]
+    boundaries = _boundary_runs(content, dialect)
+    title_runs = {}
+    break_run_ends = _break_run_ends(content, lines) if dialect == "page" else None
+
+    pos = 0
+    for match in _DIGITS.finditer(content):
+        d0, d1 = match.span()
+        if d1 <= pos or d1 >= n:
+            continue
+        if dialect == "page":
+            if content[d1] != '.' and not content[d1].isspace():
+                continue
+            header = _match_page_header(content, lines, d1, title_runs, break_run_ends)
+        else:
+            if not content[d1].isspace():
+                continue
+            header = _match_book_header(content, lines, d1)
+        if header is None:
+            continue
+
+        # Die Suche beginnt am Ende des vorigen Songtexts, ggf. mitten in dieser Zahl
+        start = max(d0, pos)
+        t_start, t_end, artist_start, artist_line = header
+        if dialect == "page":
+            artist_end = ends[artist_line]
+        else:
+            # Optionaler Bindestrich vor dem Interpreten
+            if (content.startswith('- ', artist_start) and artist_start + 2 < n
+                    and content[artist_start + 2] != '\n'):
+                artist_start += 2
+            artist_end = max(artist_start + 1, content_ends[artist_line])
+        body_start = body_starts[artist_line]
+        body_end = _body_end(content, boundaries, body_start)
+
+        yield SongSpan(start, content[start:d1], content[t_start:t_end],
+                       content[artist_start:artist_end], body_start, body_end)
+        pos = body_end
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from chord_tokenizer import classify_line, is_chord
+
+# Akkordzeilen aus den OCR-Texten der Bücher (extracted/), mit Satzzeichen und
+# OCR-Resten zwischen den Akkorden; sie dürfen nicht als Liedtext stehen bleiben
+CHORD_LINES = [
+    "G D —",
+    "Cm/A D7 Gm Cm — —",
+    "Bm Em €",
+    "; Em",
+    "; Em €",
+    "E — |",
+    "A ———",
+    "Bm =",
+    "Dm € Bb €",
+    "\" € G D Am",
+    "G € Am —",
+    "Am € G",
+    "Em? Am? Em?",
+    "Bm? G A |",
+    "G D7 Em? i;",
+    "E— —",
+    "(G Em7 Am D)",
+]
+
+# Liedtextzeilen, die mit Akkordnamen beginnen oder sie enthalten
+LYRIC_LINES = [
+    "Am Ende des Tages",
+    "a little bit funny, this feeling inside",
+    "I’m not one of those who can, easily hide",
+    "1. Du hast’n Schatten im Blick, Lachen ist gemalt.",
+    "A — B — C, so einfach ist das",
+]
+
+class ClassifyLineTest(unittest.TestCase):
+
+    def test_chord_lines_with_ocr_punctuation(self):
+        for line in CHORD_LINES:
+            with self.subTest(line=line):
+                self.assertIsNotNone(classify_line(line))
+
+    def test_lyric_lines(self):
+        for line in LYRIC_LINES:
+            with self.subTest(line=line):
+                self.assertIsNone(classify_line(line))
+
+    def test_columns_without_punctuation(self):
+        self.assertEqual(classify_line("; Em €"), [(2, "Em")])
+        self.assertEqual(classify_line("Em? Am"), [(0, "Em"), (4, "Am")])
+        self.assertEqual(classify_line("(G Em7)"), [(1, "G"), (3, "Em7")])
+
+class IsChordTest(unittest.TestCase):
+
+    def test_chords(self):
+        for token in ("Am", "F#m7/C#", "Dsus4", "Cmaj7", "Bb", "C(add9)", "E7b9", "C+", "A-"):
+            with self.subTest(token=token):
+                self.assertTrue(is_chord(token))
+
+    def test_no_chords(self):
+        for token in ("Ende", "Am?", "Cm/", "H7", "Bass", "Gm/X"):
+            with self.subTest(token=token):
+                self.assertFalse(is_chord(token))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from pdf_ocr import split_batch_text
+
+class SplitBatchTextTest(unittest.TestCase):
+
+    def test_pages_keep_form_feed_of_single_page_output(self):
+        # tesseract schließt auch bei einem einzelnen Bild die Seite mit '\f' ab
+        self.assertEqual(split_batch_text("Seite eins\n\fSeite zwei\n\f", 2), ["Seite eins\n\f", "Seite zwei\n\f"])
+        self.assertEqual(split_batch_text("\f\f", 2), ["\f", "\f"])
+
+    def test_missing_pages(self):
+        with self.assertRaises(ValueError):
+            split_batch_text("Seite eins\n", 2)
+
+if __name__ == "__main__":
+    unittest.main()
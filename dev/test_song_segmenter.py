@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import glob
+import time
+import random
+import unittest
+
+from song_segmenter import segment_songs, REGEX_PATTERNS
+
+EXTRACTED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extracted")
+PAGE_PATTERN = re.compile(r'\[Seite (\d+)\]([\s\S]+?)(?=\[Seite|$)')
+
+def regex_spans(text, dialect):
+    return [(m.start(), m.group(1), m.group(2), m.group(3), m.start(4), m.end(4))
+            for m in re.finditer(REGEX_PATTERNS[dialect], text)]
+
+def segmenter_spans(text, dialect):
+    return [tuple(span) for span in segment_songs(text, dialect)]
+
+class SegmentSongsTest(unittest.TestCase):
+
+    def test_books_match_regex(self):
+        """Same songs as the regex patterns on the OCR texts of the books"""
+        text_files = sorted(glob.glob(os.path.join(EXTRACTED_DIR, "Das Ding *.txt")))
+        if not text_files:
+            self.skipTest(f"no OCR texts in {EXTRACTED_DIR}")
+        for text_file in text_files:
+            with open(text_file, 'r', encoding='utf-8', errors='replace') as f:
+                content = f.read()
+            # Ganzes Buch ("book") und jede Seite einzeln ("page")
+            with self.subTest(book=os.path.basename(text_file), dialect="book"):
+                self.assertEqual(segmenter_spans(content, "book"), regex_spans(content, "book"))
+            for match in PAGE_PATTERN.finditer(content):
+                with self.subTest(book=os.path.basename(text_file), page=match.group(1)):
+                    text = match.group(2)
+                    self.assertEqual(segmenter_spans(text, "page"), regex_spans(text, "page"))
+
+    def test_random_texts_match_regex(self):
+        """Same songs as the regex patterns on short texts made of the characters that matter"""
+        pieces = ['1', '12', '2', '.', ' ', ' ', '-', '–', 'a', 'b', '\n', '\n', ' - ', '\n\n', '\t']
+        rnd = random.Random(7)
+        found = 0
+        for _ in range(5000):
+            text = ''.join(rnd.choice(pieces) for _ in range(rnd.randint(0, 40)))
+            for dialect in ("book", "page"):
+                expected = regex_spans(text, dialect)
+                found += len(expected)
+                self.assertEqual(segmenter_spans(text, dialect), expected, f"{dialect}: {text!r}")
+        self.assertGreater(found, 1000)
+
+    def test_linear_on_long_lines(self):
+        """Long lines of numbers: the regex (and a rescan per number) is quadratic there"""
+        texts = [
+            ("page", '1 ' * 20000 + '\n'),
+            ("page", '1 - ' * 20000 + '\n'),
+            ("page", '1' + ' \n' * 20000 + 'x\n'),
+            ("book", '1 ' * 20000 + '\n'),
+            ("book", '1 a\n' * 20000),
+        ]
+        for dialect, text in texts:
+            with self.subTest(dialect=dialect, text=text[:12]):
+                start = time.perf_counter()
+                list(segment_songs(text, dialect))
+                self.assertLess(time.perf_counter() - start, 2.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,10 +4,23 @@ import os
 import re
 import json
 import csv
+import time
+import argparse
+import hashlib
+from concurrent.futures import Executor, ProcessPoolExecutor
 from collections import defaultdict
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, Iterator, NamedTuple
 import logging
 
+from ocr_pages import iter_ocr_file
+from chord_tokenizer import classify_line, align_chords, format_chord_positions
+from lyrics_db import write_lyrics_db
+from binary_catalog import write_binary_catalog
+from page_dedup import group_similar_pages
+from catalog_keys import CATALOG_INDEX_FILE, song_keys, write_catalog_index
+from song_export import JsonArrayWriter, ShardedSongWriter, csv_line, csv_writer
+import pipeline_metrics as metrics
+
 # Konfiguration
 EXTRACTED_DIR = "/var/www/kultliederbuch.z11.de/dev/extracted"
 OUTPUT_DIR = "/var/www/kultliederbuch.z11.de/dev/extracted"
@@ -27,7 +40,16 @@ BOOK_MAPPING = {
     "Weihnachtslieder": "W"
 }
 
-# CSV-Parsing mit Unterstützung für Anführungszeichen
+# Kompakter Katalogeintrag einer CSV-Zeile (tupelbasiert, ohne Instanz-Dict)
+class SongRecord(NamedTuple):
+    song_id: str
+    title: str
+    artist: str
+    book_id: str
+    page: Optional[int]
+    page_notes: Optional[int]
+
+# Bisheriger zeichenweiser CSV-Parser, nur noch als Referenz für benchmark_csv_loader
 def parse_csv_line(line: str) -> List[str]:
     result = []
     in_quotes = False
@@ -52,70 +74,86 @@ def parse_csv_line(line: str) -> List[str]:
     result.append(current_field.strip())
     return result
 
+# Lade den Song-Katalog mit dem csv-Modul in einem Durchlauf
+def load_song_catalog(csv_file: str = CSV_FILE) -> Tuple[List[SongRecord], Dict[str, Dict[int, List[Tuple[str, str, str]]]]]:
+    # Ergebnis: Liste der Einträge und {buchnummer: {seitenzahl: [(song_id, title, artist),...]}}
+    records = []
+    songs_by_page = defaultdict(lambda: defaultdict(list))
+    
+    with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = [col.strip() for col in next(reader)]
+        
+        # Finde Spaltenindizes
+        idx_seite_noten = header.index("Seite (Noten)" if "Seite (Noten)" in header else "Seite Noten")
+        idx_seite = header.index("Seite")
+        idx_buch = header.index("Buch")
+        idx_kuenstler = header.index("Künstler")
+        idx_titel = header.index("Titel")
+        
+        for cols in reader:
+            if len(cols) < len(header):
+                logger.warning(f"Zeile hat zu wenige Spalten: {','.join(cols)}")
+                continue
+            
+            title = cols[idx_titel].strip()
+            artist = cols[idx_kuenstler].strip()
+            book_id = cols[idx_buch].strip()
+            
+            # Song-ID erstellen
+            song_id = f"{title.replace(' ', '_').lower()}_{book_id}"
+            entry = (song_id, title, artist)
+            
+            # Reguläre Seite
+            page = None
+            value = cols[idx_seite].strip()
+            if value:
+                try:
+                    page = int(value)
+                    songs_by_page[book_id][page].append(entry)
+                except ValueError:
+                    logger.warning(f"Ungültige Seitenzahl: {value} für Song {title}")
+            
+            # Seite mit Noten; wir verwenden die gleiche Zuordnung,
+            # da der OCR-Text aus dem regulären Buch kommt
+            page_notes = None
+            value = cols[idx_seite_noten].strip()
+            if value:
+                try:
+                    page_notes = int(value)
+                    # Gleiche Seite nicht zweimal eintragen, sonst wird der Song doppelt verarbeitet
+                    if page_notes != page:
+                        songs_by_page[book_id][page_notes].append(entry)
+                except ValueError:
+                    logger.warning(f"Ungültige Notenseitenzahl: {value} für Song {title}")
+            
+            records.append(SongRecord(song_id, title, artist, book_id, page, page_notes))
+    
+    return records, songs_by_page
+
 # Lade die CSV-Daten und erstelle eine Mapping von Seitenzahlen zu Songs
-def load_song_page_mapping() -> Dict[str, Dict[int, List[Tuple[str, str]]]]:
+def load_song_page_mapping(csv_file: str = CSV_FILE) -> Tuple[Dict[str, Dict[int, List[Tuple[str, str, str]]]], Dict[str, dict]]:
     # Ergebnis-Format: {buchnummer: {seitenzahl: [(song_id, title, artist),...]}}
     songs_by_page = defaultdict(lambda: defaultdict(list))
     song_data = {}  # Format: {song_id: {"title": str, "artist": str, "lyrics": str}}
     
-    logger.info(f"Lade Song-Daten aus {CSV_FILE}")
+    logger.info(f"Lade Song-Daten aus {csv_file}")
     try:
-        with open(CSV_FILE, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            header = parse_csv_line(lines[0])
-            
-            # Finde Spaltenindizes
-            idx_seite_noten = header.index("Seite (Noten)" if "Seite (Noten)" in header else "Seite Noten")
-            idx_seite = header.index("Seite")
-            idx_buch = header.index("Buch")
-            idx_kuenstler = header.index("Künstler")
-            idx_titel = header.index("Titel")
-            
-            for line in lines[1:]:
-                cols = parse_csv_line(line)
-                if len(cols) < len(header):
-                    logger.warning(f"Zeile hat zu wenige Spalten: {line}")
-                    continue
-                
-                title = cols[idx_titel]
-                artist = cols[idx_kuenstler]
-                book_id = cols[idx_buch]
-                
-                # Song-ID erstellen
-                song_id = f"{title.replace(' ', '_').lower()}_{book_id}"
-                
-                # Speichere Song-Daten
-                song_data[song_id] = {
-                    "title": title,
-                    "artist": artist,
-                    "lyrics": "",
-                    "chords": "",
-                    "book_id": book_id,
-                    "book_page": None,  # Wird später gesetzt
-                    "book_page_notes": None  # Wird später gesetzt
-                }
-                
-                # Füge Seiten hinzu (reguläre Seiten)
-                if cols[idx_seite].strip():
-                    try:
-                        page = int(cols[idx_seite])
-                        # Setze Seitenzahl im Song-Objekt
-                        song_data[song_id]["book_page"] = page
-                        songs_by_page[book_id][page].append((song_id, title, artist))
-                    except ValueError:
-                        logger.warning(f"Ungültige Seitenzahl: {cols[idx_seite]} für Song {title}")
-                
-                # Füge Seiten mit Noten hinzu
-                if cols[idx_seite_noten].strip():
-                    try:
-                        page_notes = int(cols[idx_seite_noten])
-                        # Setze Noten-Seitenzahl im Song-Objekt
-                        song_data[song_id]["book_page_notes"] = page_notes
-                        # Wir verwenden die gleiche Mapping für Seiten mit Noten, 
-                        # da der OCR-Text aus dem regulären Buch kommt
-                        songs_by_page[book_id][page_notes].append((song_id, title, artist))
-                    except ValueError:
-                        logger.warning(f"Ungültige Notenseitenzahl: {cols[idx_seite_noten]} für Song {title}")
+        records, songs_by_page = load_song_catalog(csv_file)
+        for record in records:
+            # Speichere Song-Daten
+            song_data[record.song_id] = {
+                "title": record.title,
+                "artist": record.artist,
+                "lyrics": "",
+                "chords": "",
+                "chord_positions": "",
+                "book_id": record.book_id,
+                "book_page": record.page,
+                "book_page_notes": record.page_notes,
+                # Such- und Sortierschlüssel, damit die App nicht bei jeder Eingabe normalisieren muss
+                **song_keys(record.title, record.artist)
+            }
     
     except Exception as e:
         logger.error(f"Fehler beim Laden der CSV-Datei: {e}")
@@ -123,143 +161,413 @@ def load_song_page_mapping() -> Dict[str, Dict[int, List[Tuple[str, str]]]]:
     logger.info(f"Geladen: {sum(len(pages) for pages in songs_by_page.values())} Seitenzuordnungen für {len(song_data)} Songs")
     return songs_by_page, song_data
 
-# Extrahiere Seiteninhalte aus einer OCR-Textdatei
-def extract_pages_from_ocr(ocr_file: str) -> Dict[int, str]:
-    # Format: {page_number: page_content}
-    pages = {}
+# Vergleiche den csv-basierten Loader mit dem bisherigen zeichenweisen Parser
+def benchmark_csv_loader(csv_file: str = CSV_FILE, rounds: int = 20) -> Dict[str, float]:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        with open(csv_file, 'r', encoding='utf-8') as f:
+            legacy_rows = [parse_csv_line(line) for line in f.readlines()[1:]]
+    legacy_time = (time.perf_counter() - start) / rounds
     
+    start = time.perf_counter()
+    for _ in range(rounds):
+        records, _ = load_song_catalog(csv_file)
+    catalog_time = (time.perf_counter() - start) / rounds
+    
+    # Abweichungen zeigen Zeilen, die der alte Parser falsch zerlegt hat
+    legacy_titles = [row[4] for row in legacy_rows if len(row) >= 5]
+    differences = sum(1 for a, b in zip(legacy_titles, (r.title for r in records)) if a != b)
+    logger.info(f"CSV-Loader: alt {legacy_time * 1000:.2f} ms, csv-Modul {catalog_time * 1000:.2f} ms "
+                f"({legacy_time / max(catalog_time, 1e-9):.1f}x) für {len(records)} Songs, {differences} abweichende Titel")
+    return {"legacy": legacy_time, "catalog": catalog_time}
+
+# Streame Seiteninhalte aus einer OCR-Textdatei, Seite für Seite per mmap
+def stream_pages_from_ocr(ocr_file: str) -> Iterator[Tuple[int, str]]:
     logger.info(f"Verarbeite OCR-Datei: {ocr_file}")
+    count = 0
     try:
-        with open(ocr_file, 'r', encoding='utf-8', errors='replace') as f:
-            content = f.read()
-            
-            # Extrahiere Seiten mit Regex
-            page_pattern = r'\[Seite (\d+)\]([\s\S]+?)(?=\[Seite|$)'
-            for match in re.finditer(page_pattern, content):
-                page_num = int(match.group(1))
-                page_content = match.group(2).strip()
-                pages[page_num] = page_content
-    
+        for page_num, page_content in iter_ocr_file(ocr_file):
+            count += 1
+            yield page_num, page_content.strip()
     except Exception as e:
         logger.error(f"Fehler beim Verarbeiten der OCR-Datei {ocr_file}: {e}")
     
-    logger.info(f"Extrahiert: {len(pages)} Seiten aus {ocr_file}")
-    return pages
+    logger.info(f"Extrahiert: {count} Seiten aus {ocr_file}")
+
+# Extrahiere Seiteninhalte aus einer OCR-Textdatei
+def extract_pages_from_ocr(ocr_file: str) -> Dict[int, str]:
+    # Format: {page_number: page_content}
+    return dict(stream_pages_from_ocr(ocr_file))
+
+# Vorkompilierte Muster für clean_lyrics
+# Copyright-Hinweise
+COPYRIGHT_PATTERN = re.compile(r'\s*[\u00A9\(c\)][^\n]+?(Copyright|Rights Reserved|Secured|Reproduced|permission)[^\n]+', re.IGNORECASE)
+# M + T: Autorennennungen
+AUTHOR_PATTERN = re.compile(r'\s*M\s*\+\s*T\s*:[^\n]+')
+# Grundtöne für die schnelle Vorprüfung auf Akkordzeilen
+CHORD_ROOTS = frozenset('ABCDEFG')
+
+# Anzahl Prozesse für die Bereinigung der Seiten eines Buchs
+CLEAN_WORKERS = int(os.environ.get("CLEAN_WORKERS", os.cpu_count() or 1))
 
-# Reinige Liedtext-Inhalte
-def clean_lyrics(text: str) -> Tuple[str, str]:
+# Reinige Liedtext-Inhalte, liefert Text, Akkorde und Akkordpositionen im Text
+def clean_lyrics(text: str) -> Tuple[str, str, str]:
     # Entferne Copyright-Hinweise
-    text = re.sub(r'\s*[\u00A9\(c\)][^\n]+?(Copyright|Rights Reserved|Secured|Reproduced|permission)[^\n]+', '', text, flags=re.IGNORECASE)
+    text = COPYRIGHT_PATTERN.sub('', text)
     
     # Entferne M + T: Autorennennungen
-    text = re.sub(r'\s*M\s*\+\s*T\s*:[^\n]+', '', text)
-    
-    # Extrahiere Akkorde
-    # Muster: Akkorde wie A, Am, G7, Dsus4, F#m, E7, usw.
-    chord_pattern = r'\b([A-G][#b]?(?:maj|min|m|sus|dim|aug|\+|\-|\d)?\d*(?:\/[A-G][#b]?)?)\b'
+    text = AUTHOR_PATTERN.sub('', text)
     
     # Finde Zeilen, die hauptsächlich aus Akkorden bestehen (z.B. "G Am C Am Em D G")
     chord_lines = []
     lines = text.split('\n')
     processed_lines = []
+    # Akkorde der letzten Akkordzeile, bis die nächste Textzeile darunter folgt
+    line_chords = []
+    pending = []
     
     for line in lines:
-        # Zähle die Akkorde in der Zeile
-        chords = re.findall(chord_pattern, line)
-        words = re.findall(r'\b\w+\b', line)
-        
-        # Wenn die Zeile hauptsächlich aus Akkorden besteht
-        if len(chords) > 0 and len(chords) / (len(words) + 0.1) > 0.7:
-            chord_lines.append(line.strip())
-            # Entferne diese Zeile aus dem Text
-            continue
+        # Ohne Grundton A-G kann die Zeile keine Akkorde enthalten
+        if not CHORD_ROOTS.isdisjoint(line):
+            # Zeile einmal in Akkorde und übrige Wörter zerlegen
+            chords = classify_line(line)
+            if chords is not None:
+                chord_lines.append(line.strip())
+                pending = chords
+                # Entferne diese Zeile aus dem Text
+                continue
         
         processed_lines.append(line)
+        if line.strip():
+            line_chords.append(pending)
+            pending = []
+        else:
+            line_chords.append([])
     
     # Kombiniere alle gefundenen Akkordzeilen
     chords = ' '.join(chord_lines)
     
-    # Bereinige den verbleibenden Text
-    cleaned_text = '\n'.join(processed_lines)
-    cleaned_text = re.sub(r'\s+', ' ', cleaned_text)
-    cleaned_text = re.sub(r'\n\s*\n', '\n', cleaned_text)
+    # Bereinige den verbleibenden Text (Leerraum zusammenfassen) und
+    # übertrage die Spalten der Akkorde auf Positionen im bereinigten Text
+    cleaned_text, positions = align_chords(processed_lines, line_chords)
     
-    return cleaned_text.strip(), chords.strip()
+    return cleaned_text, chords.strip(), format_chord_positions(positions)
 
-# Hauptfunktion zum Extrahieren und Zuordnen der Songtexte
-def update_song_lyrics():
-    # Lade Song-Seiten-Mapping und Song-Daten
-    songs_by_page, song_data = load_song_page_mapping()
-    updated_songs = 0
+# Hash eines Seiteninhalts als Schlüssel für den Bereinigungs-Cache
+def page_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+# Bereinige viele Seiten auf einmal: doppelte Seiten nur einmal, bekannte aus dem Cache
+# (Ergebnisse je Seiten-Hash, vom Aufrufer für die Dauer eines Laufs gehalten)
+def clean_lyrics_batch(texts: List[str], executor: Optional[Executor] = None,
+                       cache: Optional[Dict[str, Tuple[str, str, str]]] = None) -> List[Tuple[str, str, str]]:
+    if cache is None:
+        cache = {}
+    keys = [page_hash(text) for text in texts]
+    pending = {}
+    for key, text in zip(keys, texts):
+        if key not in cache:
+            pending.setdefault(key, text)
+    
+    if pending:
+        if executor is not None and len(pending) > 1:
+            chunksize = max(1, len(pending) // (4 * CLEAN_WORKERS))
+            cleaned = list(executor.map(clean_lyrics, pending.values(), chunksize=chunksize))
+        else:
+            cleaned = [clean_lyrics(text) for text in pending.values()]
+        cache.update(zip(pending.keys(), cleaned))
+    
+    return [cache[key] for key in keys]
+
+# Felder eines Songs, die im Lyrics-Store nur einmal je Inhalt abgelegt werden
+LYRICS_FIELDS = ("lyrics", "chords", "chord_positions")
+LYRICS_STORE_FORMAT = "lyrics-store-1"
+
+# Inhalts-Hash eines Songtexts samt Akkorden als Schlüssel im Lyrics-Store
+def lyrics_key(entry: dict) -> str:
+    content = '\0'.join(entry.get(field, "") for field in LYRICS_FIELDS)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()[:16]
+
+# Flache Songliste in den Lyrics-Store umwandeln: jeder Text einmal, Songs verweisen per "lyrics_ref"
+def build_lyrics_store(songs: List[dict]) -> dict:
+    lyrics = {}
+    store_songs = []
+    for song in songs:
+        entry = {field: song.get(field, "") for field in LYRICS_FIELDS}
+        stored = {key: value for key, value in song.items() if key not in LYRICS_FIELDS}
+        if entry["lyrics"]:
+            key = lyrics_key(entry)
+            if lyrics.setdefault(key, entry) != entry:
+                raise ValueError(f"Hash-Kollision im Lyrics-Store: {key}")
+            stored["lyrics_ref"] = key
+        else:
+            stored["lyrics_ref"] = None
+        store_songs.append(stored)
+    return {"format": LYRICS_STORE_FORMAT, "lyrics": lyrics, "songs": store_songs}
+
+# Lyrics-Store wieder in die flache Songliste auflösen (gleiche Feldreihenfolge wie zuvor)
+def expand_lyrics_store(store: dict) -> List[dict]:
+    empty = {field: "" for field in LYRICS_FIELDS}
+    songs = []
+    for stored in store["songs"]:
+        ref = stored.get("lyrics_ref")
+        entry = store["lyrics"][ref] if ref else empty
+        song = {}
+        for key, value in stored.items():
+            if key == "lyrics_ref":
+                continue
+            song[key] = value
+            # Textfelder folgen im flachen Format direkt auf den Interpreten
+            if key == "artist":
+                song.update(entry)
+        songs.append(song)
+    return songs
+
+# songs_with_lyrics.json lesen, egal ob flaches Format (Liste) oder Lyrics-Store
+def load_songs_with_lyrics(json_file: str) -> List[dict]:
+    with open(json_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return data
+    if data.get("format") != LYRICS_STORE_FORMAT:
+        raise ValueError(f"Unbekanntes Format in {json_file}: {data.get('format')}")
+    return expand_lyrics_store(data)
+
+# songs_with_lyrics.json schreiben, optional dedupliziert, und die Ersparnis melden
+def write_songs_with_lyrics(songs: List[dict], output_file: str, dedupe: bool = False) -> Tuple[int, int]:
+    if not dedupe:
+        # Song für Song schreiben, ohne die ganze Datei im Speicher aufzubauen
+        with open(output_file, 'wb') as f:
+            writer = JsonArrayWriter(f)
+            for song in songs:
+                writer.write(song)
+            writer.close()
+        return writer.bytes, writer.bytes
     
-    # Verarbeite jede OCR-Textdatei
+    flat_size = len(json.dumps(songs, indent=2, ensure_ascii=False).encode('utf-8'))
+    store = build_lyrics_store(songs)
+    deduped = json.dumps(store, indent=2, ensure_ascii=False)
+    deduped_size = len(deduped.encode('utf-8'))
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(deduped)
+    referenced = sum(1 for song in store["songs"] if song["lyrics_ref"])
+    logger.info(f"Lyrics-Store: {len(store['lyrics'])} verschiedene Texte für {referenced} Songs, "
+                f"{deduped_size / 1024:.0f} KB statt {flat_size / 1024:.0f} KB "
+                f"({(flat_size - deduped_size) / 1024:.0f} KB bzw. {100 * (1 - deduped_size / max(flat_size, 1)):.0f}% gespart)")
+    return flat_size, deduped_size
+
+SONGS_CSV_HEADER = "Künstler,Titel,Lyrics,Akkorde,Buch,Seite,Seite_Noten\n"
+
+# Felder der Import-CSV für einen Song, None für Songs ohne Text
+def songs_csv_fields(song: dict) -> Optional[list]:
+    if not song["lyrics"]:
+        return None
+    # Alle Felder in Anführungszeichen (csv.QUOTE_ALL), fehlende Seiten als ""
+    return [song["artist"], song["title"], song["lyrics"], song.get("chords", ""), song["book_id"],
+            song["book_page"], song["book_page_notes"]]
+
+# Zeile der Import-CSV für einen Song, None für Songs ohne Text
+def songs_csv_row(song: dict) -> Optional[str]:
+    fields = songs_csv_fields(song)
+    return csv_line(fields, csv.QUOTE_ALL) if fields is not None else None
+
+# CSV für den direkten Import schreiben (nur Songs mit Text)
+def write_songs_csv(songs: List[dict], csv_output: str) -> int:
+    written = 0
+    with open(csv_output, 'w', encoding='utf-8', newline='') as f:
+        # CSV-Header
+        f.write(SONGS_CSV_HEADER)
+        
+        # Schreibe Songs, das Quoting übernimmt der csv-Writer
+        writer = csv_writer(f, csv.QUOTE_ALL)
+        for song in songs:
+            fields = songs_csv_fields(song)
+            if fields is not None:
+                writer.writerow(fields)
+                written += 1
+    return written
+
+# Bereinigten Text einer OCR-Seite einem Song zuordnen
+def assign_page_lyrics(song: dict, cleaned: Tuple[str, str, str], page_num: int, book_id: str):
+    song["lyrics"], song["chords"], song["chord_positions"] = cleaned
+    # Seitenzahl und Buch nochmal explizit setzen (zur Sicherheit)
+    song["source_page"] = page_num
+    song["source_book"] = book_id
+
+# Seiten mit Songs je Buch als [(book_id, page_num, page_content), ...], ein Buch nach dem anderen
+def iter_book_pages(extracted_dir: str, songs_by_page: Dict[str, Dict[int, List[Tuple[str, str, str]]]]
+                    ) -> Iterator[List[Tuple[str, int, str]]]:
     for book_name, book_id in BOOK_MAPPING.items():
-        ocr_file = os.path.join(EXTRACTED_DIR, f"{book_name}.txt")
+        ocr_file = os.path.join(extracted_dir, f"{book_name}.txt")
         
         if not os.path.exists(ocr_file):
             logger.warning(f"OCR-Datei nicht gefunden: {ocr_file}")
             continue
         
-        # Extrahiere Seiteninhalte
-        pages = extract_pages_from_ocr(ocr_file)
-        
-        # Ordne Songtexte zu
-        for page_num, page_content in pages.items():
-            songs_on_page = songs_by_page.get(book_id, {}).get(page_num, [])
-            
-            if not songs_on_page:
-                # Keine Songs auf dieser Seite gefunden
-                continue
-            
-            logger.info(f"Gefunden: {len(songs_on_page)} Songs auf Seite {page_num} in Buch {book_id}")
-            
-            # Wenn mehrere Songs auf einer Seite sind, wird der Text allen zugeordnet
-            # In einer realen Anwendung würde man hier eine komplexere Logik implementieren
-            for song_id, title, artist in songs_on_page:
-                if song_id in song_data:
-                    cleaned_lyrics, chords = clean_lyrics(page_content)
-                    song_data[song_id]["lyrics"] = cleaned_lyrics
-                    song_data[song_id]["chords"] = chords
-                    # Seitenzahl und Buch nochmal explizit setzen (zur Sicherheit)
-                    song_data[song_id]["source_page"] = page_num
-                    song_data[song_id]["source_book"] = book_id
-                    updated_songs += 1
-                    logger.info(f"Songtext zugeordnet: '{title}' von '{artist}' (ID: {song_id})")
+        # Die Seiten werden nacheinander gelesen, behalten werden nur die mit Songs
+        with metrics.stage("read"):
+            book_pages = [(book_id, page_num, page_content)
+                          for page_num, page_content in stream_pages_from_ocr(ocr_file)
+                          if songs_by_page.get(book_id, {}).get(page_num)]
+        metrics.count("pages_with_songs", len(book_pages))
+        yield book_pages
+
+# Gruppen fast gleicher Seiten (Buch:Seite, erster Eintrag ist der Vertreter) mit ihren Songs speichern
+def write_duplicate_pages(groups: List[List[Tuple[str, int]]], songs_by_page: Dict[str, Dict[int, List[Tuple[str, str, str]]]],
+                          output_file: str):
+    report = []
+    for group in groups:
+        report.append({
+            "representative": f"{group[0][0]}:{group[0][1]}",
+            "pages": [{"book": book_id, "page": page_num,
+                       "songs": [song_id for song_id, _, _ in songs_by_page[book_id][page_num]]}
+                      for book_id, page_num in group],
+        })
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+# Hauptfunktion zum Extrahieren und Zuordnen der Songtexte
+def update_song_lyrics(csv_file: str = CSV_FILE, extracted_dir: str = EXTRACTED_DIR,
+                       output_dir: str = OUTPUT_DIR, workers: int = CLEAN_WORKERS, dedupe: bool = False,
+                       sqlite_file: Optional[str] = None, binary_file: Optional[str] = None,
+                       share_duplicates: bool = False, shard_dir: Optional[str] = None):
+    # Lade Song-Seiten-Mapping und Song-Daten
+    with metrics.stage("csv"):
+        songs_by_page, song_data = load_song_page_mapping(csv_file)
+    updated_songs = set()
     
-    # Speichere aktualisierte Songs in JSON
-    output_file = os.path.join(OUTPUT_DIR, "songs_with_lyrics.json")
-    try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(list(song_data.values()), f, indent=2, ensure_ascii=False)
-        logger.info(f"Song-Daten mit Texten gespeichert in: {output_file}")
-    except Exception as e:
-        logger.error(f"Fehler beim Speichern der Song-Daten: {e}")
+    # Buch für Buch lesen, bereinigen und zuordnen
+    book_batches = iter_book_pages(extracted_dir, songs_by_page)
+    
+    # Dasselbe Lied in mehreren Büchern: fast gleiche Seiten nur einmal bereinigen,
+    # alle Seiten einer Gruppe bekommen den Text des Vertreters. Dafür werden die
+    # Seiten aller Bücher gesammelt und in einem Durchgang verarbeitet.
+    representative = {}
+    if share_duplicates:
+        all_pages = [page for book_pages in book_batches for page in book_pages]
+        book_batches = [all_pages]
+        with metrics.stage("dedup"):
+            groups = group_similar_pages([((book_id, page_num), page_content)
+                                          for book_id, page_num, page_content in all_pages])
+        for group in groups:
+            for key in group[1:]:
+                representative[key] = group[0]
+        metrics.count("pages_shared", len(representative))
+        report_file = os.path.join(output_dir, "duplicate_pages.json")
+        write_duplicate_pages(groups, songs_by_page, report_file)
+        logger.info(f"{len(groups)} Gruppen gleicher Seiten, {len(representative)} Seiten übernommen: {report_file}")
     
-    # Erstelle auch eine CSV-Datei für den direkten Import
-    csv_output = os.path.join(OUTPUT_DIR, 'songs_with_lyrics.csv')
+    # Bereinigte Seiten dieses Aufrufs je Seiten-Hash
+    clean_cache = {}
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
     try:
-        with open(csv_output, 'w', encoding='utf-8') as f:
-            # CSV-Header
-            f.write("Künstler,Titel,Lyrics,Akkorde,Buch,Seite,Seite_Noten\n")
+        for book_pages in book_batches:
+            # Jede Seite wird nur einmal bereinigt, parallel über die Seiten des Buchs
+            to_clean = [((book_id, page_num), page_content) for book_id, page_num, page_content in book_pages
+                        if (book_id, page_num) not in representative]
+            with metrics.stage("clean"):
+                cleaned_pages = dict(zip((key for key, _ in to_clean),
+                                         clean_lyrics_batch([page_content for _, page_content in to_clean], executor,
+                                                            clean_cache)))
             
-            # Schreibe Songs
-            for song in song_data.values():
-                if song["lyrics"]:
-                    artist = song["artist"].replace('"', '""')  # Escape Anführungszeichen
-                    title = song["title"].replace('"', '""')
-                    lyrics = song["lyrics"].replace('"', '""')
-                    chords = song.get("chords", "").replace('"', '""')
-                    book_id = song["book_id"]
-                    page = song["book_page"] if song["book_page"] is not None else ""
-                    page_notes = song["book_page_notes"] if song["book_page_notes"] is not None else ""
-                    f.write(f'"{artist}","{title}","{lyrics}","{chords}","{book_id}","{page}","{page_notes}"\n')
-        logger.info(f"CSV für Import erstellt: {csv_output}")
-    except Exception as e:
-        logger.error(f"Fehler beim Erstellen der CSV-Datei: {e}")
+            # Ordne Songtexte zu
+            with metrics.stage("match"):
+                for book_id, page_num, _ in book_pages:
+                    source = representative.get((book_id, page_num))
+                    cleaned = cleaned_pages[source or (book_id, page_num)]
+                    songs_on_page = songs_by_page[book_id][page_num]
+                    metrics.log_sampled(logger, "page", "Gefunden: %d Songs auf Seite %d in Buch %s",
+                                        len(songs_on_page), page_num, book_id)
+                    
+                    # Wenn mehrere Songs auf einer Seite sind, wird der Text allen zugeordnet
+                    # In einer realen Anwendung würde man hier eine komplexere Logik implementieren
+                    for song_id, title, artist in songs_on_page:
+                        if song_id in song_data:
+                            assign_page_lyrics(song_data[song_id], cleaned, page_num, book_id)
+                            if source:
+                                song_data[song_id]["lyrics_group"] = f"{source[0]}:{source[1]}"
+                            updated_songs.add(song_id)
+                            metrics.log_sampled(logger, "song", "Songtext zugeordnet: '%s' von '%s' (ID: %s)",
+                                                title, artist, song_id)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    metrics.count("distinct_pages_cleaned", len(clean_cache))
+    metrics.count("songs_updated", len(updated_songs))
+    
+    with metrics.stage("export"):
+        # Speichere aktualisierte Songs in JSON
+        output_file = os.path.join(output_dir, "songs_with_lyrics.json")
+        try:
+            write_songs_with_lyrics(list(song_data.values()), output_file, dedupe)
+            logger.info(f"Song-Daten mit Texten gespeichert in: {output_file}")
+        except Exception as e:
+            logger.error(f"Fehler beim Speichern der Song-Daten: {e}")
+        
+        # Erstelle auch eine CSV-Datei für den direkten Import
+        csv_output = os.path.join(output_dir, 'songs_with_lyrics.csv')
+        try:
+            write_songs_csv(list(song_data.values()), csv_output)
+            logger.info(f"CSV für Import erstellt: {csv_output}")
+        except Exception as e:
+            logger.error(f"Fehler beim Erstellen der CSV-Datei: {e}")
+        
+        # Alphabetische Titelliste und Gruppierung nach Buch und Interpret
+        try:
+            write_catalog_index(song_data, os.path.join(output_dir, CATALOG_INDEX_FILE))
+        except Exception as e:
+            logger.error(f"Fehler beim Erstellen des Katalogindex: {e}")
+        
+        # Ein NDJSON-Shard je Buch mit Manifest, damit ein Buch allein geladen werden kann
+        if shard_dir:
+            try:
+                with ShardedSongWriter(shard_dir) as shards:
+                    shards.write_many(song_data.values())
+                logger.info(f"NDJSON je Buch gespeichert in: {shard_dir}")
+            except Exception as e:
+                logger.error(f"Fehler beim Schreiben der Shards: {e}")
     
-    return updated_songs
+    # Fertige SQLite-Datenbank für die App
+    if sqlite_file:
+        with metrics.stage("export_sqlite"):
+            try:
+                write_lyrics_db(song_data, sqlite_file)
+            except Exception as e:
+                logger.error(f"Fehler beim Erstellen der SQLite-Datenbank: {e}")
+    
+    # Binärkatalog zum Memory-Mapping, Texte komprimiert
+    if binary_file:
+        with metrics.stage("export_binary"):
+            try:
+                write_binary_catalog(list(song_data.values()), binary_file)
+            except Exception as e:
+                logger.error(f"Fehler beim Erstellen des Binärkatalogs: {e}")
+    
+    return len(updated_songs)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Songtexte aus den OCR-Dateien den Songs aus data.csv zuordnen")
+    parser.add_argument("--csv", default=CSV_FILE, help="Song-Katalog (data.csv)")
+    parser.add_argument("--extracted-dir", default=EXTRACTED_DIR, help="Verzeichnis mit den OCR-Textdateien")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Zielverzeichnis für JSON und CSV")
+    parser.add_argument("--workers", type=int, default=CLEAN_WORKERS, help="Prozesse für die Bereinigung")
+    parser.add_argument("--dedupe", action="store_true", help="Jeden Songtext nur einmal speichern (Lyrics-Store), Songs verweisen per Hash")
+    parser.add_argument("--sqlite", metavar="DB", help="Zusätzlich eine SQLite-Datenbank mit Suchindex schreiben")
+    parser.add_argument("--binary", metavar="FILE", help="Zusätzlich einen Binärkatalog (binary_catalog.py) schreiben")
+    parser.add_argument("--shards", metavar="DIR", help="Zusätzlich ein NDJSON je Buch mit Manifest hier ablegen")
+    parser.add_argument("--share-duplicates", action="store_true",
+                        help="Fast gleiche Seiten mehrerer Bücher nur einmal bereinigen (Bericht in duplicate_pages.json)")
+    parser.add_argument("--benchmark-csv", metavar="CSV", nargs="?", const=CSV_FILE, help="Nur den CSV-Loader messen")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    
+    if args.benchmark_csv:
+        benchmark_csv_loader(args.benchmark_csv)
+        raise SystemExit(0)
+    
     logger.info("Starte Aktualisierung der Songtexte...")
-    updated = update_song_lyrics()
+    metrics.start(args)
+    updated = update_song_lyrics(args.csv, args.extracted_dir, args.output_dir, args.workers, args.dedupe, args.sqlite, args.binary,
+                                 args.share_duplicates, args.shards)
     logger.info(f"Fertig! {updated} Songtexte wurden aktualisiert.")
+    metrics.finish(args, logger)